@@ -1,7 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Profile, Attendance, LeaveRequest, Payroll, Evaluation, Notification
+from .models import Profile, Attendance, AttendanceArchive, AttendanceSummary, LeaveBalance, LeaveRequest, Payroll, PayrollRollup, PayrollRun, ReportJob, Evaluation, Notification, UnreadCounter
+from .timekeeping import recompute_attendance
 
 # Inline لإظهار Profile عند User
 class ProfileInline(admin.StackedInline):
@@ -18,8 +19,31 @@ admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 
 # تسجيل باقي النماذج
-admin.site.register(Attendance)
+@admin.register(Attendance)
+class AttendanceAdmin(admin.ModelAdmin):
+    list_display = ('employee', 'date', 'check_in', 'check_out', 'hours_worked', 'status')
+    list_filter = ('status', 'date')
+    actions = ('recompute_hours', 'recompute_hours_and_status')
+
+    @admin.action(description='إعادة حساب ساعات العمل')
+    def recompute_hours(self, request, queryset):
+        updated = recompute_attendance(queryset)
+        self.message_user(request, f'تمت إعادة حساب {updated} سجل.', messages.SUCCESS)
+
+    @admin.action(description='إعادة حساب ساعات العمل وحالة التأخير')
+    def recompute_hours_and_status(self, request, queryset):
+        updated = recompute_attendance(queryset, late_after='')
+        self.message_user(request, f'تمت إعادة حساب {updated} سجل.', messages.SUCCESS)
+
+
+admin.site.register(AttendanceArchive)
+admin.site.register(AttendanceSummary)
 admin.site.register(LeaveRequest)
+admin.site.register(LeaveBalance)
 admin.site.register(Payroll)
+admin.site.register(PayrollRun)
+admin.site.register(PayrollRollup)
+admin.site.register(ReportJob)
 admin.site.register(Evaluation)
 admin.site.register(Notification)
+admin.site.register(UnreadCounter)
@@ -0,0 +1,129 @@
+# hr_app/attendance_analytics.py
+"""
+تحليلات الحضور لمدير الموارد البشرية: نسب التأخير، متوسط ساعات العمل وخريطة أوقات
+الدخول حسب يوم الأسبوع والساعة، محسوبة بمصفوفات NumPy بدلاً من المرور على السجلات.
+"""
+
+import threading
+
+import numpy as np
+from .models import Attendance, AttendanceArchive
+from .versions import ATTENDANCE, data_version
+
+# ترتيب weekday() في بايثون: 0 = الاثنين
+WEEKDAYS = ('الاثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت', 'الأحد')
+STATUS_CODES = {'Present': 0, 'Absent': 1, 'Late': 2}
+
+# آخر النتائج المحسوبة، مفتاحها (القسم، السنة، الشهر) وتُستبدل عند تغير بيانات الحضور
+_results = {}
+_results_lock = threading.Lock()
+MAX_RESULTS = 32
+
+
+class AttendanceSnapshot:
+    """
+    Attendance columns of one scope loaded into NumPy arrays.
+
+    `check_in_minutes` and `hours` are float64 with NaN where the value is
+    missing; `department_codes[i]` indexes into `departments` for row i.
+    """
+
+    def __init__(self, rows):
+        days, check_ins, check_outs, statuses, departments = zip(*rows) if rows else ((),) * 5
+        self.departments, codes = np.unique(np.array([d or '' for d in departments], dtype=object), return_inverse=True)
+        self.department_codes = codes.astype(np.int64)
+        self.weekdays = np.array([day.weekday() for day in days], dtype=np.int64)
+        self.status_codes = np.array([STATUS_CODES.get(status, 0) for status in statuses], dtype=np.int64)
+        self.check_in_minutes = np.array(
+            [t.hour * 60 + t.minute if t else np.nan for t in check_ins], dtype=np.float64
+        )
+        check_out_minutes = np.array(
+            [t.hour * 60 + t.minute if t else np.nan for t in check_outs], dtype=np.float64
+        )
+        self.hours = (check_out_minutes - self.check_in_minutes) / 60
+
+    @classmethod
+    def load(cls, department=None, year=None, month=None):
+        """Read only the needed columns from the live and archive tables."""
+        columns = ('date', 'check_in', 'check_out', 'status', 'employee__department')
+        rows = []
+        for model in (Attendance, AttendanceArchive):
+            rows.extend(_scope(model.objects.all(), department, year, month).values_list(*columns))
+        return cls(rows)
+
+
+def _scope(qs, department=None, year=None, month=None):
+    if department:
+        qs = qs.filter(employee__department=department)
+    if year is not None:
+        qs = qs.filter(date__year=year)
+    if month is not None:
+        qs = qs.filter(date__month=month)
+    return qs
+
+
+def _summarize(snapshot, mask):
+    """Lateness, absence, average hours and the 7x24 check-in heatmap of the rows in `mask`."""
+    statuses = snapshot.status_codes[mask]
+    total = len(statuses)
+    late = int(np.count_nonzero(statuses == STATUS_CODES['Late']))
+    absent = int(np.count_nonzero(statuses == STATUS_CODES['Absent']))
+    attended = total - absent
+
+    hours = snapshot.hours[mask]
+    hours = hours[~np.isnan(hours)]
+    check_ins = snapshot.check_in_minutes[mask]
+    has_check_in = ~np.isnan(check_ins)
+    # كل خلية = عدد مرات الدخول في (يوم الأسبوع، الساعة)
+    cells = snapshot.weekdays[mask][has_check_in] * 24 + (check_ins[has_check_in] // 60).astype(np.int64)
+    heatmap = np.bincount(cells, minlength=7 * 24).reshape(7, 24)
+
+    return {
+        'records': total,
+        'late': late,
+        'absent': absent,
+        'lateness_rate': round(late / attended * 100, 2) if attended else None,
+        'absence_rate': round(absent / total * 100, 2) if total else None,
+        'average_hours': round(float(hours.mean()), 2) if len(hours) else None,
+        'average_check_in': _format_minutes(check_ins[has_check_in].mean()) if has_check_in.any() else None,
+        'heatmap': heatmap.tolist(),
+    }
+
+
+def _format_minutes(minutes):
+    minutes = int(round(float(minutes)))
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def compute_analytics(snapshot):
+    """Per-department and company-wide analytics of a snapshot."""
+    return {
+        'weekdays': WEEKDAYS,
+        'departments': {
+            (name or 'بدون قسم'): _summarize(snapshot, snapshot.department_codes == code)
+            for code, name in enumerate(snapshot.departments)
+        },
+        'company': _summarize(snapshot, slice(None)),
+    }
+
+
+def get_attendance_analytics(department=None, year=None, month=None):
+    """
+    Return the analytics of the scope, recomputing them only if the attendance data changed.
+
+    The cache is checked against the attendance data version, which every write
+    path bumps (including a check-in alone, which leaves the monthly summary
+    unchanged), so a check costs one primary-key lookup.
+    """
+    key = (department or None, year, month)
+    version = data_version(ATTENDANCE)
+    with _results_lock:
+        cached = _results.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+    result = compute_analytics(AttendanceSnapshot.load(*key))
+    with _results_lock:
+        if len(_results) >= MAX_RESULTS:
+            _results.pop(next(iter(_results)))
+        _results[key] = (version, result)
+    return result
@@ -1,4 +1,8 @@
-from .models import Profile, Message
+from django.utils.functional import SimpleLazyObject
+
+from .messaging import unread_counts
+from .models import Profile
+
 
 def user_profile(request):
     """
@@ -6,22 +10,23 @@ def user_profile(request):
     RelatedObjectDoesNotExist. If the user is authenticated and doesn't have
     a Profile yet, create a default Employee profile (so templates that use
     `user.profile` won't crash).
+
+    The unread counters are lazy: they are read from the user's counter row
+    only if the rendered template actually shows a badge.
     """
     context = {}
     user = getattr(request, 'user', None)
     if user and user.is_authenticated:
         try:
-            # Try to access related profile; create if missing
-            profile = Profile.objects.get(user=user)
+            # Reuse the profile cached on request.user when a view already loaded it
+            profile = user.profile
         except Profile.DoesNotExist:
             profile = Profile.objects.create(user=user, user_type='Employee')
-        # Attach to user object for template convenience (lives only for this request)
-        setattr(user, 'profile', profile)
+            # Attach to user object for template convenience (lives only for this request)
+            user.profile = profile
         context['profile'] = profile
-        # عدد الرسائل غير المقروءة للمستخدم الحالي
-        try:
-            unread = Message.objects.filter(recipient=user, is_read=False).count()
-        except Exception:
-            unread = 0
-        context['unread_messages_count'] = unread
+        # عدد الرسائل والإشعارات غير المقروءة: استعلام واحد عند أول استخدام فقط
+        counts = SimpleLazyObject(lambda: unread_counts(user.pk))
+        context['unread_messages_count'] = SimpleLazyObject(lambda: counts[0])
+        context['unread_notifications_count'] = SimpleLazyObject(lambda: counts[1])
     return context
@@ -0,0 +1,113 @@
+# hr_app/events.py
+"""
+دفع الإشعارات والرسائل الجديدة للمستخدمين المتصلين لحظياً (Server-Sent Events)
+بدلاً من إعادة تحميل الصفحة.
+
+الوسيط الافتراضي يعمل داخل العملية نفسها: كل اتصال مفتوح له طابور asyncio، والنشر
+من أي خيط (مثل الـ views المتزامنة) يصل إلى اتصالات هذه العملية فقط. عند التشغيل
+على أكثر من عملية يمكن استبداله بوسيط محلي (مثل Redis pub/sub) يطبّق نفس الواجهة
+subscribe / publish ويُحدد في الإعداد EVENT_BROKER.
+"""
+
+import asyncio
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """One open event stream: an asyncio queue bound to the loop that serves it."""
+
+    def __init__(self, broker, user_id, queue_size):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, event):
+        # يُستدعى داخل حلقة الاتصال؛ العميل البطيء يفقد الأحداث الزائدة بدلاً من حجز الذاكرة
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout=None):
+        """Wait for the next event; raises asyncio.TimeoutError after `timeout` seconds."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Publish/subscribe between the threads and event loops of one process.
+
+    `publish` is thread-safe and never blocks: events are handed to each
+    subscriber's loop with call_soon_threadsafe. Users without an open stream
+    in this process cost one dict lookup.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Open a subscription for `user_id`; must be called from the stream's event loop."""
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_ids, event):
+        """Send `event` (a JSON-serializable dict) to the open streams of `user_ids`."""
+        with self._lock:
+            targets = [s for user_id in user_ids for s in self._subscribers.get(user_id, ())]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # الحلقة أُغلقت قبل أن يُلغى الاشتراك
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker, built from settings.EVENT_BROKER."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENT_BROKER)(queue_size=settings.EVENT_STREAM_QUEUE_SIZE)
+        return _broker
+
+
+def publish_on_commit(user_ids, event):
+    """Publish `event` once the current transaction commits, so nobody sees rolled back rows."""
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: get_broker().publish(user_ids, event))
+
+
+def publish_each_on_commit(events):
+    """Like publish_on_commit for a list of (user_id, event) pairs with different events."""
+    events = list(events)
+    if events:
+        def publish():
+            broker = get_broker()
+            for user_id, event in events:
+                broker.publish([user_id], event)
+        transaction.on_commit(publish)
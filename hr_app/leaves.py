@@ -0,0 +1,305 @@
+# hr_app/leaves.py
+"""
+خدمات الإجازات: التحقق من التواريخ، كشف تداخل الطلبات مع الإجازات والحضور السابق،
+معرفة من هو في إجازة من نفس القسم عند الموافقة، دفتر أرصدة الإجازات السنوية،
+واتخاذ قرار القبول أو الرفض لعدة طلبات دفعة واحدة.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_date
+
+from .messaging import save_notifications
+from .models import Attendance, LeaveBalance, LeaveRequest, Notification, Profile
+
+
+# الطلبات التي تحجز أيام الإجازة (المرفوض لا يمنع طلباً جديداً)
+ACTIVE_LEAVE_STATUSES = ('Pending', 'Approved')
+
+DECISION_MESSAGES = {
+    'Approved': 'تم قبول طلب إجازتك ({leave_type}) من {start} إلى {end}.',
+    'Rejected': 'تم رفض طلب إجازتك ({leave_type}) من {start} إلى {end}.',
+}
+
+
+def validate_leave_dates(start_date, end_date):
+    """Return (start, end) as dates, raising ValueError for a missing or reversed range."""
+    start = parse_date(start_date) if isinstance(start_date, str) else start_date
+    end = parse_date(end_date) if isinstance(end_date, str) else end_date
+    if start is None or end is None:
+        raise ValueError('تاريخ البداية والنهاية مطلوبان بصيغة صحيحة.')
+    if end < start:
+        raise ValueError('تاريخ النهاية يجب أن يكون بعد تاريخ البداية.')
+    return start, end
+
+
+def overlapping(qs, start, end):
+    """Leave requests of `qs` whose [start_date, end_date] intersects [start, end]."""
+    return qs.filter(start_date__lte=end, end_date__gte=start)
+
+
+def employee_leave_conflicts(employee_id, start, end, exclude_id=None):
+    """
+    Pending or approved requests of the employee that overlap [start, end].
+
+    Served by the (employee, start_date, end_date) index: one range scan over
+    the employee's own requests, whatever the size of the table.
+    """
+    qs = overlapping(
+        LeaveRequest.objects.filter(employee_id=employee_id, status__in=ACTIVE_LEAVE_STATUSES), start, end
+    )
+    if exclude_id is not None:
+        qs = qs.exclude(id=exclude_id)
+    return qs.order_by('start_date')
+
+
+def attended_days(employee_id, start, end):
+    """Days in [start, end] on which the employee already has a non-absent attendance row."""
+    return list(
+        Attendance.objects
+        .filter(employee_id=employee_id, date__range=(start, end))
+        .exclude(status='Absent')
+        .order_by('date')
+        .values_list('date', flat=True)
+    )
+
+
+def department_out(department, start, end, exclude_employee_id=None):
+    """
+    Approved leaves in `department` overlapping [start, end] ("who is out").
+
+    Uses the (status, end_date, start_date) index to read only approved
+    leaves that have not ended before `start`, then joins the department.
+    """
+    qs = overlapping(
+        LeaveRequest.objects.filter(status='Approved', employee__department=department), start, end
+    )
+    if exclude_employee_id is not None:
+        qs = qs.exclude(employee_id=exclude_employee_id)
+    return qs.select_related('employee__user').order_by('start_date')
+
+
+# ----------------------------
+# دفتر أرصدة الإجازات
+# ----------------------------
+
+def leave_days_by_year(start, end):
+    """Calendar days of [start, end] per year, e.g. {2024: 3, 2025: 2} for a leave over new year."""
+    days = {}
+    while start <= end:
+        year_end = min(end, date(start.year, 12, 31))
+        days[start.year] = (year_end - start).days + 1
+        start = year_end + timedelta(days=1)
+    return days
+
+
+def _apply_leave_to_balance(leave, sign):
+    """Add (sign=1) or give back (sign=-1) the days of an approved leave in the ledger."""
+    for year, days in leave_days_by_year(leave.start_date, leave.end_date).items():
+        balance, _ = LeaveBalance.objects.get_or_create(
+            employee_id=leave.employee_id, leave_type=leave.leave_type, year=year,
+            defaults={'entitled_days': settings.LEAVE_ENTITLEMENTS.get(leave.leave_type, 0)},
+        )
+        LeaveBalance.objects.filter(pk=balance.pk).update(used_days=F('used_days') + sign * days)
+
+
+def _lock_employees(employee_ids):
+    # قفل صفوف الموظفين يجعل قبول طلبين متداخلين لنفس الموظف في نفس اللحظة يتم بالتتابع،
+    # فيرى الثاني قبول الأول عند التحقق من التعارض
+    list(Profile.objects.select_for_update().filter(pk__in=employee_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def set_leave_status(leave_id, status, user=None):
+    """
+    Move a leave request to `status` and update the balance ledger in the same transaction.
+
+    The request row is locked first, so a double click or two managers acting
+    at once apply the change only once. An approval also locks the employee
+    and raises ValueError if another approved leave overlaps, so two
+    overlapping requests can never both be approved. Approving consumes the
+    days; rejecting an already approved leave gives them back. Returns
+    (leave, changed).
+    """
+    with transaction.atomic():
+        leave = LeaveRequest.objects.select_for_update().get(id=leave_id)
+        if leave.status == status:
+            return leave, False
+        if status == 'Approved':
+            _lock_employees([leave.employee_id])
+            conflicts = employee_leave_conflicts(leave.employee_id, leave.start_date, leave.end_date, exclude_id=leave.id)
+            if conflicts.filter(status='Approved').exists():
+                raise ValueError('لا يمكن القبول: الموظف لديه إجازة مقبولة في نفس الفترة.')
+        if leave.status == 'Approved':
+            _apply_leave_to_balance(leave, -1)
+        if status == 'Approved':
+            _apply_leave_to_balance(leave, 1)
+        leave.status = status
+        leave.approved_by = user
+        leave.save(update_fields=['status', 'approved_by'])
+        if status in DECISION_MESSAGES:
+            save_notifications([decision_notification(leave, status)])
+    return leave, True
+
+
+def decision_notification(leave, status):
+    """Unsaved notification telling the employee about the decision on `leave`."""
+    return Notification(
+        user_id=leave.employee.user_id,
+        message=DECISION_MESSAGES[status].format(
+            leave_type=leave.get_leave_type_display(), start=leave.start_date, end=leave.end_date,
+        ),
+    )
+
+
+def leave_balances(employee_id, year):
+    """
+    The employee's balance for every leave type in `year`, read with one indexed query.
+
+    Types without a ledger row yet show the full entitlement. Returns a list of
+    {'leave_type', 'label', 'entitled_days', 'used_days', 'remaining_days'}.
+    """
+    rows = {
+        row.leave_type: row
+        for row in LeaveBalance.objects.filter(employee_id=employee_id, year=year)
+    }
+    balances = []
+    for leave_type, label in LeaveRequest.LEAVE_TYPES:
+        row = rows.get(leave_type)
+        entitled = row.entitled_days if row else settings.LEAVE_ENTITLEMENTS.get(leave_type, 0)
+        used = row.used_days if row else 0
+        balances.append({
+            'leave_type': leave_type,
+            'label': label,
+            'entitled_days': entitled,
+            'used_days': used,
+            'remaining_days': entitled - used,
+        })
+    return balances
+
+
+def rebuild_leave_balances(year=None):
+    """
+    Recompute used_days from the approved leave requests (all years, or one).
+
+    Entitlements already in the ledger are kept; new rows get the default
+    entitlement. Returns the number of ledger rows written.
+    """
+    approved = LeaveRequest.objects.filter(status='Approved')
+    if year is not None:
+        approved = approved.filter(start_date__lte=date(year, 12, 31), end_date__gte=date(year, 1, 1))
+
+    used = {}
+    for employee_id, leave_type, start, end in approved.values_list('employee_id', 'leave_type', 'start_date', 'end_date').iterator():
+        for leave_year, days in leave_days_by_year(start, end).items():
+            if year is None or leave_year == year:
+                key = (employee_id, leave_type, leave_year)
+                used[key] = used.get(key, 0) + days
+
+    balances = LeaveBalance.objects.all() if year is None else LeaveBalance.objects.filter(year=year)
+    with transaction.atomic():
+        existing = {(b.employee_id, b.leave_type, b.year): b for b in balances.select_for_update()}
+        for key, balance in existing.items():
+            balance.used_days = used.pop(key, 0)
+        LeaveBalance.objects.bulk_update(existing.values(), ['used_days'], batch_size=1000)
+        LeaveBalance.objects.bulk_create([
+            LeaveBalance(
+                employee_id=employee_id, leave_type=leave_type, year=leave_year, used_days=days,
+                entitled_days=settings.LEAVE_ENTITLEMENTS.get(leave_type, 0),
+            )
+            for (employee_id, leave_type, leave_year), days in used.items()
+        ], batch_size=1000)
+    return len(existing) + len(used)
+
+
+# ----------------------------
+# القرار الجماعي على الطلبات
+# ----------------------------
+
+def _consume_balances(leaves):
+    """Add the days of newly approved `leaves` to the ledger: one locked read and one bulk write."""
+    days = {}
+    for leave in leaves:
+        for year, count in leave_days_by_year(leave.start_date, leave.end_date).items():
+            key = (leave.employee_id, leave.leave_type, year)
+            days[key] = days.get(key, 0) + count
+    if not days:
+        return
+
+    employee_ids = {key[0] for key in days}
+    years = {key[2] for key in days}
+    existing = {
+        (b.employee_id, b.leave_type, b.year): b
+        for b in LeaveBalance.objects.select_for_update().filter(employee_id__in=employee_ids, year__in=years)
+    }
+    for key, balance in existing.items():
+        balance.used_days += days.pop(key, 0)
+    LeaveBalance.objects.bulk_update(existing.values(), ['used_days'], batch_size=1000)
+    LeaveBalance.objects.bulk_create([
+        LeaveBalance(
+            employee_id=employee_id, leave_type=leave_type, year=year, used_days=count,
+            entitled_days=settings.LEAVE_ENTITLEMENTS.get(leave_type, 0),
+        )
+        for (employee_id, leave_type, year), count in days.items()
+    ], batch_size=1000)
+
+
+def decide_leaves(leave_ids, status, user=None):
+    """
+    Approve or reject many pending leave requests at once.
+
+    The pending rows are locked and changed with one UPDATE; the ledger and
+    the employees' notifications are written in bulk in the same transaction.
+    An approval is refused when the employee already has an approved leave
+    overlapping it (including one approved earlier in the same batch).
+
+    Returns {leave_id: result} where result is the new status, 'not_found',
+    'already_decided' or 'conflict'.
+    """
+    if status not in DECISION_MESSAGES:
+        raise ValueError('القرار يجب أن يكون قبول أو رفض.')
+    leave_ids = list(dict.fromkeys(leave_ids))
+    results = dict.fromkeys(leave_ids, 'not_found')
+
+    with transaction.atomic():
+        leaves = list(
+            LeaveRequest.objects.select_for_update(of=('self',)).select_related('employee')
+            .filter(id__in=leave_ids).order_by('start_date', 'id')
+        )
+        pending = []
+        for leave in leaves:
+            if leave.status == 'Pending':
+                pending.append(leave)
+            else:
+                results[leave.id] = 'already_decided'
+
+        if status == 'Approved' and pending:
+            _lock_employees({l.employee_id for l in pending})
+            # الإجازات المقبولة لنفس الموظفين خلال الفترة كلها في استعلام واحد
+            booked = {}
+            approved = overlapping(
+                LeaveRequest.objects.filter(status='Approved', employee_id__in={l.employee_id for l in pending}),
+                min(l.start_date for l in pending), max(l.end_date for l in pending),
+            )
+            for employee_id, start, end in approved.values_list('employee_id', 'start_date', 'end_date'):
+                booked.setdefault(employee_id, []).append((start, end))
+            accepted = []
+            for leave in pending:
+                periods = booked.setdefault(leave.employee_id, [])
+                if any(start <= leave.end_date and end >= leave.start_date for start, end in periods):
+                    results[leave.id] = 'conflict'
+                    continue
+                periods.append((leave.start_date, leave.end_date))
+                accepted.append(leave)
+            pending = accepted
+
+        if pending:
+            LeaveRequest.objects.filter(id__in=[l.id for l in pending]).update(status=status, approved_by=user)
+            if status == 'Approved':
+                _consume_balances(pending)
+            save_notifications([decision_notification(l, status) for l in pending])
+            for leave in pending:
+                results[leave.id] = status
+    return results
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hr_app.payroll import adjust_salaries, validate_period
+
+
+class Command(BaseCommand):
+    help = "Raises or cuts a salary field for many payroll rows with a single UPDATE statement."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--field', default='base_salary', choices=['base_salary', 'bonuses', 'deductions'])
+        parser.add_argument('--percent', default=None, help='Percentage change, e.g. 7 for +7%%.')
+        parser.add_argument('--amount', default=None, help='Flat change added to every row.')
+        parser.add_argument('--department', default=None)
+        parser.add_argument('--year', type=int, default=None)
+        parser.add_argument('--month', type=int, default=None)
+        parser.add_argument('--all-periods', action='store_true', help='Adjust every period when no --year/--month is given.')
+
+    def handle(self, *args, **options):
+        year, month = options['year'], options['month']
+        try:
+            if year is not None or month is not None:
+                year, month = validate_period(year, month)
+            updated = adjust_salaries(
+                field=options['field'],
+                percent=options['percent'],
+                amount=options['amount'],
+                year=year,
+                month=month,
+                department=options['department'],
+                all_periods=options['all_periods'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Adjusted {updated} payroll rows.'))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hr_app.timekeeping import archive_attendance, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves attendance rows older than ATTENDANCE_ARCHIVE_AFTER_DAYS into the archive table, "
+        "in batches. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ATTENDANCE_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches.')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        moved = archive_attendance(cutoff, batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} attendance rows dated before {cutoff}.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hr_app.payroll import validate_period
+from hr_app.reports import payslip_rows, stream_payslips_zip
+
+
+class Command(BaseCommand):
+    help = "Renders one payslip PDF per payroll row of a month into a ZIP file and reports throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, required=True)
+        parser.add_argument('--month', type=int, required=True)
+        parser.add_argument('--department', default=None)
+        parser.add_argument('--output', required=True, help='Path of the ZIP file to write.')
+
+    def handle(self, *args, **options):
+        try:
+            year, month = validate_period(options['year'], options['month'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        stats = {}
+        with open(options['output'], 'wb') as f:
+            for chunk in stream_payslips_zip(payslip_rows(year, month, options['department']), stats):
+                f.write(chunk)
+
+        self.stdout.write(
+            f"{stats['rendered']} payslips ({stats['failed']} failed) in {stats['seconds']} s, "
+            f"{stats['payslips_per_second']} payslips/s."
+        )
+        self.stdout.write(self.style.SUCCESS(f"Payslips written to {options['output']}."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hr_app.payroll_import import import_payroll_file
+
+
+class Command(BaseCommand):
+    help = "Imports payroll rows from a CSV or XLSX file and prints a per-row error report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file to import.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, 'rb') as f:
+                report = import_payroll_file(f, path, batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for line_number, error in report['errors']:
+            self.stderr.write(f'line {line_number}: {error}')
+        self.stdout.write(
+            f"{report['rows']} rows, {report['created']} created, "
+            f"{report['failed']} failed in {report['seconds']} s."
+        )
+        self.stdout.write(self.style.SUCCESS('Payroll import completed.'))
@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from hr_app.timekeeping import mark_absences
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks employees with no attendance and no approved leave as Absent. "
+        "Defaults to yesterday; use --from/--to to backfill a date range."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Single day to process (YYYY-MM-DD). Defaults to yesterday.')
+        parser.add_argument('--from', dest='date_from', help='First day of a backfill range (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', help='Last day of a backfill range (YYYY-MM-DD). Defaults to yesterday.')
+        parser.add_argument(
+            '--skip-weekday', type=int, action='append', default=[], choices=range(7),
+            help='Weekday to skip (0=Monday ... 6=Sunday). Can be repeated.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def _parse(self, value, name):
+        try:
+            day = parse_date(value)
+        except ValueError:
+            # صيغة صحيحة لكن التاريخ غير موجود، مثل 2025-02-30
+            day = None
+        if day is None:
+            raise CommandError(f'Invalid {name}: {value}')
+        return day
+
+    def handle(self, *args, **options):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        if options['date_from']:
+            start = self._parse(options['date_from'], '--from')
+            end = self._parse(options['date_to'], '--to') if options['date_to'] else yesterday
+        else:
+            start = end = self._parse(options['date'], '--date') if options['date'] else yesterday
+
+        try:
+            results = mark_absences(start, end, skip_weekdays=options['skip_weekday'], batch_size=options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for day, created in results.items():
+            self.stdout.write(f'{day}: {created} marked absent.')
+        self.stdout.write(self.style.SUCCESS(f'Marked {sum(results.values())} absences over {len(results)} day(s).'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from hr_app.timekeeping import rebuild_attendance_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the monthly attendance summary table from the Attendance rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=None)
+        parser.add_argument('--month', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = rebuild_attendance_summaries(options['year'], options['month'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} attendance summary rows.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from hr_app.leaves import rebuild_leave_balances
+
+
+class Command(BaseCommand):
+    help = "Recomputes the used days of the leave balance ledger from the approved leave requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = rebuild_leave_balances(options['year'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} leave balance rows.'))
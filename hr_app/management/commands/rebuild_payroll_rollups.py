@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from hr_app.payroll import rebuild_payroll_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-department payroll rollup table from the Payroll rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=None)
+        parser.add_argument('--month', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = rebuild_payroll_rollups(options['year'], options['month'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} payroll rollup rows.'))
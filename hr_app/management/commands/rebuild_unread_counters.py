@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from hr_app.messaging import rebuild_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes the per-user unread message and notification counters."
+
+    def handle(self, *args, **options):
+        count = rebuild_unread_counters()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} unread counters.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from hr_app.models import Attendance
+from hr_app.timekeeping import recompute_attendance
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes hours_worked from check_in/check_out with batched SQL updates, "
+        "and optionally the Present/Late status from a late threshold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='First day to recompute (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', help='Last day to recompute (YYYY-MM-DD).')
+        parser.add_argument('--status', action='store_true', help='Also recompute Present/Late from the late threshold.')
+        parser.add_argument('--late-after', default=None, help='Late threshold (HH:MM). Defaults to ATTENDANCE_LATE_AFTER.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        qs = Attendance.objects.all()
+        for option, lookup in (('date_from', 'date__gte'), ('date_to', 'date__lte')):
+            if options[option]:
+                try:
+                    day = parse_date(options[option])
+                except ValueError:
+                    day = None
+                if day is None:
+                    raise CommandError(f'Invalid date: {options[option]}')
+                qs = qs.filter(**{lookup: day})
+
+        late_after = (options['late_after'] or '') if options['status'] else None
+        try:
+            updated = recompute_attendance(qs, late_after=late_after, batch_size=options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {updated} attendance rows.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hr_app.payroll import run_monthly_payroll
+
+
+class Command(BaseCommand):
+    help = "Generates the payroll rows of every eligible employee for one month in a single bulk insert."
+
+    def add_arguments(self, parser):
+        now = timezone.now()
+        parser.add_argument('--year', type=int, default=now.year)
+        parser.add_argument('--month', type=int, default=now.month)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            run = run_monthly_payroll(options['year'], options['month'], batch_size=options['batch_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f'Payroll {run.month}/{run.year}: {run.eligible_count} eligible, '
+            f'{run.created_count} created, {run.skipped_count} skipped in {run.duration_ms} ms.'
+        )
+        if run.missing_usernames:
+            self.stdout.write(self.style.WARNING(
+                f'{run.missing_salary_count} employee(s) have no base salary yet and were not paid: '
+                + ', '.join(run.missing_usernames)
+            ))
+        self.stdout.write(self.style.SUCCESS('Payroll run completed.'))
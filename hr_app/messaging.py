@@ -0,0 +1,327 @@
+# hr_app/messaging.py
+"""
+إرسال الرسائل الداخلية والإشعارات لعدة مستلمين دفعة واحدة: رسائل الموظفين إلى
+مديري الموارد البشرية، الردود، إشعارات التقييم وإعلانات الأقسام، مع تحديث
+عدادات غير المقروء لكل مستخدم، وتجميع الرسائل في محادثات.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
+
+from .events import publish_each_on_commit, publish_on_commit
+from .models import Message, Notification, Profile, UnreadCounter
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+# ----------------------------
+# عدادات غير المقروء
+# ----------------------------
+
+def add_unread(user_ids, field, delta=1):
+    """
+    Add `delta` to the `field` counter ('messages' or 'notifications') of each user id.
+
+    A user listed n times gets n * delta. When adding, missing counter rows
+    are created first; a decrement only updates existing rows, so it never
+    recreates the counter of a user who is being deleted. Users sharing the
+    same amount are updated with one UPDATE.
+    """
+    amounts = Counter(user_ids)
+    if not amounts:
+        return
+    if delta > 0:
+        UnreadCounter.objects.bulk_create([UnreadCounter(user_id=user_id) for user_id in amounts], ignore_conflicts=True)
+    by_amount = {}
+    for user_id, times in amounts.items():
+        by_amount.setdefault(times, []).append(user_id)
+    for times, ids in by_amount.items():
+        UnreadCounter.objects.filter(user_id__in=ids).update(**{field: F(field) + times * delta})
+
+
+def unread_counts(user_id):
+    """(unread messages, unread notifications) of the user, read from the counter row."""
+    row = UnreadCounter.objects.filter(user_id=user_id).values_list('messages', 'notifications').first()
+    return tuple(max(0, n) for n in row) if row else (0, 0)
+
+
+def mark_message_read(message):
+    """Mark `message` read once, even if the page is opened twice at the same time."""
+    if message.is_read:
+        return False
+    message.is_read = True
+    if Message.objects.filter(pk=message.pk, is_read=False).update(is_read=True):
+        add_unread([message.recipient_id], 'messages', -1)
+        return True
+    return False
+
+
+def mark_notifications_read(user_id, ids=None):
+    """Mark the user's unread notifications (all, or only `ids`) read. Returns how many changed."""
+    qs = Notification.objects.filter(user_id=user_id, is_read=False)
+    if ids is not None:
+        qs = qs.filter(id__in=ids)
+    with transaction.atomic():
+        count = qs.update(is_read=True)
+        if count:
+            add_unread([user_id] * count, 'notifications', -1)
+    return count
+
+
+def rebuild_unread_counters():
+    """Recompute every counter from the Message and Notification tables. Returns the rows written."""
+    counters = {}
+    for recipient_id, n in Message.objects.filter(is_read=False).values_list('recipient_id').annotate(n=Count('id')).order_by():
+        counters.setdefault(recipient_id, UnreadCounter(user_id=recipient_id)).messages = n
+    for user_id, n in Notification.objects.filter(is_read=False).values_list('user_id').annotate(n=Count('id')).order_by():
+        counters.setdefault(user_id, UnreadCounter(user_id=user_id)).notifications = n
+    with transaction.atomic():
+        UnreadCounter.objects.all().delete()
+        UnreadCounter.objects.bulk_create(counters.values(), batch_size=1000)
+    return len(counters)
+
+
+# ----------------------------
+# الإرسال
+# ----------------------------
+
+def notification_event(message, link=None):
+    """Payload pushed to the user's open event streams for a new notification."""
+    return {'type': 'notification', 'message': message, 'link': link or ''}
+
+
+def save_notifications(notifications, batch_size=1000):
+    """Insert unsaved Notification rows with batched bulk_create. Returns the number written."""
+    count = 0
+    with transaction.atomic():
+        for chunk in _chunks(notifications, batch_size):
+            Notification.objects.bulk_create(chunk)
+            add_unread([n.user_id for n in chunk], 'notifications')
+            publish_each_on_commit((n.user_id, notification_event(n.message, n.link)) for n in chunk)
+            count += len(chunk)
+    return count
+
+
+def notify(user_ids, message, link=None, batch_size=1000):
+    """Send the same notification to every user in `user_ids`."""
+    return save_notifications(
+        (Notification(user_id=user_id, message=message, link=link) for user_id in user_ids), batch_size,
+    )
+
+
+def send_messages(sender, recipient_ids, subject, body, notification=None, reply_to=None, link=None, batch_size=1000):
+    """
+    Send one message from `sender` to each of `recipient_ids`, plus an optional notification.
+
+    Rows are built in memory and written with bulk_create, `batch_size` at a
+    time, inside one transaction: either every recipient gets the message and
+    its notification or nobody does. `recipient_ids` may be any iterable (a
+    values_list iterator for large audiences), so memory stays bounded.
+    Returns the number of messages sent.
+    """
+    sender_id = getattr(sender, 'pk', sender)
+    reply_to_id = getattr(reply_to, 'pk', reply_to)
+    root = thread_root_of(reply_to) if reply_to is not None else None
+    count = 0
+    with transaction.atomic():
+        for chunk in _chunks(recipient_ids, batch_size):
+            created = Message.objects.bulk_create([
+                Message(
+                    sender_id=sender_id, recipient_id=recipient_id, subject=subject, body=body,
+                    reply_to_id=reply_to_id, thread_root=root,
+                )
+                for recipient_id in chunk
+            ])
+            if root is None:
+                # كل نسخة من رسالة جديدة تبدأ محادثة مستقلة مع مستلمها
+                Message.objects.filter(pk__in=[m.pk for m in created]).update(thread_root=F('id'))
+            add_unread(chunk, 'messages')
+            publish_on_commit(chunk, {'type': 'message', 'subject': subject})
+            if notification:
+                Notification.objects.bulk_create([
+                    Notification(user_id=recipient_id, message=notification, link=link) for recipient_id in chunk
+                ])
+                add_unread(chunk, 'notifications')
+                publish_on_commit(chunk, notification_event(notification, link))
+            count += len(chunk)
+    return count
+
+
+def hr_manager_ids():
+    """User ids of the HR managers who receive employee messages."""
+    return Profile.objects.filter(user_type='HR Manager', user__is_superuser=False).values_list('user_id', flat=True)
+
+
+def department_member_ids(departments, exclude_user_id=None):
+    """User ids of every non-superuser profile in `departments`, in a stable order."""
+    qs = Profile.objects.filter(department__in=departments, user__is_superuser=False)
+    if exclude_user_id is not None:
+        qs = qs.exclude(user_id=exclude_user_id)
+    return qs.order_by('user_id').values_list('user_id', flat=True)
+
+
+def broadcast_announcement(sender, departments, subject, body, batch_size=1000):
+    """
+    Send an announcement message and notification to every member of `departments`.
+
+    Recipients are streamed from the database and written in batches, so a
+    department of thousands costs a handful of INSERTs. Returns the number of
+    recipients.
+    """
+    sender_name = sender.get_full_name() or sender.username
+    return send_messages(
+        sender,
+        department_member_ids(departments, exclude_user_id=sender.pk).iterator(chunk_size=batch_size),
+        subject,
+        body,
+        notification=f'إعلان جديد من {sender_name}: {subject}',
+        batch_size=batch_size,
+    )
+
+
+# ----------------------------
+# المحادثات
+# ----------------------------
+
+def thread_root_of(message):
+    """Thread id for a reply to `message` (a Message or its id)."""
+    if not isinstance(message, Message):
+        message = Message.objects.only('thread_root').get(pk=message)
+    return message.thread_root or message.pk
+
+
+def thread_messages(message, user):
+    """
+    The whole conversation of `message` that `user` took part in, oldest first.
+
+    One query on the (thread_root, created_at) index, however long the
+    reply_to chain is.
+    """
+    return (
+        Message.objects
+        .filter(thread_root=thread_root_of(message))
+        .filter(Q(sender=user) | Q(recipient=user))
+        .select_related('sender', 'recipient')
+        .order_by('created_at', 'id')
+    )
+
+
+def inbox_threads(user, after=None, unread_only=False, page_size=None):
+    """
+    The user's received messages grouped by thread, newest activity first.
+
+    Returns (threads, next_cursor): the last received Message of each thread
+    with `thread_total` and `thread_unread` set on it, one page at a time.
+    `after` is the inbox cursor of the last message shown on the previous page.
+
+    Two queries. The first walks the (recipient, created_at) index newest first
+    and keeps the messages that have no newer received message in their thread
+    (a NOT EXISTS probe on the (thread_root, created_at) index), stopping after
+    one page. The second counts messages for that page's threads only, so
+    the cost follows the page size, not the size of the inbox.
+    """
+    page_size = page_size or INBOX_PAGE_SIZE
+    received = Message.objects.filter(recipient=user)
+    newer_in_thread = received.filter(thread_root=OuterRef('thread_root')).filter(
+        Q(created_at__gt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), id__gt=OuterRef('id'))
+    )
+    last_messages = received.exclude(Exists(newer_in_thread))
+    if unread_only:
+        last_messages = last_messages.filter(Exists(received.filter(thread_root=OuterRef('thread_root'), is_read=False)))
+    after = decode_inbox_cursor(after)
+    if after:
+        created_at, pk = after
+        last_messages = last_messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    threads = list(last_messages.select_related('sender').order_by('-created_at', '-id')[:page_size + 1])
+    next_cursor = encode_inbox_cursor(threads[page_size - 1]) if len(threads) > page_size else None
+    threads = threads[:page_size]
+
+    counts = {
+        row['thread_root']: row
+        for row in (
+            received.filter(thread_root__in=[message.thread_root for message in threads])
+            .values('thread_root')
+            .annotate(total=Count('id'), unread=Count('id', filter=Q(is_read=False)))
+            .order_by()
+        )
+    }
+    for message in threads:
+        message.thread_total = counts[message.thread_root]['total']
+        message.thread_unread = counts[message.thread_root]['unread']
+    return threads, next_cursor
+
+
+# ----------------------------
+# تصفح صندوق الوارد والإشعارات (keyset pagination)
+# ----------------------------
+
+INBOX_PAGE_SIZE = 50
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MAX_CURSOR_ID = 2 ** 63 - 1
+
+
+def _parse_cursor_id(value):
+    """A positive id from a cursor part, or None; isdigit alone accepts digits like ² that int() rejects."""
+    value = str(value or '')
+    if not (value.isascii() and value.isdigit()) or int(value) > MAX_CURSOR_ID:
+        return None
+    return int(value)
+
+
+def encode_inbox_cursor(row):
+    # الوقت بالميكروثانية منذ 1970 حتى يبقى المؤشر رقماً آمناً داخل الرابط
+    return f'{(row.created_at - _EPOCH) // timedelta(microseconds=1)}_{row.id}'
+
+
+def decode_inbox_cursor(cursor):
+    """Return (created_at, id) from a cursor string, or None if it is missing or malformed."""
+    micros, _, pk = (cursor or '').partition('_')
+    micros, pk = _parse_cursor_id(micros), _parse_cursor_id(pk)
+    if micros is None or pk is None:
+        return None
+    try:
+        return _EPOCH + timedelta(microseconds=micros), pk
+    except OverflowError:
+        # وقت بعد سنة 9999
+        return None
+
+
+def inbox_page(qs, after=None, before=None, page_size=INBOX_PAGE_SIZE):
+    """
+    One page of messages or notifications ordered newest first, using a keyset on (created_at, id).
+
+    Works like timekeeping.attendance_page: each page is one range scan of the
+    (recipient/user, [is_read,] created_at) index, so the 1000th page costs the
+    same as the first. Returns (rows, next_cursor, previous_cursor).
+    """
+    after, before = decode_inbox_cursor(after), decode_inbox_cursor(before)
+    if before:
+        created_at, pk = before
+        qs = qs.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)).order_by('created_at', 'id')
+    else:
+        if after:
+            created_at, pk = after
+            qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        qs = qs.order_by('-created_at', '-id')
+
+    rows = list(qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+        has_next, has_previous = bool(rows), has_more
+    else:
+        has_next, has_previous = has_more, after is not None
+
+    next_cursor = encode_inbox_cursor(rows[-1]) if rows and has_next else None
+    previous_cursor = encode_inbox_cursor(rows[0]) if rows and has_previous else None
+    return rows, next_cursor, previous_cursor
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-17 21:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hr_app', '0006_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayrollRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.IntegerField()),
+                ('year', models.IntegerField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('eligible_count', models.PositiveIntegerField(default=0)),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('skipped_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='payroll',
+            constraint=models.UniqueConstraint(fields=('employee', 'year', 'month'), name='unique_payroll_employee_period'),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='run_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payroll_runs', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
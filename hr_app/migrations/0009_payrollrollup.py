@@ -0,0 +1,65 @@
+# Generated by Django 4.2 on 2026-10-17 21:28
+
+# The rollups start from the payroll rows already in the table; after that
+# they are kept up to date by hr_app.signals and rebuild_payroll_rollups.
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_rollups(apps, schema_editor):
+    Payroll = apps.get_model('hr_app', 'Payroll')
+    PayrollRollup = apps.get_model('hr_app', 'PayrollRollup')
+
+    totals = (
+        Payroll.objects
+        .values('employee__department', 'year', 'month')
+        .annotate(
+            headcount=Count('id'),
+            total_base_salary=Sum('base_salary'),
+            total_bonuses=Sum('bonuses'),
+            total_deductions=Sum('deductions'),
+            total_net_salary=Sum('net_salary'),
+        )
+        .order_by()
+    )
+    # القسم الفارغ و NULL يمثلان نفس الصف في الملخص
+    rollups = {}
+    for row in totals:
+        key = (row['employee__department'] or '', row['year'], row['month'])
+        rollup = rollups.setdefault(key, PayrollRollup(department=key[0], year=key[1], month=key[2]))
+        rollup.headcount += row['headcount']
+        rollup.total_base_salary += row['total_base_salary'] or 0
+        rollup.total_bonuses += row['total_bonuses'] or 0
+        rollup.total_deductions += row['total_deductions'] or 0
+        rollup.total_net_salary += row['total_net_salary'] or 0
+    PayrollRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0008_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayrollRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department', models.CharField(blank=True, default='', max_length=50)),
+                ('month', models.IntegerField()),
+                ('year', models.IntegerField()),
+                ('headcount', models.IntegerField(default=0)),
+                ('total_base_salary', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_bonuses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_deductions', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_net_salary', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='payrollrollup',
+            constraint=models.UniqueConstraint(fields=('department', 'year', 'month'), name='unique_payroll_rollup_period'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
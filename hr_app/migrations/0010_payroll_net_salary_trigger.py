@@ -0,0 +1,94 @@
+# The application writes net_salary itself on every path (Payroll.save, the
+# bulk_create paths and the F() expression in adjust_salaries), so it is
+# correct on every backend. On PostgreSQL and SQLite a trigger also keeps it in
+# step for raw SQL or admin tools; other backends (e.g. MySQL) only get the
+# backfill. Django 4.2 has no GeneratedField.
+#
+# Note: on SQLite, a later migration that rebuilds the hr_app_payroll table
+# drops these triggers; the application paths above do not depend on them.
+
+from django.db import migrations
+
+
+POSTGRESQL_FORWARD = [
+    """
+    CREATE OR REPLACE FUNCTION hr_app_payroll_net_salary() RETURNS trigger AS $$
+    BEGIN
+        NEW.net_salary := NEW.base_salary + NEW.bonuses - NEW.deductions;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    CREATE TRIGGER hr_app_payroll_net_salary
+    BEFORE INSERT OR UPDATE ON hr_app_payroll
+    FOR EACH ROW EXECUTE PROCEDURE hr_app_payroll_net_salary();
+    """,
+]
+POSTGRESQL_BACKWARD = [
+    "DROP TRIGGER IF EXISTS hr_app_payroll_net_salary ON hr_app_payroll;",
+    "DROP FUNCTION IF EXISTS hr_app_payroll_net_salary();",
+]
+
+# SQLite cannot change NEW in a BEFORE trigger, so the row is corrected right
+# after the write (recursive triggers are off, so this does not loop).
+SQLITE_FORWARD = [
+    """
+    CREATE TRIGGER hr_app_payroll_net_salary_insert
+    AFTER INSERT ON hr_app_payroll
+    BEGIN
+        UPDATE hr_app_payroll
+        SET net_salary = ROUND(NEW.base_salary + NEW.bonuses - NEW.deductions, 2)
+        WHERE id = NEW.id;
+    END;
+    """,
+    """
+    CREATE TRIGGER hr_app_payroll_net_salary_update
+    AFTER UPDATE OF base_salary, bonuses, deductions, net_salary ON hr_app_payroll
+    BEGIN
+        UPDATE hr_app_payroll
+        SET net_salary = ROUND(NEW.base_salary + NEW.bonuses - NEW.deductions, 2)
+        WHERE id = NEW.id;
+    END;
+    """,
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS hr_app_payroll_net_salary_insert;",
+    "DROP TRIGGER IF EXISTS hr_app_payroll_net_salary_update;",
+]
+
+# Bring any row written before the trigger existed up to date.
+BACKFILL = "UPDATE hr_app_payroll SET net_salary = base_salary + bonuses - deductions;"
+
+
+def _run(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def create_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_FORWARD)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+    schema_editor.execute(BACKFILL)
+
+
+def drop_triggers(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_BACKWARD)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0009_payrollrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
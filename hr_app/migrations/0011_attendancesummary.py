@@ -0,0 +1,63 @@
+# Generated by Django 4.2 on 2026-10-17 21:34
+
+# The summaries start from the attendance rows already in the table; after
+# that they are kept up to date by hr_app.signals and rebuild_attendance_summaries.
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    Attendance = apps.get_model('hr_app', 'Attendance')
+    AttendanceSummary = apps.get_model('hr_app', 'AttendanceSummary')
+
+    totals = (
+        Attendance.objects
+        .annotate(period_year=ExtractYear('date'), period_month=ExtractMonth('date'))
+        .values('employee_id', 'period_year', 'period_month')
+        .annotate(
+            present=Count('id', filter=Q(status='Present')),
+            absent=Count('id', filter=Q(status='Absent')),
+            late=Count('id', filter=Q(status='Late')),
+            hours=Sum('hours_worked'),
+        )
+        .order_by()
+    )
+    AttendanceSummary.objects.bulk_create([
+        AttendanceSummary(
+            employee_id=row['employee_id'], year=row['period_year'], month=row['period_month'],
+            present_count=row['present'], absent_count=row['absent'], late_count=row['late'],
+            total_hours=row['hours'] or 0,
+        )
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0010_payroll_net_salary_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.IntegerField()),
+                ('year', models.IntegerField()),
+                ('present_count', models.IntegerField(default=0)),
+                ('absent_count', models.IntegerField(default=0)),
+                ('late_count', models.IntegerField(default=0)),
+                ('total_hours', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_summaries', to='hr_app.profile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='attendancesummary',
+            constraint=models.UniqueConstraint(fields=('employee', 'year', 'month'), name='unique_attendance_summary_period'),
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
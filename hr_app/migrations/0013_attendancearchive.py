@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-17 21:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0012_attendance_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.IntegerField(unique=True)),
+                ('date', models.DateField()),
+                ('check_in', models.TimeField(blank=True, null=True)),
+                ('check_out', models.TimeField(blank=True, null=True)),
+                ('hours_worked', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('status', models.CharField(choices=[('Present', 'حاضر'), ('Absent', 'غائب'), ('Late', 'متأخر')], default='Present', max_length=10)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_attendances', to='hr_app.profile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='attendancearchive',
+            index=models.Index(fields=['employee', '-date'], name='attendance_archive_emp_idx'),
+        ),
+    ]
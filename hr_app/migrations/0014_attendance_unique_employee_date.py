@@ -0,0 +1,67 @@
+# Attendance gets one row per (employee, date). Existing duplicates are merged
+# into the oldest row first: earliest check-in, latest check-out, hours
+# recomputed, and Late/Present preferred over Absent. The monthly summaries of
+# the affected employees are then recomputed from the remaining rows.
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+STATUS_PRIORITY = {'Late': 0, 'Present': 1, 'Absent': 2}
+
+
+def merge_duplicates(apps, schema_editor):
+    Attendance = apps.get_model('hr_app', 'Attendance')
+    AttendanceArchive = apps.get_model('hr_app', 'AttendanceArchive')
+    AttendanceSummary = apps.get_model('hr_app', 'AttendanceSummary')
+
+    duplicates = (
+        Attendance.objects.values('employee_id', 'date')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    affected = set()
+    for group in duplicates.iterator():
+        rows = list(Attendance.objects.filter(employee_id=group['employee_id'], date=group['date']).order_by('id'))
+        keep, extra = rows[0], rows[1:]
+        check_ins = [r.check_in for r in rows if r.check_in]
+        check_outs = [r.check_out for r in rows if r.check_out]
+        keep.check_in = min(check_ins) if check_ins else None
+        keep.check_out = max(check_outs) if check_outs else None
+        if keep.check_in and keep.check_out:
+            delta = datetime.combine(keep.date, keep.check_out) - datetime.combine(keep.date, keep.check_in)
+            keep.hours_worked = round(delta.total_seconds() / 3600, 2)
+        keep.status = min((r.status for r in rows), key=lambda status: STATUS_PRIORITY.get(status, 1))
+        keep.save(update_fields=['check_in', 'check_out', 'hours_worked', 'status'])
+        Attendance.objects.filter(id__in=[r.id for r in extra]).delete()
+        affected.add((keep.employee_id, keep.date.year, keep.date.month))
+
+    for employee_id, year, month in affected:
+        totals = {'present_count': 0, 'absent_count': 0, 'late_count': 0, 'total_hours': 0}
+        for model in (Attendance, AttendanceArchive):
+            result = model.objects.filter(employee_id=employee_id, date__year=year, date__month=month).aggregate(
+                present_count=Count('id', filter=Q(status='Present')),
+                absent_count=Count('id', filter=Q(status='Absent')),
+                late_count=Count('id', filter=Q(status='Late')),
+                total_hours=Sum('hours_worked'),
+            )
+            for name, value in result.items():
+                totals[name] += value or 0
+        AttendanceSummary.objects.update_or_create(employee_id=employee_id, year=year, month=month, defaults=totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0013_attendancearchive'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('employee', 'date'), name='unique_attendance_employee_date'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-17 21:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0014_attendance_unique_employee_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaverequest',
+            index=models.Index(fields=['employee', 'start_date', 'end_date'], name='leave_employee_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaverequest',
+            index=models.Index(fields=['status', 'end_date', 'start_date'], name='leave_status_period_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2 on 2026-10-17 21:57
+
+# The ledger starts from the leave requests already approved; after that it is
+# kept up to date by hr_app.leaves and rebuild_leave_balances.
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_balances(apps, schema_editor):
+    LeaveRequest = apps.get_model('hr_app', 'LeaveRequest')
+    LeaveBalance = apps.get_model('hr_app', 'LeaveBalance')
+
+    used = {}
+    approved = LeaveRequest.objects.filter(status='Approved').values_list('employee_id', 'leave_type', 'start_date', 'end_date')
+    for employee_id, leave_type, start, end in approved.iterator():
+        # أيام الإجازة لكل سنة، كما في hr_app.leaves.leave_days_by_year
+        while start <= end:
+            year_end = min(end, date(start.year, 12, 31))
+            key = (employee_id, leave_type, start.year)
+            used[key] = used.get(key, 0) + (year_end - start).days + 1
+            start = year_end + timedelta(days=1)
+
+    LeaveBalance.objects.bulk_create([
+        LeaveBalance(
+            employee_id=employee_id, leave_type=leave_type, year=year, used_days=days,
+            entitled_days=settings.LEAVE_ENTITLEMENTS.get(leave_type, 0),
+        )
+        for (employee_id, leave_type, year), days in used.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0015_leave_overlap_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaveBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('leave_type', models.CharField(choices=[('Sick', 'مرضية'), ('Annual', 'سنوية'), ('Emergency', 'طارئة')], max_length=20)),
+                ('year', models.IntegerField()),
+                ('entitled_days', models.IntegerField(default=0)),
+                ('used_days', models.IntegerField(default=0)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leave_balances', to='hr_app.profile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='leavebalance',
+            constraint=models.UniqueConstraint(fields=('employee', 'year', 'leave_type'), name='unique_leave_balance_period'),
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-17 22:03
+
+# The counters start from the current unread messages and notifications of
+# every user; after that they are kept up to date by hr_app.messaging.
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    Message = apps.get_model('hr_app', 'Message')
+    Notification = apps.get_model('hr_app', 'Notification')
+    UnreadCounter = apps.get_model('hr_app', 'UnreadCounter')
+
+    counters = {}
+    for row in Message.objects.filter(is_read=False).values('recipient_id').annotate(n=Count('id')).order_by():
+        counters.setdefault(row['recipient_id'], UnreadCounter(user_id=row['recipient_id'])).messages = row['n']
+    for row in Notification.objects.filter(is_read=False).values('user_id').annotate(n=Count('id')).order_by():
+        counters.setdefault(row['user_id'], UnreadCounter(user_id=row['user_id'])).notifications = row['n']
+    UnreadCounter.objects.bulk_create(counters.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('hr_app', '0016_leavebalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('messages', models.IntegerField(default=0)),
+                ('notifications', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
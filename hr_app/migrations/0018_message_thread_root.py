@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-17 22:08
+
+# Every existing message gets the id of the first message of its reply_to
+# chain; a message that is not a reply starts its own thread.
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_thread_roots(apps, schema_editor):
+    Message = apps.get_model('hr_app', 'Message')
+    Message.objects.filter(reply_to__isnull=True).update(thread_root=F('id'))
+
+    parents = dict(Message.objects.filter(reply_to__isnull=False).values_list('id', 'reply_to_id').iterator())
+    replies_by_root = {}
+    for message_id in parents:
+        root, seen = message_id, set()
+        while root in parents and root not in seen:
+            seen.add(root)
+            root = parents[root]
+        replies_by_root.setdefault(root, []).append(message_id)
+    for root, ids in replies_by_root.items():
+        Message.objects.filter(id__in=ids).update(thread_root=root)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0017_unreadcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='thread_root',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread_root', 'created_at'], name='message_thread_idx'),
+        ),
+        migrations.RunPython(fill_thread_roots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0019_inbox_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancearchive',
+            name='original_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-17 23:08
+
+# The payroll row is created here so that its creation time identifies this
+# database; after that hr_app.versions bumps it on every change.
+
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    DataVersion = apps.get_model('hr_app', 'DataVersion')
+    DataVersion.objects.create(name='payroll')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0020_alter_attendancearchive_original_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hr_app', '0021_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrollrun',
+            name='missing_salary_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -49,10 +49,66 @@ class Attendance(models.Model):
     hours_worked = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Present')
 
+    class Meta:
+        # سجل واحد فقط لكل موظف في اليوم (يمنع التكرار عند الضغط المزدوج أو التسجيل المتزامن)
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'date'], name='unique_attendance_employee_date'),
+        ]
+        # فهارس صفحة إدارة الحضور: الترتيب والتقسيم على (date, id) والتصفية بالحالة
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='attendance_date_id_idx'),
+            models.Index(fields=['status', '-date', '-id'], name='attendance_status_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.employee.user.username} - {self.date}"
 
 
+# ----------------------------
+# أرشيف الحضور: السجلات الأقدم من فترة الاحتفاظ تُنقل هنا (أمر archive_attendance)
+# ----------------------------
+class AttendanceArchive(models.Model):
+    STATUS_CHOICES = Attendance.STATUS_CHOICES
+
+    original_id = models.BigIntegerField(unique=True)  # رقم السجل في جدول Attendance قبل النقل
+    employee = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='archived_attendances')
+    date = models.DateField()
+    check_in = models.TimeField(null=True, blank=True)
+    check_out = models.TimeField(null=True, blank=True)
+    hours_worked = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Present')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['employee', '-date'], name='attendance_archive_emp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.employee.user.username} - {self.date} (أرشيف)"
+
+
+# ----------------------------
+# ملخص الحضور الشهري لكل موظف (يتم تحديثه تلقائياً مع كل تعديل على الحضور)
+# ----------------------------
+class AttendanceSummary(models.Model):
+    employee = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='attendance_summaries')
+    month = models.IntegerField()  # 1-12
+    year = models.IntegerField()
+    present_count = models.IntegerField(default=0)
+    absent_count = models.IntegerField(default=0)
+    late_count = models.IntegerField(default=0)
+    total_hours = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'year', 'month'], name='unique_attendance_summary_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.employee.user.username} - {self.month}/{self.year}"
+
+
 # ----------------------------
 # نموذج طلب الإجازة
 # ----------------------------
@@ -75,10 +131,40 @@ class LeaveRequest(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
     approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='approved_leaves')
 
+    class Meta:
+        # فهارس كشف التداخل: طلبات الموظف حسب الفترة، والإجازات المقبولة حسب الفترة (من هو في إجازة)
+        indexes = [
+            models.Index(fields=['employee', 'start_date', 'end_date'], name='leave_employee_period_idx'),
+            models.Index(fields=['status', 'end_date', 'start_date'], name='leave_status_period_idx'),
+        ]
+
     def __str__(self):
         return f"{self.employee.user.username} - {self.leave_type}"
 
 
+# ----------------------------
+# رصيد الإجازات لكل موظف ونوع إجازة وسنة (يتم تحديثه عند قبول أو رفض الطلبات)
+# ----------------------------
+class LeaveBalance(models.Model):
+    employee = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='leave_balances')
+    leave_type = models.CharField(max_length=20, choices=LeaveRequest.LEAVE_TYPES)
+    year = models.IntegerField()
+    entitled_days = models.IntegerField(default=0)
+    used_days = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'year', 'leave_type'], name='unique_leave_balance_period'),
+        ]
+
+    @property
+    def remaining_days(self):
+        return self.entitled_days - self.used_days
+
+    def __str__(self):
+        return f"{self.employee.user.username} - {self.leave_type} {self.year}: {self.used_days}/{self.entitled_days}"
+
+
 # ----------------------------
 # نموذج الرواتب
 # ----------------------------
@@ -92,7 +178,14 @@ class Payroll(models.Model):
     net_salary = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     remarks = models.TextField(blank=True, null=True)
 
+    class Meta:
+        # راتب واحد فقط لكل موظف في كل شهر (يجعل تشغيل مسير الرواتب قابلاً للإعادة)
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'year', 'month'], name='unique_payroll_employee_period'),
+        ]
+
     def save(self, *args, **kwargs):
+        # المسارات الجماعية تحسب الصافي بنفس المعادلة (انظر hr_app.payroll و migration 0010)
         self.net_salary = self.base_salary + self.bonuses - self.deductions
         super().save(*args, **kwargs)
 
@@ -100,6 +193,25 @@ class Payroll(models.Model):
         return f"{self.employee.user.username} - {self.month}/{self.year} - {self.net_salary}"
 
 
+# ----------------------------
+# نموذج تشغيل مسير الرواتب الشهري
+# ----------------------------
+class PayrollRun(models.Model):
+    month = models.IntegerField()  # 1-12
+    year = models.IntegerField()
+    run_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='payroll_runs')
+    started_at = models.DateTimeField(auto_now_add=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+    eligible_count = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    # موظفون جدد بدون راتب سابق يؤخذ منه الراتب الأساسي، يجب إدخال أول راتب لهم يدوياً
+    missing_salary_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.month}/{self.year} - {self.created_count} rows"
+
+
 # ----------------------------
 # نموذج التقييم
 # ----------------------------
@@ -124,6 +236,13 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # قائمة الإشعارات (كلها أو غير المقروءة فقط) مرتبة من الأحدث
+            models.Index(fields=['user', 'is_read', 'created_at'], name='notification_unread_idx'),
+            models.Index(fields=['user', 'created_at'], name='notification_user_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.message[:20]}"
 
@@ -139,6 +258,84 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies')
+    # رقم أول رسالة في المحادثة (للرسالة الأولى = رقمها نفسه)؛ رقم عادي وليس FK حتى تبقى
+    # المحادثة مجمعة لو حُذفت الرسالة الأولى
+    thread_root = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread_root', 'created_at'], name='message_thread_idx'),
+            # صندوق الوارد (كله أو غير المقروء فقط) مرتباً من الأحدث
+            models.Index(fields=['recipient', 'is_read', 'created_at'], name='message_unread_idx'),
+            models.Index(fields=['recipient', 'created_at'], name='message_inbox_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} -> {self.recipient.username}: {self.subject[:30]}"
+
+
+# ----------------------------
+# عدادات الرسائل والإشعارات غير المقروءة لكل مستخدم (بدلاً من COUNT في كل صفحة)
+# ----------------------------
+class UnreadCounter(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    messages = models.IntegerField(default=0)
+    notifications = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.messages} رسائل / {self.notifications} إشعارات"
+
+
+# ----------------------------
+# ملخص الرواتب لكل قسم وشهر (يتم تحديثه تلقائياً مع كل تعديل على الرواتب)
+# ----------------------------
+class PayrollRollup(models.Model):
+    department = models.CharField(max_length=50, blank=True, default='')  # '' للموظفين بدون قسم
+    month = models.IntegerField()  # 1-12
+    year = models.IntegerField()
+    headcount = models.IntegerField(default=0)
+    total_base_salary = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_bonuses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_deductions = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_net_salary = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'year', 'month'], name='unique_payroll_rollup_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.department or '-'} - {self.month}/{self.year} - {self.total_net_salary}"
+
+
+# ----------------------------
+# نموذج مهام توليد التقارير في الخلفية
+# ----------------------------
+class ReportJob(models.Model):
+    STATUS_CHOICES = (
+        ('Pending', 'في الانتظار'),
+        ('Running', 'قيد التنفيذ'),
+        ('Done', 'مكتمل'),
+        ('Failed', 'فشل'),
+    )
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='report_jobs')
+    content_hash = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} - {self.status}"
+
+
+# ----------------------------
+# أرقام إصدار البيانات (تزيد مع كل تعديل وتُبنى عليها مفاتيح التخزين المؤقت)
+# ----------------------------
+class DataVersion(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
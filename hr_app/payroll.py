@@ -0,0 +1,324 @@
+# hr_app/payroll.py
+"""
+خدمات الرواتب: تشغيل مسير الرواتب الشهري دفعة واحدة، تصدير الكشوفات على دفعات،
+وتحديث ملخص الرواتب لكل قسم وشهر.
+"""
+
+import calendar
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Round
+
+from .models import Payroll, PayrollRollup, PayrollRun, Profile
+from .versions import PAYROLL, bump_data_version
+
+# حدود حقول DecimalField(max_digits=10, decimal_places=2) في نموذج Payroll
+MAX_SALARY = Decimal('99999999.99')
+
+
+def to_decimal(val, default=Decimal('0.00')):
+    """
+    تقوم بتحويل القيمة إلى Decimal بشكل آمن، وتعيد قيمة افتراضية عند الفشل.
+    """
+    try:
+        if val in (None, ''):
+            return default
+        return Decimal(val)
+    except (InvalidOperation, TypeError):
+        return default
+
+
+def validate_period(year, month):
+    """Return (year, month) as ints, raising ValueError for an invalid period."""
+    try:
+        year, month = int(year), int(month)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('السنة والشهر يجب أن تكون أرقاماً صحيحة.')
+    if not 1 <= month <= 12:
+        raise ValueError('الشهر يجب أن يكون بين 1 و 12.')
+    if not 1900 <= year <= 9999:
+        raise ValueError('السنة غير صالحة.')
+    return year, month
+
+
+def payable_profiles(year, month):
+    """
+    Profiles that should be paid for (year, month), annotated with `last_base_salary`.
+
+    A profile is payable when the account is active and joined on or before the
+    last day of the period. `last_base_salary` is the base salary of its latest
+    earlier payroll row, or None for a new hire. Everything is resolved in a
+    single query.
+    """
+    period_end = date(year, month, calendar.monthrange(year, month)[1])
+    previous = (
+        Payroll.objects
+        .filter(employee=OuterRef('pk'))
+        .filter(Q(year__lt=year) | Q(year=year, month__lt=month))
+        .order_by('-year', '-month')
+    )
+    return (
+        Profile.objects
+        .filter(user__is_superuser=False, user__is_active=True, date_joined__lte=period_end)
+        .annotate(last_base_salary=Subquery(previous.values('base_salary')[:1]))
+    )
+
+
+def eligible_profiles(year, month):
+    """Payable profiles with an earlier payroll row to carry the base salary forward from."""
+    return payable_profiles(year, month).filter(last_base_salary__isnull=False)
+
+
+def missing_base_salary_profiles(year, month):
+    """
+    Payable profiles the monthly run cannot pay because no base salary is known.
+
+    These are new hires without any earlier payroll row and without a row for
+    the period itself; their first salary has to be entered by hand (add
+    payroll or the import), after which later runs carry it forward.
+    """
+    return (
+        payable_profiles(year, month)
+        .filter(last_base_salary__isnull=True)
+        .exclude(payroll__year=year, payroll__month=month)
+    )
+
+
+def run_monthly_payroll(year, month, run_by=None, batch_size=1000):
+    """
+    Generate the payroll rows of every eligible employee for (year, month).
+
+    Rows are inserted with one batched bulk_create inside a transaction; a new
+    row has no bonuses or deductions, so its net salary is the base salary. Employees that
+    already have a row for the period are skipped, so the run can be repeated
+    safely. Employees with no base salary to carry forward are counted in
+    `missing_salary_count`, and their usernames are set on the returned run as
+    `missing_usernames`. Returns the saved PayrollRun with timing and row counts.
+    """
+    year, month = validate_period(year, month)
+    started = time.perf_counter()
+
+    with transaction.atomic():
+        # قفل الموظفين المستحقين يجعل تشغيلين متزامنين لنفس الشهر يعملان بالتتابع،
+        # فيرى الثاني رواتب الأول بعد انتهائه بدلاً من محاولة إدراجها مرة أخرى
+        candidates = list(
+            eligible_profiles(year, month).select_for_update(of=('self',)).values_list('id', 'last_base_salary')
+        )
+        already_paid = set(
+            Payroll.objects.filter(year=year, month=month).values_list('employee_id', flat=True)
+        )
+        new_rows = [
+            Payroll(employee_id=emp_id, year=year, month=month, base_salary=base_salary, net_salary=base_salary)
+            for emp_id, base_salary in candidates
+            if emp_id not in already_paid
+        ]
+        Payroll.objects.bulk_create(new_rows, batch_size=batch_size, ignore_conflicts=True)
+        if new_rows:
+            bump_data_version(PAYROLL)
+        # ignore_conflicts قد يتجاهل صفوفاً أُضيفت يدوياً في نفس اللحظة، لذلك نعد ما أُدرج فعلاً
+        created = Payroll.objects.filter(year=year, month=month).count() - len(already_paid)
+        # bulk_create لا يرسل إشارات post_save، لذلك نعيد بناء ملخص هذا الشهر مباشرة
+        rebuild_payroll_rollups(year, month)
+        missing = list(
+            missing_base_salary_profiles(year, month).order_by('user__username').values_list('user__username', flat=True)
+        )
+
+        run = PayrollRun.objects.create(
+            year=year,
+            month=month,
+            run_by=run_by,
+            eligible_count=len(candidates),
+            created_count=created,
+            skipped_count=len(candidates) - created,
+            missing_salary_count=len(missing),
+            duration_ms=int((time.perf_counter() - started) * 1000),
+        )
+    run.missing_usernames = missing
+    return run
+
+
+# أعمدة ملف CSV بنفس ترتيب رأس الجدول في export_payroll
+EXPORT_COLUMNS = (
+    'employee__user__username', 'year', 'month',
+    'base_salary', 'bonuses', 'deductions', 'net_salary', 'remarks',
+)
+
+
+def filter_payrolls(queryset, year=None, month=None, department=None):
+    """Narrow a Payroll queryset to a period and/or department; empty filters are ignored."""
+    if year not in (None, ''):
+        queryset = queryset.filter(year=int(year))
+    if month not in (None, ''):
+        queryset = queryset.filter(month=int(month))
+    if department:
+        queryset = queryset.filter(employee__department=department)
+    return queryset
+
+
+def iter_payroll_export_rows(year=None, month=None, department=None, chunk_size=2000):
+    """
+    Yield CSV rows for the export without loading the whole table.
+
+    Only the exported columns are fetched (as tuples, no model instances) and
+    the database cursor is read in chunks, so memory stays constant.
+    """
+    rows = (
+        filter_payrolls(Payroll.objects.all(), year, month, department)
+        .order_by('year', 'month', 'id')
+        .values_list(*EXPORT_COLUMNS)
+    )
+    for username, p_year, p_month, base_salary, bonuses, deductions, net_salary, remarks in rows.iterator(chunk_size=chunk_size):
+        yield [username, p_year, p_month, str(base_salary), str(bonuses), str(deductions), str(net_salary), remarks or '']
+
+
+def adjust_salaries(field='base_salary', percent=None, amount=None, year=None, month=None, department=None,
+                    all_periods=False):
+    """
+    Change one salary field for many payroll rows with a single UPDATE statement.
+
+    Exactly one of `percent` (7 means +7%) or `amount` (a flat change) must be
+    given; the rows can be narrowed by period and department. Changing every
+    period at once needs `all_periods=True`. Nothing is written if a new value
+    or its net salary would not fit the Payroll columns. net_salary is
+    rewritten in the same UPDATE, so no database trigger is needed, and the
+    affected rollups are rebuilt. Returns the number of rows updated.
+    """
+    if field not in ('base_salary', 'bonuses', 'deductions'):
+        raise ValueError('الحقل يجب أن يكون base_salary أو bonuses أو deductions.')
+    if (percent in (None, '')) == (amount in (None, '')):
+        raise ValueError('حدد نسبة مئوية أو مبلغاً ثابتاً (واحد فقط).')
+    if year is None and month is None and not all_periods:
+        raise ValueError('حدد السنة والشهر، أو اختر التطبيق على كل الفترات صراحة.')
+    value = to_decimal(percent if percent not in (None, '') else amount, default=None)
+    if value is None or not value.is_finite():
+        raise ValueError('القيمة يجب أن تكون رقماً.')
+
+    if percent not in (None, ''):
+        new_value = Round(F(field) * (1 + value / 100), 2)
+    else:
+        new_value = F(field) + value
+    new_fields = {name: F(name) for name in ('base_salary', 'bonuses', 'deductions')}
+    new_fields[field] = new_value
+    new_net = new_fields['base_salary'] + new_fields['bonuses'] - new_fields['deductions']
+
+    with transaction.atomic():
+        payrolls = filter_payrolls(Payroll.objects.all(), year, month, department)
+        # نتحقق قبل التحديث حتى لا يفشل الأمر في منتصفه (DataError على PostgreSQL)
+        out_of_range = (
+            payrolls.annotate(new_value=new_value, new_net=new_net)
+            .filter(
+                Q(new_value__gt=MAX_SALARY) | Q(new_value__lt=-MAX_SALARY)
+                | Q(new_net__gt=MAX_SALARY) | Q(new_net__lt=-MAX_SALARY)
+            )
+        )
+        if out_of_range.exists():
+            raise ValueError('التعديل يجعل بعض الرواتب خارج الحدود المسموحة.')
+        updated = payrolls.update(**{field: new_value, 'net_salary': new_net})
+        bump_data_version(PAYROLL)
+        rebuild_payroll_rollups(year, month)
+    return updated
+
+
+# ----------------------------
+# ملخص الرواتب لكل قسم وشهر
+# ----------------------------
+
+def payroll_rollup_values(payroll):
+    """The (key, amounts) a single Payroll row contributes to PayrollRollup."""
+    key = (payroll.employee.department or '', payroll.year, payroll.month)
+    amounts = (payroll.base_salary, payroll.bonuses, payroll.deductions, payroll.net_salary or 0)
+    return key, amounts
+
+
+def apply_payroll_rollup_delta(key, amounts, sign, headcount=1):
+    """
+    Add (sign=1) or remove (sign=-1) payroll amounts from their rollup.
+
+    `amounts` are the totals of `headcount` rows (one row by default). The
+    counters are changed with a single UPDATE using F() expressions so
+    concurrent edits never overwrite each other. Removing never creates a
+    rollup row: a missing rollup does not hold these amounts in the first place.
+    """
+    department, year, month = key
+    base_salary, bonuses, deductions, net_salary = amounts
+    if sign > 0:
+        PayrollRollup.objects.get_or_create(department=department, year=year, month=month)
+    PayrollRollup.objects.filter(department=department, year=year, month=month).update(
+        headcount=F('headcount') + sign * headcount,
+        total_base_salary=F('total_base_salary') + sign * base_salary,
+        total_bonuses=F('total_bonuses') + sign * bonuses,
+        total_deductions=F('total_deductions') + sign * deductions,
+        total_net_salary=F('total_net_salary') + sign * net_salary,
+    )
+
+
+def move_payroll_rollups(employee_id, old_department, new_department):
+    """
+    Move every payroll row of one employee from one department rollup to another.
+
+    Called when the employee changes department, so the rollups keep matching
+    rebuild_payroll_rollups, which groups by the current department.
+    """
+    totals = (
+        Payroll.objects.filter(employee_id=employee_id)
+        .values('year', 'month')
+        .annotate(
+            headcount=Count('id'),
+            base_salary=Sum('base_salary'),
+            bonuses=Sum('bonuses'),
+            deductions=Sum('deductions'),
+            net_salary=Sum('net_salary'),
+        )
+        .order_by()
+    )
+    for row in totals:
+        amounts = (row['base_salary'], row['bonuses'], row['deductions'], row['net_salary'] or 0)
+        apply_payroll_rollup_delta((old_department or '', row['year'], row['month']), amounts, -1, row['headcount'])
+        apply_payroll_rollup_delta((new_department or '', row['year'], row['month']), amounts, 1, row['headcount'])
+
+
+def rebuild_payroll_rollups(year=None, month=None):
+    """
+    Recompute PayrollRollup from the Payroll table with one aggregate query.
+
+    Without arguments every rollup is rebuilt; with a period only that
+    period's rows are replaced. Returns the number of rollup rows written.
+    """
+    payrolls = filter_payrolls(Payroll.objects.all(), year, month)
+    rollups = PayrollRollup.objects.all()
+    if year is not None:
+        rollups = rollups.filter(year=year)
+    if month is not None:
+        rollups = rollups.filter(month=month)
+
+    totals = (
+        payrolls
+        .values('employee__department', 'year', 'month')
+        .annotate(
+            headcount=Count('id'),
+            total_base_salary=Sum('base_salary'),
+            total_bonuses=Sum('bonuses'),
+            total_deductions=Sum('deductions'),
+            total_net_salary=Sum('net_salary'),
+        )
+        .order_by()
+    )
+    # نجمع في قاموس لأن القسم الفارغ و NULL يمثلان نفس الصف في الملخص
+    merged = {}
+    for row in totals:
+        key = (row['employee__department'] or '', row['year'], row['month'])
+        current = merged.setdefault(key, PayrollRollup(department=key[0], year=key[1], month=key[2]))
+        current.headcount += row['headcount']
+        current.total_base_salary += row['total_base_salary'] or 0
+        current.total_bonuses += row['total_bonuses'] or 0
+        current.total_deductions += row['total_deductions'] or 0
+        current.total_net_salary += row['total_net_salary'] or 0
+
+    with transaction.atomic():
+        rollups.delete()
+        PayrollRollup.objects.bulk_create(merged.values(), batch_size=1000)
+    return len(merged)
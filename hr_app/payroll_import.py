@@ -0,0 +1,209 @@
+# hr_app/payroll_import.py
+"""
+استيراد الرواتب دفعة واحدة من ملفات CSV أو XLSX القادمة من النظام المحاسبي.
+"""
+
+import csv
+import io
+import time
+import zipfile
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import Payroll, Profile
+from .payroll import MAX_SALARY, rebuild_payroll_rollups, to_decimal, validate_period
+from .versions import PAYROLL, bump_data_version
+
+
+# أسماء الأعمدة المقبولة: بالإنجليزية أو بنفس عناوين ملف التصدير العربي
+HEADER_ALIASES = {
+    'username': 'username', 'الموظف': 'username',
+    'year': 'year', 'السنة': 'year',
+    'month': 'month', 'الشهر': 'month',
+    'base_salary': 'base_salary', 'الراتب الأساسي': 'base_salary',
+    'bonuses': 'bonuses', 'العلاوات': 'bonuses',
+    'deductions': 'deductions', 'الخصومات': 'deductions',
+    'remarks': 'remarks', 'ملاحظات': 'remarks',
+}
+REQUIRED_COLUMNS = ('username', 'year', 'month', 'base_salary')
+
+
+def _iter_csv(file_obj):
+    text = io.TextIOWrapper(file_obj, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    try:
+        yield from reader
+    except UnicodeDecodeError:
+        raise ValueError('ملف CSV يجب أن يكون بترميز UTF-8.')
+    except csv.Error as e:
+        # مثل حقل أطول من الحد المسموح أو بايت NUL داخل الملف
+        raise ValueError(f'ملف CSV غير صالح (السطر {reader.line_num}): {e}')
+    finally:
+        text.detach()
+
+
+def _iter_xlsx(file_obj):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ValueError('قراءة ملفات XLSX تتطلب تثبيت مكتبة openpyxl.')
+    # read_only يقرأ الملف صفاً بصف بدلاً من تحميل الورقة كاملة في الذاكرة
+    try:
+        workbook = load_workbook(file_obj, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ValueError('ملف XLSX غير صالح أو تالف.')
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield [_cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    # Excel يخزن الأرقام الصحيحة أحياناً كـ 2025.0، فنعيدها نصاً صحيحاً حتى تقبلها int()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def iter_payroll_rows(file_obj, filename):
+    """Yield (line_number, row_dict) from a CSV or XLSX file, one row at a time."""
+    reader = _iter_xlsx(file_obj) if filename.lower().endswith('.xlsx') else _iter_csv(file_obj)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError('الملف فارغ.')
+    columns = [HEADER_ALIASES.get(str(name or '').strip().lower()) for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ValueError(f"أعمدة مطلوبة غير موجودة في الملف: {', '.join(missing)}")
+
+    for line_number, values in enumerate(reader, start=2):
+        if not any(str(v).strip() for v in values):
+            continue
+        yield line_number, {col: str(v).strip() for col, v in zip(columns, values) if col}
+
+
+def _parse_amount(raw, required=False):
+    """Same rules as to_decimal, but an unparseable value is reported instead of defaulted."""
+    if raw in (None, ''):
+        if required:
+            raise ValueError('القيمة مطلوبة')
+        return Decimal('0.00')
+    value = to_decimal(raw, default=None)
+    if value is None or not value.is_finite():
+        raise ValueError(f'قيمة غير صالحة: {raw}')
+    if value.as_tuple().exponent < -2 or abs(value) > MAX_SALARY:
+        raise ValueError(f'قيمة خارج الحدود المسموحة: {raw}')
+    return value
+
+
+def _parse_row(row, employees):
+    """Turn one row dict into an unsaved Payroll, raising ValueError with the reason."""
+    username = row.get('username', '')
+    employee_id = employees.get(username)
+    if employee_id is None:
+        raise ValueError(f'الموظف غير موجود: {username}')
+    try:
+        # int() وحدها ترفض 2024.9 و 1e3 بدلاً من تقريبها إلى فترة أخرى
+        year, month = int(row.get('year', '')), int(row.get('month', ''))
+    except ValueError:
+        raise ValueError('السنة والشهر يجب أن تكون أرقاماً صحيحة.')
+    year, month = validate_period(year, month)
+
+    fields = {}
+    for name in ('base_salary', 'bonuses', 'deductions'):
+        try:
+            fields[name] = _parse_amount(row.get(name), required=(name == 'base_salary'))
+        except ValueError as e:
+            raise ValueError(f'{name}: {e}')
+    # bulk_create لا يستدعي save()، لذلك نحسب الصافي هنا
+    net_salary = fields['base_salary'] + fields['bonuses'] - fields['deductions']
+    if abs(net_salary) > MAX_SALARY:
+        raise ValueError('صافي الراتب خارج الحدود المسموحة.')
+
+    return Payroll(
+        employee_id=employee_id,
+        year=year,
+        month=month,
+        remarks=row.get('remarks') or None,
+        net_salary=net_salary,
+        **fields,
+    )
+
+
+def _insert_batch(batch, errors):
+    """Drop rows that already exist in the database, then bulk insert the rest."""
+    existing = set(
+        Payroll.objects
+        .filter(employee_id__in={p.employee_id for p in batch.values()}, year__in={p.year for p in batch.values()})
+        .values_list('employee_id', 'year', 'month')
+    )
+    new_rows = []
+    for line_number, payroll in batch.items():
+        if (payroll.employee_id, payroll.year, payroll.month) in existing:
+            errors.append((line_number, 'يوجد راتب مسجل لهذا الموظف في نفس الشهر.'))
+        else:
+            new_rows.append(payroll)
+    Payroll.objects.bulk_create(new_rows)
+    return len(new_rows)
+
+
+def import_payroll_file(file_obj, filename, batch_size=2000):
+    """
+    Import payroll rows from an uploaded CSV/XLSX file.
+
+    The file is parsed as a stream; employees are resolved from one
+    username -> profile id map, and valid rows are inserted with batched
+    bulk_create inside a single transaction. Invalid or duplicate rows are
+    skipped and listed in the returned report:
+    {'rows', 'created', 'failed', 'errors': [(line, message)], 'seconds'}.
+    """
+    started = time.perf_counter()
+    employees = dict(
+        Profile.objects.filter(user__is_superuser=False).values_list('user__username', 'id')
+    )
+    errors = []
+    seen = set()
+    periods = set()
+    rows = created = 0
+
+    with transaction.atomic():
+        batch = {}
+        for line_number, row in iter_payroll_rows(file_obj, filename):
+            rows += 1
+            try:
+                payroll = _parse_row(row, employees)
+            except ValueError as e:
+                errors.append((line_number, str(e)))
+                continue
+            key = (payroll.employee_id, payroll.year, payroll.month)
+            if key in seen:
+                errors.append((line_number, 'الموظف مكرر لنفس الشهر داخل الملف.'))
+                continue
+            seen.add(key)
+            periods.add((payroll.year, payroll.month))
+            batch[line_number] = payroll
+            if len(batch) >= batch_size:
+                created += _insert_batch(batch, errors)
+                batch = {}
+        if batch:
+            created += _insert_batch(batch, errors)
+
+        # bulk_create لا يرسل إشارات، لذلك نعيد بناء ملخص الأشهر المستوردة
+        for year, month in periods:
+            rebuild_payroll_rollups(year, month)
+        if created:
+            bump_data_version(PAYROLL)
+
+    errors.sort()
+    return {
+        'rows': rows,
+        'created': created,
+        'failed': len(errors),
+        'errors': errors,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,171 @@
+# hr_app/payroll_simulator.py
+"""
+محاكاة تأثير سياسات الزيادات والخصومات على الرواتب دون الكتابة في قاعدة البيانات.
+"""
+
+import math
+import threading
+
+import numpy as np
+from django.db.models import Count, Max, Sum
+
+from .models import Payroll
+from .payroll import filter_payrolls
+
+
+SIMULATED_FIELDS = ('base_salary', 'bonuses', 'deductions')
+
+# آخر لقطات تم تحميلها، مفتاحها (السنة، الشهر) وتُستبدل عند تغير بيانات الرواتب
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+MAX_SNAPSHOTS = 8
+
+
+class PayrollSnapshot:
+    """
+    Payroll columns of one scope loaded into NumPy arrays.
+
+    `department_codes[i]` indexes into `departments` for row i; the salary
+    columns are float64 arrays of the same length.
+    """
+
+    def __init__(self, rows):
+        departments, base_salary, bonuses, deductions = zip(*rows) if rows else ((), (), (), ())
+        self.departments, codes = np.unique(np.array([d or '' for d in departments], dtype=object), return_inverse=True)
+        self.department_codes = codes.astype(np.int64)
+        self.columns = {
+            'base_salary': np.array(base_salary, dtype=np.float64),
+            'bonuses': np.array(bonuses, dtype=np.float64),
+            'deductions': np.array(deductions, dtype=np.float64),
+        }
+
+    @classmethod
+    def load(cls, year=None, month=None):
+        rows = list(
+            filter_payrolls(Payroll.objects.all(), year, month)
+            .values_list('employee__department', 'base_salary', 'bonuses', 'deductions')
+        )
+        return cls(rows)
+
+    def net_salary(self, columns=None):
+        columns = columns or self.columns
+        return columns['base_salary'] + columns['bonuses'] - columns['deductions']
+
+
+def _snapshot_version(year, month):
+    # بصمة مأخوذة من جدول الرواتب نفسه: صف مجمّع لكل قسم بدلاً من تحميل كل الصفوف،
+    # فتتغير مع أي إضافة أو حذف أو تعديل أو نقل موظف إلى قسم آخر
+    rows = (
+        filter_payrolls(Payroll.objects.all(), year, month)
+        .values('employee__department')
+        .annotate(Count('id'), Max('id'), Sum('base_salary'), Sum('bonuses'), Sum('deductions'))
+        .order_by()
+    )
+    return tuple(sorted((tuple(row.values()) for row in rows), key=lambda row: (row[0] or '',) + row[1:]))
+
+
+def get_snapshot(year=None, month=None):
+    """Return the cached snapshot for the scope, reloading it only if the payroll data changed."""
+    key = (year, month)
+    version = _snapshot_version(year, month)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+    snapshot = PayrollSnapshot.load(year, month)
+    with _snapshots_lock:
+        if len(_snapshots) >= MAX_SNAPSHOTS:
+            _snapshots.pop(next(iter(_snapshots)))
+        _snapshots[key] = (version, snapshot)
+    return snapshot
+
+
+def validate_rules(rules, departments=None):
+    """
+    Check scenario rules and return them normalised.
+
+    Each rule is {'field': one of SIMULATED_FIELDS, 'department': optional,
+    and exactly one of 'percent' (e.g. 7 for +7%) or 'amount' (flat change)}.
+    When `departments` is given, a rule naming any other department is rejected.
+    """
+    if not isinstance(rules, list) or not rules:
+        raise ValueError('يجب تحديد قاعدة واحدة على الأقل.')
+    cleaned = []
+    for index, rule in enumerate(rules, start=1):
+        if not isinstance(rule, dict):
+            raise ValueError(f'القاعدة {index} غير صالحة.')
+        field = rule.get('field', 'base_salary')
+        if not isinstance(field, str) or field not in SIMULATED_FIELDS:
+            raise ValueError(f"القاعدة {index}: الحقل يجب أن يكون أحد {', '.join(SIMULATED_FIELDS)}.")
+        if ('percent' in rule) == ('amount' in rule):
+            raise ValueError(f'القاعدة {index}: حدد percent أو amount (واحد فقط).')
+        value = rule['percent'] if 'percent' in rule else rule['amount']
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'القاعدة {index}: القيمة يجب أن تكون رقماً.')
+        try:
+            value = float(value)
+        except OverflowError:
+            value = math.inf
+        if not math.isfinite(value):
+            raise ValueError(f'القاعدة {index}: القيمة يجب أن تكون رقماً محدوداً.')
+        department = rule.get('department') or None
+        if department is not None and not isinstance(department, str):
+            raise ValueError(f'القاعدة {index}: القسم يجب أن يكون نصاً.')
+        if department is not None and departments is not None and department not in departments:
+            raise ValueError(f'القاعدة {index}: القسم غير موجود: {department}')
+        cleaned.append({
+            'field': field,
+            'department': department,
+            'kind': 'percent' if 'percent' in rule else 'amount',
+            'value': value,
+        })
+    return cleaned
+
+
+def simulate(snapshot, rules):
+    """
+    Apply the rules to copies of the snapshot columns and return the net salary deltas.
+
+    Rules are applied in order, each one as a single vectorised operation over
+    the rows of its department (or all rows).
+    """
+    columns = {name: values.copy() for name, values in snapshot.columns.items()}
+    department_index = {name: code for code, name in enumerate(snapshot.departments)}
+
+    for rule in rules:
+        target = columns[rule['field']]
+        if rule['department'] is None:
+            mask = slice(None)
+        elif rule['department'] in department_index:
+            mask = snapshot.department_codes == department_index[rule['department']]
+        else:
+            continue
+        if rule['kind'] == 'percent':
+            target[mask] *= 1 + rule['value'] / 100
+        else:
+            target[mask] += rule['value']
+
+    current = snapshot.net_salary()
+    simulated = snapshot.net_salary(columns)
+    department_count = len(snapshot.departments)
+    codes = snapshot.department_codes
+    headcount = np.bincount(codes, minlength=department_count)
+    current_totals = np.bincount(codes, weights=current, minlength=department_count)
+    simulated_totals = np.bincount(codes, weights=simulated, minlength=department_count)
+
+    def summary(count, before, after):
+        return {
+            'headcount': int(count),
+            'current_net_salary': round(float(before), 2),
+            'simulated_net_salary': round(float(after), 2),
+            'delta': round(float(after - before), 2),
+            'delta_percent': round(float((after - before) / before * 100), 2) if before else None,
+        }
+
+    return {
+        'departments': {
+            (name or 'بدون قسم'): summary(headcount[code], current_totals[code], simulated_totals[code])
+            for code, name in enumerate(snapshot.departments)
+        },
+        'company': summary(len(codes), current.sum(), simulated.sum()),
+    }
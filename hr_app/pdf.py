@@ -0,0 +1,258 @@
+# hr_app/pdf.py
+"""
+توليد ملفات PDF عبر Playwright باستخدام مجموعة متصفحات دائمة (Browser Pool)
+بدلاً من تشغيل Chromium جديد مع كل طلب.
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import threading
+import time
+
+from django.conf import settings
+from playwright.async_api import async_playwright
+
+logger = logging.getLogger(__name__)
+
+PDF_OPTIONS = {
+    'format': 'A4',
+    'print_background': True,
+    'margin': {'top': '20mm', 'bottom': '20mm', 'left': '20mm', 'right': '20mm'},
+}
+
+
+class PoolBusy(Exception):
+    """Raised when the render queue is full and the job cannot be accepted."""
+
+
+class RenderTimeout(Exception):
+    """Raised when a job does not finish within its timeout."""
+
+
+class BrowserPool:
+    """
+    A long-lived pool of warm Chromium contexts.
+
+    The pool owns a background thread running its own asyncio loop; `size`
+    worker coroutines each keep one browser and context open and take jobs from
+    a bounded queue. A browser is recycled after `max_jobs_per_browser` renders.
+    `render()` is synchronous so it can be called from regular Django views.
+    If a relaunch fails the worker logs it and retries with a growing delay
+    (up to `max_launch_delay` seconds) instead of leaving the pool smaller.
+    """
+
+    def __init__(self, size=2, max_jobs_per_browser=100, queue_size=20, job_timeout=30, max_launch_delay=30):
+        self.size = size
+        self.max_jobs_per_browser = max_jobs_per_browser
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.max_launch_delay = max_launch_delay
+
+        self._loop = None
+        self._thread = None
+        self._queue = None
+        self._playwright = None
+        self._workers = []
+        self._start_lock = threading.Lock()
+
+        self._rendered = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._recycles = 0
+        self._launch_failures = 0
+        self._in_flight = 0
+        self._total_latency = 0.0
+        self._last_latency = 0.0
+
+    # --- Public API (called from request threads) ---
+
+    def render(self, html, timeout=None):
+        """Render `html` to PDF bytes, waiting at most `timeout` seconds."""
+        self._ensure_started()
+        timeout = timeout or self.job_timeout
+        future = asyncio.run_coroutine_threadsafe(self._submit(html, timeout), self._loop)
+        try:
+            # هامش صغير حتى تنتهي مهلة الحلقة الداخلية أولاً
+            return future.result(timeout + 5)
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+            # إلغاء الطلب يلغي التوليد الجاري في العامل أيضاً (انظر _worker)
+            future.cancel()
+            raise RenderTimeout(f'PDF render did not finish within {timeout}s')
+
+    def metrics(self):
+        rendered = self._rendered
+        return {
+            'size': self.size,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'queue_size': self.queue_size,
+            'in_flight': self._in_flight,
+            'rendered': rendered,
+            'failed': self._failed,
+            'timeouts': self._timeouts,
+            'rejected': self._rejected,
+            'recycles': self._recycles,
+            'launch_failures': self._launch_failures,
+            'avg_latency_ms': round(self._total_latency / rendered * 1000, 1) if rendered else 0,
+            'last_latency_ms': round(self._last_latency * 1000, 1),
+        }
+
+    def shutdown(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(30)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop = self._thread = self._queue = None
+
+    # --- Internals (run inside the pool's event loop) ---
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='pdf-browser-pool', daemon=True)
+            thread.start()
+            try:
+                asyncio.run_coroutine_threadsafe(self._start(), loop).result(60)
+            except Exception:
+                loop.call_soon_threadsafe(loop.stop)
+                raise
+            self._loop, self._thread = loop, thread
+
+    async def _start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._playwright = await async_playwright().start()
+        # نشغل المتصفحات مسبقاً حتى يظهر أي خطأ في التشغيل هنا وليس داخل العمال
+        browsers = []
+        try:
+            for _ in range(self.size):
+                browsers.append(await self._launch())
+        except BaseException:
+            # لا نترك المتصفحات التي عملت ولا Playwright نفسه يعملان بعد فشل البدء
+            for browser, _ in browsers:
+                await self._close_browser(browser)
+            await self._playwright.stop()
+            self._playwright = None
+            raise
+        self._workers = [asyncio.create_task(self._worker(*pair)) for pair in browsers]
+
+    async def _stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self._playwright.stop()
+
+    async def _submit(self, html, timeout):
+        result = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((html, result))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise PoolBusy('PDF render queue is full')
+        try:
+            return await asyncio.wait_for(result, timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+
+    async def _launch(self):
+        browser = await self._playwright.chromium.launch()
+        try:
+            context = await browser.new_context()
+        except BaseException:
+            await self._close_browser(browser)
+            raise
+        return browser, context
+
+    async def _close_browser(self, browser):
+        try:
+            await browser.close()
+        except Exception:
+            logger.warning('Closing a PDF browser failed', exc_info=True)
+
+    async def _relaunch(self, browser):
+        """Close `browser` and launch a replacement, retrying until it succeeds."""
+        await self._close_browser(browser)
+        delay = 1
+        while True:
+            try:
+                return await self._launch()
+            except Exception:
+                self._launch_failures += 1
+                logger.exception('Relaunching a PDF browser failed, retrying in %ss', delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_launch_delay)
+
+    async def _worker(self, browser, context):
+        jobs = 0
+        try:
+            while True:
+                html, result = await self._queue.get()
+                if result.done():
+                    # انتهت مهلة الطلب وهو ما زال في الطابور
+                    continue
+                self._in_flight += 1
+                started = time.perf_counter()
+                render = asyncio.ensure_future(self._render(context, html))
+                # عند انتهاء مهلة الطلب يُلغى result، فنلغي التوليد ونغلق صفحته بدلاً من تركه يعمل
+                result.add_done_callback(lambda _, render=render: render.cancel())
+                try:
+                    await asyncio.wait({render})
+                finally:
+                    render.cancel()
+                    self._in_flight -= 1
+                # التوليد الملغى انتهت مهلته وقد حُسب في _submit
+                error = None if render.cancelled() else render.exception()
+                if error is not None:
+                    self._failed += 1
+                    if not result.done():
+                        result.set_exception(error)
+                elif not render.cancelled():
+                    elapsed = time.perf_counter() - started
+                    self._rendered += 1
+                    self._total_latency += elapsed
+                    self._last_latency = elapsed
+                    if not result.done():
+                        result.set_result(render.result())
+
+                jobs += 1
+                if jobs >= self.max_jobs_per_browser or not browser.is_connected():
+                    browser, context = await self._relaunch(browser)
+                    jobs = 0
+                    self._recycles += 1
+        finally:
+            await browser.close()
+
+    async def _render(self, context, html):
+        page = await context.new_page()
+        try:
+            await page.set_content(html)
+            # ننتظر حتى يتم تحميل كل شيء (مثل الخطوط) من الشبكة
+            await page.wait_for_load_state('networkidle')
+            return await page.pdf(**PDF_OPTIONS)
+        finally:
+            await page.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool():
+    """Return the process-wide BrowserPool, configured from settings."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(
+                size=settings.PDF_POOL_SIZE,
+                max_jobs_per_browser=settings.PDF_POOL_MAX_JOBS_PER_BROWSER,
+                queue_size=settings.PDF_POOL_QUEUE_SIZE,
+                job_timeout=settings.PDF_POOL_JOB_TIMEOUT,
+            )
+            atexit.register(_pool.shutdown)
+        return _pool
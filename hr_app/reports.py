@@ -0,0 +1,284 @@
+# hr_app/reports.py
+"""
+مهام تقارير الرواتب في الخلفية مع تخزين ملفات PDF على القرص حسب بصمة البيانات،
+وتوليد قسائم الرواتب الفردية دفعة واحدة داخل ملف ZIP.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Payroll, ReportJob
+from .payroll import filter_payrolls
+from .pdf import get_browser_pool
+from .versions import PAYROLL, data_version
+
+
+PAYROLL_REPORT_TEMPLATE = 'payroll_pdf_template.html'
+PAYSLIP_TEMPLATE = 'payslip_pdf_template.html'
+
+# عدد مرات إعادة التوليد إذا تغيرت البيانات أثناء توليد التقرير
+REPORT_RENDER_ATTEMPTS = 3
+
+_executor = None
+
+
+class ReportDataChanged(Exception):
+    """The payroll data kept changing while the report was being rendered."""
+
+
+def payroll_report_queryset():
+    return Payroll.objects.select_related('employee__user').order_by('employee__user__username', 'id')
+
+
+def payroll_report_hash():
+    """
+    SHA-256 of the template name and the payroll data version.
+
+    The version is bumped by the signals and the bulk payroll paths whenever a
+    payroll row or an employee name changes (see hr_app.versions), so this is
+    one primary-key lookup instead of a walk over the Payroll table.
+    """
+    digest = hashlib.sha256(PAYROLL_REPORT_TEMPLATE.encode())
+    digest.update(repr(data_version(PAYROLL)).encode())
+    return digest.hexdigest()
+
+
+def cached_report_path(content_hash):
+    return os.path.join(settings.REPORT_CACHE_DIR, f'payroll_{content_hash}.pdf')
+
+
+def evict_report_cache(keep=None):
+    """
+    Delete the least recently used cached PDFs beyond the newest `keep` files.
+
+    `keep` defaults to settings.REPORT_CACHE_MAX_FILES. Returns the number of
+    files removed.
+    """
+    keep = settings.REPORT_CACHE_MAX_FILES if keep is None else keep
+    try:
+        entries = [e for e in os.scandir(settings.REPORT_CACHE_DIR) if e.name.endswith('.pdf') and e.is_file()]
+    except FileNotFoundError:
+        return 0
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    removed = 0
+    for entry in entries[keep:]:
+        try:
+            os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            # حذفه عامل آخر في نفس اللحظة
+            pass
+    return removed
+
+
+def build_payroll_report(content_hash=None):
+    """
+    Return (content_hash, path) of the cached PDF for the current payroll data.
+
+    The PDF is rendered first if it is not on disk. The hash is read again
+    after rendering; if the data changed in the meantime the render is thrown
+    away and repeated under the new hash, so a cached file never holds older
+    rows than its name says. Raises ReportDataChanged if that keeps happening.
+    """
+    for _ in range(REPORT_RENDER_ATTEMPTS):
+        content_hash = content_hash or payroll_report_hash()
+        path = cached_report_path(content_hash)
+        if os.path.exists(path):
+            # نحدّث وقت التعديل حتى يبقى الملف المستخدم حديثاً عند التنظيف
+            os.utime(path)
+            return content_hash, path
+
+        html = render_to_string(PAYROLL_REPORT_TEMPLATE, {
+            'payrolls': payroll_report_queryset(),
+            'export_date': timezone.now().strftime('%Y-%m-%d %H:%M'),
+        })
+        pdf_bytes = get_browser_pool().render(html)
+        if payroll_report_hash() == content_hash:
+            _write_report(path, pdf_bytes)
+            return content_hash, path
+        content_hash = None
+    raise ReportDataChanged('تتغير بيانات الرواتب أثناء توليد التقرير، يرجى المحاولة بعد قليل.')
+
+
+def _write_report(path, pdf_bytes):
+    # نكتب في ملف مؤقت باسم فريد لكل خيط ثم نعيد تسميته حتى لا يُقرأ ملف غير مكتمل
+    os.makedirs(settings.REPORT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.REPORT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    evict_report_cache()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.REPORT_WORKERS, thread_name_prefix='report-job')
+    return _executor
+
+
+def _run_job(job_id):
+    close_old_connections()
+    job = ReportJob.objects.get(id=job_id)
+    try:
+        job.status = 'Running'
+        job.save(update_fields=['status'])
+        # إذا تغيرت البيانات قبل التوليد يُحفظ التقرير الأحدث تحت بصمة جديدة
+        job.content_hash, _ = build_payroll_report(job.content_hash)
+        job.status = 'Done'
+    except Exception as e:
+        job.status = 'Failed'
+        job.error = str(e)
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['content_hash', 'status', 'error', 'finished_at'])
+        close_old_connections()
+
+
+def enqueue_payroll_report(user):
+    """
+    Create a ReportJob for the current payroll report and hand it to a worker.
+
+    If the PDF for the current data is already on disk the job is finished
+    immediately; if an identical job is still pending it is returned instead of
+    starting a second render. Jobs pending or running for longer than
+    settings.REPORT_JOB_STALE_SECONDS (e.g. lost in a restart) are marked
+    failed and a new job is started.
+    """
+    content_hash = payroll_report_hash()
+    if os.path.exists(cached_report_path(content_hash)):
+        return ReportJob.objects.create(
+            requested_by=user, content_hash=content_hash, status='Done', finished_at=timezone.now()
+        )
+
+    now = timezone.now()
+    in_progress = ReportJob.objects.filter(content_hash=content_hash, status__in=['Pending', 'Running'])
+    in_progress.filter(created_at__lt=now - timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS)).update(
+        status='Failed', error='انتهت مهلة المهمة قبل اكتمالها.', finished_at=now,
+    )
+    in_progress = in_progress.first()
+    if in_progress:
+        return in_progress
+
+    job = ReportJob.objects.create(requested_by=user, content_hash=content_hash)
+    transaction.on_commit(lambda: _get_executor().submit(_run_job, job.id))
+    return job
+
+
+# ----------------------------
+# قسائم الرواتب الفردية
+# ----------------------------
+
+PAYSLIP_COLUMNS = (
+    'year', 'month', 'employee__user__username', 'employee__user__first_name', 'employee__user__last_name',
+    'employee__department', 'base_salary', 'bonuses', 'deductions', 'net_salary', 'remarks',
+)
+
+
+def payslip_rows(year, month, department=None):
+    """Stream the payslip data of one period as dicts, without model instances."""
+    rows = (
+        filter_payrolls(Payroll.objects.all(), year, month, department)
+        .order_by('employee__user__username')
+        .values(*PAYSLIP_COLUMNS)
+    )
+    return rows.iterator(chunk_size=500)
+
+
+def _render_payslip(pool, slip):
+    """Render one payslip; returns (filename, pdf_bytes, error)."""
+    filename = f"payslip_{slip['year']}_{slip['month']:02d}_{slip['employee__user__username']}.pdf"
+    full_name = f"{slip['employee__user__first_name']} {slip['employee__user__last_name']}".strip()
+    try:
+        html = render_to_string(PAYSLIP_TEMPLATE, {'slip': slip, 'full_name': full_name})
+        return filename, pool.render(html), None
+    except Exception as e:
+        return filename, None, str(e)
+
+
+def iter_payslip_pdfs(rows, window=None):
+    """
+    Render payslips on a thread pool and yield (filename, pdf_bytes, error) as they finish.
+
+    At most `window` payslips are in flight at once, so memory stays bounded
+    no matter how many employees are in the period.
+    """
+    window = window or settings.PDF_POOL_SIZE * 2
+    pool = get_browser_pool()
+    with ThreadPoolExecutor(max_workers=window, thread_name_prefix='payslip') as executor:
+        pending = set()
+        for slip in rows:
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(_render_payslip, pool, slip))
+        for future in wait(pending).done:
+            yield future.result()
+
+
+class _ZipStream:
+    """ملف وهمي للكتابة فقط: zipfile يكتب فيه ونفرغ البيانات بعد كل قسيمة."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_payslips_zip(rows, stats=None):
+    """
+    Yield the bytes of a ZIP holding one PDF per payslip row.
+
+    Each PDF is written and released as soon as it is rendered. A summary.txt
+    with the count, failures and throughput (payslips per second) closes the
+    archive; the same figures are stored in `stats` if a dict is given.
+    """
+    stats = {} if stats is None else stats
+    started = time.perf_counter()
+    rendered, errors = 0, []
+    buffer = _ZipStream()
+    # ملفات PDF مضغوطة أصلاً، لذلك نخزنها بدون ضغط إضافي
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, pdf_bytes, error in iter_payslip_pdfs(rows):
+            if error:
+                errors.append(f'{filename}: {error}')
+                continue
+            archive.writestr(filename, pdf_bytes)
+            rendered += 1
+            yield buffer.pop()
+
+        elapsed = time.perf_counter() - started
+        stats.update({
+            'rendered': rendered,
+            'failed': len(errors),
+            'seconds': round(elapsed, 2),
+            'payslips_per_second': round(rendered / elapsed, 2) if elapsed else 0,
+        })
+        summary = [f'{key}: {value}' for key, value in stats.items()] + errors
+        archive.writestr('summary.txt', '\n'.join(summary))
+    yield buffer.pop()
@@ -0,0 +1,160 @@
+# hr_app/signals.py
+"""
+إبقاء جداول الملخص محدثة عند إضافة أو تعديل أو حذف السجلات.
+"""
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .messaging import add_unread, thread_root_of
+from .models import Attendance, Message, Notification, Payroll, Profile
+from .payroll import apply_payroll_rollup_delta, move_payroll_rollups, payroll_rollup_values
+from .timekeeping import apply_attendance_summary_delta, archiving_attendance, attendance_summary_values
+from .versions import ATTENDANCE, PAYROLL, bump_data_version
+
+# حقول المستخدم التي يعرضها تقرير الرواتب
+PAYROLL_REPORT_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+def deleted_with_owner(origin):
+    """True if a delete was started from a User or Profile, whose own rows are removed by the cascade."""
+    # origin هو الكائن أو الـ QuerySet الذي بدأ الحذف المتسلسل
+    return getattr(origin, 'model', type(origin)) in (User, Profile)
+
+
+@receiver(pre_save, sender=Payroll)
+def remember_payroll_rollup(sender, instance, **kwargs):
+    # نحفظ القيم القديمة قبل التعديل حتى نطرحها من الملخص بعد الحفظ
+    instance._rollup_previous = None
+    if instance.pk:
+        previous = Payroll.objects.select_related('employee').filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._rollup_previous = payroll_rollup_values(previous)
+
+
+@receiver(post_save, sender=Payroll)
+def update_payroll_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        apply_payroll_rollup_delta(*previous, sign=-1)
+    apply_payroll_rollup_delta(*payroll_rollup_values(instance), sign=1)
+    bump_data_version(PAYROLL)
+
+
+@receiver(post_delete, sender=Payroll)
+def remove_payroll_rollup(sender, instance, **kwargs):
+    apply_payroll_rollup_delta(*payroll_rollup_values(instance), sign=-1)
+    bump_data_version(PAYROLL)
+
+
+@receiver(post_save, sender=User)
+def bump_payroll_version_on_rename(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # حفظ last_login عند كل دخول لا يغير التقرير
+    if raw or created or (update_fields is not None and not PAYROLL_REPORT_USER_FIELDS & set(update_fields)):
+        return
+    bump_data_version(PAYROLL)
+
+
+@receiver(pre_save, sender=Profile)
+def remember_profile_department(sender, instance, **kwargs):
+    instance._department_previous = None
+    if instance.pk:
+        instance._department_previous = Profile.objects.filter(pk=instance.pk).values_list('department', flat=True).first()
+
+
+@receiver(post_save, sender=Profile)
+def move_profile_rollups(sender, instance, created, raw=False, **kwargs):
+    # ملخص الرواتب مجمع حسب القسم الحالي، لذلك ننقل رواتب الموظف عند تغيير قسمه
+    if raw or created:
+        return
+    previous = getattr(instance, '_department_previous', None)
+    if (previous or '') != (instance.department or ''):
+        move_payroll_rollups(instance.pk, previous, instance.department)
+        # تحليلات الحضور مجمعة حسب القسم أيضاً
+        bump_data_version(ATTENDANCE)
+
+
+@receiver(post_delete, sender=Profile)
+def bump_attendance_version_on_delete(sender, instance, **kwargs):
+    # سجلات حضور الموظف المحذوف تُحذف معه دون تغيير الإصدار لكل سجل (انظر remove_attendance_summary)
+    bump_data_version(ATTENDANCE)
+
+
+@receiver(pre_save, sender=Attendance)
+def remember_attendance_summary(sender, instance, **kwargs):
+    instance._summary_previous = None
+    if instance.pk:
+        previous = Attendance.objects.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._summary_previous = attendance_summary_values(previous)
+
+
+@receiver(post_save, sender=Attendance)
+def update_attendance_summary(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_summary_previous', None)
+    if previous is not None:
+        apply_attendance_summary_delta(*previous, sign=-1)
+    apply_attendance_summary_delta(*attendance_summary_values(instance), sign=1)
+    bump_data_version(ATTENDANCE)
+
+
+@receiver(post_delete, sender=Attendance)
+def remove_attendance_summary(sender, instance, origin=None, **kwargs):
+    # عند حذف الموظف نفسه يُحذف ملخصه أيضاً، والسجل المؤرشف يبقى محسوباً فيه
+    if deleted_with_owner(origin) or archiving_attendance.get():
+        return
+    apply_attendance_summary_delta(*attendance_summary_values(instance), sign=-1)
+    bump_data_version(ATTENDANCE)
+
+
+# الرسائل والإشعارات المنشأة أو المعدلة بشكل فردي (مثل لوحة الإدارة)؛ المسارات الجماعية
+# في hr_app.messaging تحدّث العدادات بنفسها لأن bulk_create و update لا يرسلان إشارات
+UNREAD_FIELDS = {Message: ('recipient_id', 'messages'), Notification: ('user_id', 'notifications')}
+
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=Notification)
+def remember_unread(sender, instance, **kwargs):
+    instance._unread_previous = None
+    if instance.pk:
+        owner_field, _ = UNREAD_FIELDS[sender]
+        instance._unread_previous = sender.objects.filter(pk=instance.pk, is_read=False).values_list(owner_field, flat=True).first()
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=Notification)
+def update_unread(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    owner_field, counter = UNREAD_FIELDS[sender]
+    previous = getattr(instance, '_unread_previous', None)
+    if previous is not None:
+        add_unread([previous], counter, -1)
+    if not instance.is_read:
+        add_unread([getattr(instance, owner_field)], counter, 1)
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Notification)
+def remove_unread(sender, instance, origin=None, **kwargs):
+    owner_field, counter = UNREAD_FIELDS[sender]
+    owner_id = getattr(instance, owner_field)
+    # حذف المستخدم نفسه يحذف عداده أيضاً؛ أما رسائل المرسل المحذوف فتُطرح من عداد مستلمها
+    if (isinstance(origin, User) and origin.pk == owner_id) or (isinstance(origin, Profile) and origin.user_id == owner_id):
+        return
+    if not instance.is_read:
+        add_unread([owner_id], counter, -1)
+
+
+@receiver(post_save, sender=Message)
+def assign_thread_root(sender, instance, created, raw=False, **kwargs):
+    # الرسائل المنشأة خارج send_messages (مثل لوحة الإدارة) تُضاف إلى محادثتها هنا
+    if raw or not created or instance.thread_root is not None:
+        return
+    instance.thread_root = thread_root_of(instance.reply_to) if instance.reply_to_id else instance.pk
+    Message.objects.filter(pk=instance.pk).update(thread_root=instance.thread_root)
@@ -1,3 +1,1004 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import IntegrityError, OperationalError, connection, connections
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import attendance_analytics
+from .attendance_analytics import get_attendance_analytics
+from .events import InProcessBroker
+from .leaves import rebuild_leave_balances, set_leave_status
+from .messaging import (
+    broadcast_announcement, decode_inbox_cursor, inbox_page, inbox_threads, mark_message_read, notify,
+    rebuild_unread_counters, send_messages, unread_counts,
+)
+from .models import (
+    Attendance, AttendanceSummary, LeaveBalance, LeaveRequest, Message, Notification, Payroll, PayrollRollup, Profile,
+    ReportJob, UnreadCounter,
+)
+from .pdf import BrowserPool, RenderTimeout
+from .payroll import adjust_salaries, rebuild_payroll_rollups, run_monthly_payroll
+from .payroll_import import import_payroll_file
+from .reports import build_payroll_report, cached_report_path, payroll_report_hash
+from .timekeeping import (
+    archive_attendance, attendance_history, decode_attendance_cursor, filter_attendances, mark_absences,
+    rebuild_attendance_summaries, record_punches, record_web_punch,
+)
+from .versions import PAYROLL, bump_data_version
+
+
+def run_in_parallel(target, jobs):
+    """Start one thread per job at the same moment and return the exceptions they raised."""
+    barrier = threading.Barrier(len(jobs))
+    errors = []
+
+    def worker(job):
+        try:
+            barrier.wait()
+            # قاعدة SQLite الخاصة بالاختبارات ترفض الكاتب الثاني فوراً بدلاً من انتظاره،
+            # فنعيد المحاولة هنا؛ على PostgreSQL تنتظر الأقفال ولا يظهر هذا الخطأ
+            for attempt in range(30):
+                try:
+                    return target(*job)
+                except OperationalError as e:
+                    if connection.vendor != 'sqlite' or 'locked' not in str(e) or attempt == 29:
+                        raise
+                    time.sleep(random.uniform(0, min(0.25, 0.002 * 2 ** attempt)))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(job,)) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrentAttendanceTests(TransactionTestCase):
+    """Many clients punching at the same moment must not create duplicates or lose updates."""
+
+    employees = 10
+    clients_per_employee = 8
+
+    def setUp(self):
+        self.profiles = [
+            Profile.objects.create(user=User.objects.create_user(f'emp{i}', password='x'), user_type='Employee')
+            for i in range(self.employees)
+        ]
+        self.moment = timezone.make_aware(datetime(2025, 1, 6, 8, 0))
+
+    def test_parallel_check_in_and_check_out(self):
+        jobs = [
+            (profile.id, 'check_in', self.moment)
+            for profile in self.profiles
+            for _ in range(self.clients_per_employee)
+        ]
+        self.assertEqual(run_in_parallel(record_web_punch, jobs), [])
+
+        check_out = self.moment.replace(hour=16, minute=30)
+        jobs = [
+            (profile.id, 'check_out', check_out)
+            for profile in self.profiles
+            for _ in range(self.clients_per_employee)
+        ]
+        self.assertEqual(run_in_parallel(record_web_punch, jobs), [])
+
+        day = timezone.localtime(self.moment).date()
+        self.assertEqual(Attendance.objects.filter(date=day).count(), self.employees)
+        for row in Attendance.objects.filter(date=day):
+            self.assertIsNotNone(row.check_in)
+            self.assertIsNotNone(row.check_out)
+            self.assertEqual(str(row.hours_worked), '8.50')
+
+        # كل موظف محسوب مرة واحدة فقط في الملخص الشهري، وساعاته مضافة مرة واحدة
+        summaries = AttendanceSummary.objects.filter(year=day.year, month=day.month)
+        self.assertEqual(summaries.count(), self.employees)
+        for summary in summaries:
+            self.assertEqual(summary.present_count, 1)
+            self.assertEqual(str(summary.total_hours), '8.50')
+
+    def test_parallel_terminal_batches(self):
+        # كل جهاز يرسل بصمة مختلفة لنفس الموظفين؛ الدمج يجب أن يحتفظ بأول دخول وآخر خروج من كل الأجهزة
+        batches = []
+        for terminal in range(self.clients_per_employee):
+            batches.append(([
+                {
+                    'employee': profile.user.username,
+                    'timestamp': self.moment.replace(minute=terminal).isoformat(),
+                    'action': 'check_in',
+                }
+                for profile in self.profiles
+            ] + [
+                {
+                    'employee': profile.user.username,
+                    'timestamp': self.moment.replace(hour=17, minute=terminal).isoformat(),
+                    'action': 'check_out',
+                }
+                for profile in self.profiles
+            ],))
+        self.assertEqual(run_in_parallel(record_punches, batches), [])
+
+        day = timezone.localtime(self.moment).date()
+        rows = Attendance.objects.filter(date=day)
+        self.assertEqual(rows.count(), self.employees)
+        last = self.clients_per_employee - 1
+        for row in rows:
+            self.assertEqual(row.check_in, timezone.localtime(self.moment).time())
+            self.assertEqual(row.check_out, timezone.localtime(self.moment.replace(hour=17, minute=last)).time())
+
+    def test_check_out_before_check_in_is_rejected(self):
+        result = record_punches([
+            {'employee': 'emp0', 'timestamp': self.moment.isoformat(), 'action': 'check_in'},
+            {'employee': 'emp0', 'timestamp': self.moment.replace(hour=7).isoformat(), 'action': 'check_out'},
+        ])
+        self.assertEqual([r['index'] for r in result['rejected']], [1])
+        row = Attendance.objects.get(employee=self.profiles[0])
+        self.assertIsNone(row.check_out)
+        self.assertIsNone(row.hours_worked)
+
+    def test_duplicate_rows_are_rejected(self):
+        Attendance.objects.create(employee=self.profiles[0], date=datetime(2025, 1, 6).date())
+        with self.assertRaises(IntegrityError):
+            Attendance.objects.create(employee=self.profiles[0], date=datetime(2025, 1, 6).date())
+
+
+class PayrollRollupTests(TestCase):
+    """The per-department rollups must always match a full rebuild."""
+
+    def setUp(self):
+        user = User.objects.create_user('emp', password='x')
+        self.profile = Profile.objects.create(user=user, user_type='Employee', department='IT')
+        self.payroll = Payroll.objects.create(employee=self.profile, year=2025, month=1, base_salary=1000, net_salary=1000)
+
+    def rollups(self):
+        # الملخصات الفارغة تبقى بعد الطرح ولا يعيد البناء إنشاءها
+        rows = PayrollRollup.objects.exclude(headcount=0)
+        return sorted(rows.values_list('department', 'year', 'month', 'headcount', 'total_base_salary'))
+
+    def assertMatchesRebuild(self):
+        live = self.rollups()
+        rebuild_payroll_rollups()
+        self.assertEqual(live, self.rollups())
+
+    def test_department_change_moves_rollups(self):
+        self.profile.department = 'HR'
+        self.profile.save()
+        # التعديل بعد تغيير القسم يطرح من ملخص القسم الجديد وليس القديم
+        payroll = Payroll.objects.get(pk=self.payroll.pk)
+        payroll.base_salary = 1500
+        payroll.save()
+        self.assertEqual([row[:4] for row in self.rollups()], [('HR', 2025, 1, 1)])
+        self.assertMatchesRebuild()
+
+    def test_deleting_the_employee(self):
+        self.profile.user.delete()
+        self.assertEqual(self.rollups(), [])
+
+
+class AdjustSalariesTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('emp', password='x')
+        profile = Profile.objects.create(user=user, user_type='Employee', department='IT')
+        self.payroll = Payroll.objects.create(employee=profile, year=2025, month=1, base_salary=1000)
+
+    def test_all_periods_must_be_explicit(self):
+        with self.assertRaises(ValueError):
+            adjust_salaries(percent='10')
+        self.assertEqual(adjust_salaries(percent='10', all_periods=True), 1)
+        self.payroll.refresh_from_db()
+        self.assertEqual(str(self.payroll.net_salary), '1100.00')
+
+    def test_out_of_range_values_are_rejected(self):
+        with self.assertRaises(ValueError):
+            adjust_salaries(amount='99999999', year=2025, month=1)
+        self.payroll.refresh_from_db()
+        self.assertEqual(str(self.payroll.base_salary), '1000.00')
+
+
+class MonthlyPayrollRunTests(TestCase):
+    """New hires without an earlier payroll row are reported instead of silently skipped."""
+
+    def setUp(self):
+        joined = datetime(2024, 1, 1).date()
+        self.veteran = Profile.objects.create(user=User.objects.create_user('veteran', password='x'), date_joined=joined)
+        Payroll.objects.create(employee=self.veteran, year=2025, month=1, base_salary=1000)
+        Profile.objects.create(user=User.objects.create_user('newhire', password='x'), date_joined=joined)
+        manual = Profile.objects.create(user=User.objects.create_user('manual', password='x'), date_joined=joined)
+        Payroll.objects.create(employee=manual, year=2025, month=2, base_salary=800)
+
+    def test_new_hires_are_reported(self):
+        run = run_monthly_payroll(2025, 2)
+        self.assertEqual(run.created_count, 1)
+        self.assertEqual(run.missing_salary_count, 1)
+        self.assertEqual(run.missing_usernames, ['newhire'])
+
+    @override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_view_warns_about_new_hires(self):
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        response = self.client.post(reverse('payroll_run'), {'year': 2025, 'month': 2}, follow=True)
+        self.assertContains(response, 'alert-warning')
+        self.assertContains(response, 'newhire')
+
+
+class PayrollExportTests(TestCase):
+    """The CSV export is streamed and honours the period and department filters."""
+
+    def setUp(self):
+        finance = User.objects.create_user('finance', password='x')
+        Profile.objects.create(user=finance, user_type='Finance')
+        self.client.force_login(finance)
+        for username, department in (('ali', 'IT'), ('sara', 'HR')):
+            profile = Profile.objects.create(user=User.objects.create_user(username, password='x'), department=department)
+            for month in (1, 2):
+                Payroll.objects.create(employee=profile, year=2025, month=month, base_salary=1000, bonuses=month, remarks='ok')
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_payroll'), params)
+        self.assertTrue(response.streaming)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+
+    def test_streamed_rows(self):
+        rows = self.export()
+        self.assertEqual(rows[0][0], 'الموظف')
+        self.assertEqual(len(rows), 5)
+        self.assertIn(['ali', '2025', '2', '1000.00', '2.00', '0.00', '1002.00', 'ok'], rows)
+
+    def test_filters(self):
+        rows = self.export(year=2025, month=1, department='HR')
+        self.assertEqual(rows[1:], [['sara', '2025', '1', '1000.00', '1.00', '0.00', '1001.00', 'ok']])
+        response = self.client.get(reverse('export_payroll'), {'year': 'x'})
+        self.assertRedirects(response, reverse('manage_payroll'), fetch_redirect_response=False)
+
+
+@override_settings(
+    PDF_POOL_SIZE=2,
+    STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}},
+)
+class PayslipZipTests(TestCase):
+    """One PDF per payslip is streamed into the ZIP; a failed render is listed in summary.txt."""
+
+    def setUp(self):
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        for index in range(5):
+            profile = Profile.objects.create(user=User.objects.create_user(f'emp{index}', password='x'), department='IT')
+            Payroll.objects.create(employee=profile, year=2025, month=1, base_salary=1000 + index)
+
+        def render(html):
+            if 'emp3' in html:
+                raise RuntimeError('render failed')
+            return b'%PDF-1.4'
+
+        pool = mock.Mock()
+        pool.render.side_effect = render
+        pool_patch = mock.patch('hr_app.reports.get_browser_pool', return_value=pool)
+        pool_patch.start()
+        self.addCleanup(pool_patch.stop)
+
+    def test_zip_contents(self):
+        response = self.client.get(reverse('export_payslips_zip'), {'year': 2025, 'month': 1})
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        names = sorted(archive.namelist())
+        self.assertEqual(names, [f'payslip_2025_01_emp{i}.pdf' for i in (0, 1, 2, 4)] + ['summary.txt'])
+        summary = archive.read('summary.txt').decode()
+        self.assertIn('rendered: 4', summary)
+        self.assertIn('failed: 1', summary)
+        self.assertIn('payslip_2025_01_emp3.pdf: render failed', summary)
+
+    def test_invalid_period(self):
+        response = self.client.get(reverse('export_payslips_zip'), {'year': 2025})
+        self.assertRedirects(response, reverse('manage_payroll'), fetch_redirect_response=False)
+
+
+class NetSalaryWithoutTriggersTests(TestCase):
+    """The bulk payroll paths must compute net_salary themselves (e.g. on MySQL, where no trigger exists)."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TRIGGER IF EXISTS hr_app_payroll_net_salary_insert')
+                cursor.execute('DROP TRIGGER IF EXISTS hr_app_payroll_net_salary_update')
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TRIGGER IF EXISTS hr_app_payroll_net_salary ON hr_app_payroll')
+        self.profile = Profile.objects.create(
+            user=User.objects.create_user('emp', password='x'), user_type='Employee', department='IT',
+            date_joined=datetime(2024, 1, 1).date(),
+        )
+        Payroll.objects.create(employee=self.profile, year=2025, month=1, base_salary=1000, bonuses=50)
+
+    def test_adjust_salaries(self):
+        adjust_salaries(field='bonuses', amount='25', year=2025, month=1)
+        self.assertEqual(Payroll.objects.get(year=2025, month=1).net_salary, Decimal('1075.00'))
+
+    def test_monthly_run(self):
+        run_monthly_payroll(2025, 2)
+        self.assertEqual(Payroll.objects.get(year=2025, month=2).net_salary, Decimal('1000.00'))
+
+    def test_import(self):
+        data = 'username,year,month,base_salary,bonuses,deductions\nemp,2025,3,900,100,40\n'
+        import_payroll_file(io.BytesIO(data.encode()), 'payroll.csv')
+        self.assertEqual(Payroll.objects.get(year=2025, month=3).net_salary, Decimal('960.00'))
+
+
+class SimulatePayrollTests(TestCase):
+    """Malformed scenarios get a 400 with a readable message instead of a server error."""
+
+    def setUp(self):
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        profile = Profile.objects.create(user=User.objects.create_user('emp', password='x'), user_type='Employee', department='IT')
+        Payroll.objects.create(employee=profile, year=2025, month=1, base_salary=1000)
+
+    def post(self, payload):
+        return self.client.post(reverse('simulate_payroll'), json.dumps(payload), content_type='application/json')
+
+    def test_valid_rules(self):
+        response = self.post({'year': 2025, 'month': 1, 'rules': [{'department': 'IT', 'percent': 10}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['company']['delta'], 100.0)
+
+    def test_invalid_payloads(self):
+        for payload in (
+            [],
+            {'rules': {'percent': 10}},
+            {'rules': [{'percent': '10'}]},
+            {'rules': [{'percent': True}]},
+            {'rules': [{'field': ['bonuses'], 'amount': 5}]},
+            {'rules': [{'department': ['IT'], 'amount': 5}]},
+            {'year': 1e999, 'month': 1, 'rules': [{'amount': 5}]},
+        ):
+            response = self.post(payload)
+            self.assertEqual(response.status_code, 400, payload)
+            self.assertEqual(response.json()['status'], 'error')
+
+    def test_unknown_department(self):
+        response = self.post({'rules': [{'department': 'Sales', 'percent': 10}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Sales', response.json()['message'])
+
+
+@override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+class PayrollReportCacheTests(TestCase):
+    """The cached PDF is keyed on the payroll data version and never holds rows older than its key."""
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = override_settings(REPORT_CACHE_DIR=cache_dir.name)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.pool = mock.Mock()
+        self.pool.render.return_value = b'%PDF-1.4'
+        pool_patch = mock.patch('hr_app.reports.get_browser_pool', return_value=self.pool)
+        pool_patch.start()
+        self.addCleanup(pool_patch.stop)
+        self.user = User.objects.create_user('emp', password='x')
+        profile = Profile.objects.create(user=self.user, user_type='Employee', department='IT')
+        self.payroll = Payroll.objects.create(employee=profile, year=2025, month=1, base_salary=1000)
+
+    def test_version_follows_changes(self):
+        before = payroll_report_hash()
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(payroll_report_hash(), before)
+
+        for change in (
+            lambda: self.payroll.save(),
+            lambda: adjust_salaries(percent='5', year=2025, month=1),
+            lambda: User.objects.get(pk=self.user.pk).save(),
+        ):
+            change()
+            after = payroll_report_hash()
+            self.assertNotEqual(after, before)
+            before = after
+
+    def test_cached_file_is_reused(self):
+        content_hash, path = build_payroll_report()
+        self.assertEqual(build_payroll_report(), (content_hash, path))
+        self.assertEqual(self.pool.render.call_count, 1)
+
+        self.payroll.bonuses = 10
+        self.payroll.save()
+        new_hash, new_path = build_payroll_report()
+        self.assertNotEqual(new_hash, content_hash)
+        self.assertEqual(self.pool.render.call_count, 2)
+
+    def test_change_during_render(self):
+        stale_hash = payroll_report_hash()
+
+        def edit_then_render(html):
+            if self.pool.render.call_count == 1:
+                Payroll.objects.filter(pk=self.payroll.pk).update(bonuses=10)
+                bump_data_version(PAYROLL)
+            return b'%PDF-1.4'
+
+        self.pool.render.side_effect = edit_then_render
+        content_hash, path = build_payroll_report(stale_hash)
+        self.assertEqual(self.pool.render.call_count, 2)
+        self.assertEqual(content_hash, payroll_report_hash())
+        self.assertFalse(os.path.exists(cached_report_path(stale_hash)))
+
+    def test_export_view_uses_the_job_queue(self):
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        response = self.client.get(reverse('export_payroll_pdf'))
+        self.assertContains(response, 'data-status-url')
+        self.pool.render.assert_not_called()
+
+        build_payroll_report()
+        response = self.client.get(reverse('export_payroll_pdf'))
+        self.assertRedirects(response, reverse('payroll_report_job_download', args=[ReportJob.objects.latest('id').id]),
+                             fetch_redirect_response=False)
+
+
+class BrowserPoolTests(TestCase):
+    """The PDF pool must not leave renders or browsers running behind a failure."""
+
+    def fake_playwright(self, launch):
+        playwright = mock.Mock()
+        playwright.stop = mock.AsyncMock()
+        playwright.chromium.launch = mock.AsyncMock(side_effect=launch)
+        starter = mock.Mock()
+        starter.return_value.start = mock.AsyncMock(return_value=playwright)
+        return playwright, starter
+
+    def fake_browser(self, page=None):
+        browser = mock.Mock()
+        browser.close = mock.AsyncMock()
+        browser.is_connected.return_value = True
+        browser.new_context = mock.AsyncMock(return_value=mock.Mock(new_page=mock.AsyncMock(return_value=page)))
+        return browser
+
+    def test_failed_start_closes_what_was_launched(self):
+        first = self.fake_browser()
+        playwright, starter = self.fake_playwright([first, RuntimeError('no chromium')])
+        pool = BrowserPool(size=2)
+        with mock.patch('hr_app.pdf.async_playwright', starter), self.assertRaises(RuntimeError):
+            pool._ensure_started()
+        first.close.assert_awaited_once()
+        playwright.stop.assert_awaited_once()
+
+    def test_timeout_cancels_the_render(self):
+        async def never_loads(html):
+            await asyncio.sleep(60)
+
+        page = mock.Mock()
+        page.set_content = mock.AsyncMock(side_effect=never_loads)
+        page.close = mock.AsyncMock()
+        playwright, starter = self.fake_playwright([self.fake_browser(page)])
+        pool = BrowserPool(size=1)
+        self.addCleanup(pool.shutdown)
+        with mock.patch('hr_app.pdf.async_playwright', starter), self.assertRaises(RenderTimeout):
+            pool.render('<p>slow</p>', timeout=0.2)
+        for _ in range(50):
+            if page.close.await_count and not pool.metrics()['in_flight']:
+                break
+            time.sleep(0.02)
+        page.close.assert_awaited_once()
+        self.assertEqual(pool.metrics()['in_flight'], 0)
+
+
+class EmployeeDeletionTests(TestCase):
+    """Deleting an employee must not recreate the summary rows the cascade just removed."""
+
+    def setUp(self):
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        self.profile = Profile.objects.create(user=User.objects.create_user('emp', password='x'), user_type='Employee')
+        Attendance.objects.create(employee=self.profile, date=datetime(2025, 1, 6).date(), status='Present')
+
+    def assertNoDanglingRows(self):
+        self.assertFalse(AttendanceSummary.objects.filter(employee_id=self.profile.pk).exists())
+        connection.check_constraints()
+
+    def test_delete_employee_view(self):
+        response = self.client.get(reverse('delete_employee', args=[self.profile.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertNoDanglingRows()
+
+    def test_delete_profile(self):
+        self.profile.delete()
+        self.assertNoDanglingRows()
+
+    def test_deleting_one_attendance_row(self):
+        Attendance.objects.get(employee=self.profile).delete()
+        summary = AttendanceSummary.objects.get(employee=self.profile)
+        self.assertEqual(summary.present_count, 0)
+
+
+class AttendanceFilterTests(TestCase):
+
+    def test_impossible_dates_are_ignored(self):
+        qs = Attendance.objects.all()
+        self.assertEqual(str(filter_attendances(qs, '2025-02-30', '2025-13-01').query), str(qs.query))
+        for cursor in ('2025-02-30_1', '2025-01-01_²', f'2025-01-01_{2 ** 64}'):
+            self.assertIsNone(decode_attendance_cursor(cursor))
+        self.assertEqual(decode_attendance_cursor('2025-01-01_7'), (datetime(2025, 1, 1).date(), 7))
+
+
+class AttendanceSummaryTests(TestCase):
+
+    def test_rebuild_in_chunks(self):
+        day = datetime(2025, 1, 6).date()
+        profiles = [
+            Profile.objects.create(user=User.objects.create_user(f'emp{i}', password='x'), user_type='Employee')
+            for i in range(5)
+        ]
+        Attendance.objects.bulk_create([Attendance(employee=p, date=day, status='Present') for p in profiles])
+        with mock.patch('hr_app.timekeeping.IN_BATCH_SIZE', 2):
+            written = rebuild_attendance_summaries(2025, 1, [p.pk for p in profiles])
+        self.assertEqual(written, 5)
+        self.assertEqual(AttendanceSummary.objects.filter(present_count=1).count(), 5)
+
+    def test_archiving_keeps_summaries(self):
+        profile = Profile.objects.create(user=User.objects.create_user('emp', password='x'), user_type='Employee')
+        Attendance.objects.create(employee=profile, date=datetime(2024, 1, 8).date(), status='Present', hours_worked=8)
+        self.assertEqual(archive_attendance(datetime(2025, 1, 1).date()), 1)
+        self.assertFalse(Attendance.objects.exists())
+        summary = AttendanceSummary.objects.get(employee=profile)
+        self.assertEqual((summary.present_count, str(summary.total_hours)), (1, '8.00'))
+
+
+    @override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_history_includes_archived_rows(self):
+        user = User.objects.create_user('emp', password='x')
+        profile = Profile.objects.create(user=user, user_type='Employee')
+        for day in (datetime(2024, 12, 30).date(), datetime(2025, 1, 6).date()):
+            Attendance.objects.create(employee=profile, date=day, status='Present')
+        archive_attendance(datetime(2025, 1, 1).date())
+
+        rows = list(attendance_history(profile.pk))
+        self.assertEqual([(row['date'].isoformat(), row['archived']) for row in rows],
+                         [('2025-01-06', False), ('2024-12-30', True)])
+        self.assertEqual(len(attendance_history(profile.pk, year=2024)), 1)
+
+        self.client.force_login(user)
+        response = self.client.get(reverse('attendance_history'))
+        self.assertEqual(len(response.context['page'].object_list), 2)
+        self.assertContains(response, 'مؤرشف')
+
+
+class MarkAbsencesTests(TestCase):
+
+    def setUp(self):
+        joined = datetime(2024, 1, 1).date()
+        self.day = datetime(2025, 3, 3).date()
+        self.absent = Profile.objects.create(user=User.objects.create_user('absent', password='x'), user_type='Employee', date_joined=joined)
+        self.present = Profile.objects.create(user=User.objects.create_user('present', password='x'), user_type='Employee', date_joined=joined)
+        Attendance.objects.create(employee=self.present, date=self.day, status='Present')
+        for username, user_type in (('hr', 'HR Manager'), ('finance', 'Finance')):
+            Profile.objects.create(user=User.objects.create_user(username, password='x'), user_type=user_type, date_joined=joined)
+
+    def test_only_employees_are_marked(self):
+        self.assertEqual(mark_absences(self.day), {self.day: 1})
+        self.assertEqual(
+            list(Attendance.objects.filter(date=self.day, status='Absent').values_list('employee_id', flat=True)),
+            [self.absent.pk],
+        )
+        self.assertEqual(mark_absences(self.day), {self.day: 0})
+
+    def test_count_skips_rows_written_meanwhile(self):
+        # موظف سجّل حضوره بين الاستعلام والإدراج يُتجاهل ولا يُحسب
+        candidates = Profile.objects.filter(pk__in=[self.absent.pk, self.present.pk])
+        with mock.patch('hr_app.timekeeping.absent_profiles', return_value=candidates):
+            self.assertEqual(mark_absences(self.day), {self.day: 1})
+
+
+class AttendanceAnalyticsCacheTests(TestCase):
+    """Cached analytics are reused until any attendance write, including a bare check-in."""
+
+    def setUp(self):
+        attendance_analytics._results.clear()
+        self.addCleanup(attendance_analytics._results.clear)
+        self.profile = Profile.objects.create(user=User.objects.create_user('emp', password='x'), user_type='Employee', department='IT')
+        Attendance.objects.create(employee=self.profile, date=datetime(2025, 1, 6).date(), status='Present')
+
+    def assertRecomputed(self, expected):
+        with mock.patch.object(attendance_analytics.AttendanceSnapshot, 'load', wraps=attendance_analytics.AttendanceSnapshot.load) as load:
+            result = get_attendance_analytics()
+        self.assertEqual(load.called, expected)
+        return result
+
+    def test_cache_follows_writes(self):
+        self.assertRecomputed(True)
+        self.assertRecomputed(False)
+
+        record_web_punch(self.profile.pk, 'check_in', timezone.make_aware(datetime(2025, 1, 7, 9, 30)))
+        result = self.assertRecomputed(True)
+        self.assertEqual(result['company']['average_check_in'], '09:30')
+        self.assertRecomputed(False)
+
+        self.profile.department = 'HR'
+        self.profile.save()
+        self.assertIn('HR', self.assertRecomputed(True)['departments'])
+
+
+class LeaveApprovalTests(TestCase):
+
+    def test_overlapping_leave_is_not_approved(self):
+        profile = Profile.objects.create(user=User.objects.create_user('emp', password='x'), user_type='Employee')
+        first, second = [
+            LeaveRequest.objects.create(
+                employee=profile, leave_type='Annual', start_date=datetime(2025, 5, day).date(),
+                end_date=datetime(2025, 5, day + 2).date(), reason='',
+            )
+            for day in (1, 2)
+        ]
+        set_leave_status(first.id, 'Approved')
+        with self.assertRaises(ValueError):
+            set_leave_status(second.id, 'Approved')
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'Pending')
+        self.assertEqual(LeaveBalance.objects.get(employee=profile, year=2025).used_days, 3)
+
+
+class BulkLeaveDecisionTests(TestCase):
+    """Bulk decisions keep the balance ledger equal to a rebuild from the approved leaves."""
+
+    def setUp(self):
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        self.first = Profile.objects.create(user=User.objects.create_user('first', password='x'), user_type='Employee')
+        self.second = Profile.objects.create(user=User.objects.create_user('second', password='x'), user_type='Employee')
+
+    def leave(self, profile, start, end, leave_type='Annual'):
+        return LeaveRequest.objects.create(
+            employee=profile, leave_type=leave_type, start_date=start, end_date=end, reason='',
+        ).pk
+
+    def decide(self, leave_ids, decision):
+        response = self.client.post(
+            reverse('bulk_leave_decision'), json.dumps({'leave_ids': leave_ids, 'decision': decision}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def balances(self):
+        return sorted(LeaveBalance.objects.filter(used_days__gt=0).values_list('employee_id', 'leave_type', 'year', 'used_days'))
+
+    def assertLedgerMatchesRebuild(self):
+        live = self.balances()
+        rebuild_leave_balances()
+        self.assertEqual(live, self.balances())
+
+    def test_approve_and_reject(self):
+        def d(*args):
+            return datetime(*args).date()
+
+        over_new_year = self.leave(self.first, d(2024, 12, 30), d(2025, 1, 2))
+        overlapping = self.leave(self.first, d(2025, 1, 1), d(2025, 1, 3))
+        sick = self.leave(self.second, d(2025, 3, 1), d(2025, 3, 2), leave_type='Sick')
+        rejected = self.leave(self.second, d(2025, 4, 1), d(2025, 4, 5))
+
+        results = self.decide([over_new_year, overlapping, sick], 'Approved')
+        self.assertEqual(results, {str(over_new_year): 'Approved', str(overlapping): 'conflict', str(sick): 'Approved'})
+        self.assertEqual(self.decide([rejected, sick], 'Rejected'), {str(rejected): 'Rejected', str(sick): 'already_decided'})
+
+        self.assertEqual(self.balances(), [
+            (self.first.pk, 'Annual', 2024, 2), (self.first.pk, 'Annual', 2025, 2), (self.second.pk, 'Sick', 2025, 2),
+        ])
+        self.assertLedgerMatchesRebuild()
+        self.assertEqual(Notification.objects.count(), 3)
+
+        # رفض إجازة مقبولة من صفحة الطلب يعيد أيامها إلى الرصيد
+        set_leave_status(sick, 'Rejected')
+        self.assertLedgerMatchesRebuild()
+
+
+@override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+class LeaveConflictTests(TestCase):
+    """Overlapping requests and attended days are caught when asking for leave and shown when approving."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('emp', password='x')
+        self.profile = Profile.objects.create(user=self.user, user_type='Employee', department='IT')
+        self.colleague = Profile.objects.create(user=User.objects.create_user('colleague', password='x'), user_type='Employee', department='IT')
+        self.pending = self.leave(self.profile, 1, 5)
+
+    def leave(self, profile, start, end, status='Pending'):
+        return LeaveRequest.objects.create(
+            employee=profile, leave_type='Annual', start_date=datetime(2025, 5, start).date(),
+            end_date=datetime(2025, 5, end).date(), reason='', status=status,
+        )
+
+    def request(self, start, end):
+        self.client.force_login(self.user)
+        return self.client.post(reverse('request_leave'), {
+            'leave_type': 'Annual', 'start_date': f'2025-05-{start:02d}', 'end_date': f'2025-05-{end:02d}', 'reason': '',
+        })
+
+    def test_request_conflicts(self):
+        self.assertContains(self.request(4, 8), 'الفترة تتداخل')
+        Attendance.objects.create(employee=self.profile, date=datetime(2025, 5, 12).date(), status='Present')
+        self.assertContains(self.request(10, 14), '2025-05-12')
+        self.assertRedirects(self.request(20, 22), reverse('request_leave'), fetch_redirect_response=False)
+        self.assertEqual(LeaveRequest.objects.filter(employee=self.profile).count(), 2)
+
+    def test_approval_page_shows_conflicts(self):
+        overlapping = self.leave(self.profile, 3, 7)
+        self.leave(self.colleague, 4, 4, status='Approved')
+        hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=hr, user_type='HR Manager')
+        self.client.force_login(hr)
+        response = self.client.get(reverse('approve_leave', args=[overlapping.pk]))
+        self.assertEqual(response.context['conflicts'], [self.pending])
+        self.assertEqual([l.employee_id for l in response.context['department_out']], [self.colleague.pk])
+
+
+class EventStreamTests(TestCase):
+    """The in-process broker and the WSGI fallback of the event stream."""
+
+    def test_broker_delivers_and_drops_overflow(self):
+        async def scenario():
+            broker = InProcessBroker(queue_size=2)
+            subscription = broker.subscribe(1)
+            other = broker.subscribe(2)
+            # النشر من خيط آخر كما تفعل الـ views المتزامنة
+            await asyncio.to_thread(broker.publish, [1], {'type': 'a'})
+            for name in 'bc':
+                broker.publish([1], {'type': name})
+            await asyncio.sleep(0)
+            received = [await subscription.get(timeout=1), await subscription.get(timeout=1)]
+            with self.assertRaises(asyncio.TimeoutError):
+                await other.get(timeout=0.01)
+            subscription.close()
+            other.close()
+            return received, broker._subscribers
+
+        received, subscribers = asyncio.run(scenario())
+        self.assertEqual(received, [{'type': 'a'}, {'type': 'b'}])
+        self.assertEqual(subscribers, {})
+
+    def test_publish_waits_for_commit(self):
+        user = User.objects.create_user('emp', password='x')
+        broker = mock.Mock()
+        with mock.patch('hr_app.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                notify([user.pk], 'hello')
+                broker.publish.assert_not_called()
+        broker.publish.assert_called_once()
+        self.assertEqual(broker.publish.call_args.args[0], [user.pk])
+
+    def test_wsgi_fallback(self):
+        url = reverse('event_stream')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        user = User.objects.create_user('emp', password='x')
+        Profile.objects.create(user=user, user_type='Employee', department='IT')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 204)
+
+
+class UnreadCounterTests(TestCase):
+    """The cached unread counters must follow every way messages are sent, read and deleted."""
+
+    def setUp(self):
+        self.sender = User.objects.create_user('hr', password='x')
+        self.recipient = User.objects.create_user('emp', password='x')
+        Profile.objects.create(user=self.recipient, user_type='Employee')
+
+    def assertCountsMatchRebuild(self):
+        live = {c.user_id: (c.messages, c.notifications) for c in UnreadCounter.objects.all()}
+        rebuild_unread_counters()
+        rebuilt = {c.user_id: (c.messages, c.notifications) for c in UnreadCounter.objects.all()}
+        self.assertEqual({k: v for k, v in live.items() if v != (0, 0)}, rebuilt)
+
+    def test_bulk_send_and_read(self):
+        send_messages(self.sender, [self.recipient.pk] * 2, 'subject', 'body', notification='new message')
+        notify([self.recipient.pk], 'hello')
+        self.assertEqual(unread_counts(self.recipient.pk), (2, 3))
+
+        message = Message.objects.filter(recipient=self.recipient).first()
+        self.assertTrue(mark_message_read(message))
+        self.assertFalse(mark_message_read(Message.objects.get(pk=message.pk)))
+        self.assertEqual(unread_counts(self.recipient.pk), (1, 3))
+        self.assertCountsMatchRebuild()
+
+    def test_signals(self):
+        message = Message.objects.create(sender=self.sender, recipient=self.recipient, subject='s', body='b')
+        notification = Notification.objects.create(user=self.recipient, message='n')
+        self.assertEqual(unread_counts(self.recipient.pk), (1, 1))
+        message.is_read = True
+        message.save()
+        notification.delete()
+        self.assertEqual(unread_counts(self.recipient.pk), (0, 0))
+        self.assertCountsMatchRebuild()
+
+    def test_deleting_users(self):
+        Message.objects.create(sender=self.sender, recipient=self.recipient, subject='s', body='b')
+        Notification.objects.create(user=self.recipient, message='n')
+        # حذف المرسل يطرح رسالته من عداد المستلم
+        self.sender.delete()
+        self.assertEqual(unread_counts(self.recipient.pk), (0, 1))
+        # حذف المستلم لا يعيد إنشاء عداده
+        self.recipient.delete()
+        self.assertFalse(UnreadCounter.objects.exists())
+        connection.check_constraints()
+
+    # الصفحات تُعرض بدون ملف manifest الخاص بـ collectstatic
+    @override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_badges_render(self):
+        self.client.force_login(self.recipient)
+        response = self.client.get(reverse('notifications'))
+        self.assertContains(response, 'data-unread-badge="notifications"')
+        notify([self.recipient.pk], 'hello')
+        response = self.client.get(reverse('employee_inbox'))
+        self.assertContains(response, '<span class="badge bg-danger rounded-pill ms-2" data-unread-badge="notifications">1</span>', html=True)
+
+
+    @override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_notifications_are_read_only_on_request(self):
+        notify([self.recipient.pk], 'first')
+        notify([self.recipient.pk], 'second')
+        self.client.force_login(self.recipient)
+        self.client.get(reverse('notifications'))
+        self.assertEqual(unread_counts(self.recipient.pk), (0, 2))
+
+        first = Notification.objects.get(message='first')
+        self.client.post(reverse('notifications'), {'notification_id': first.pk})
+        self.assertEqual(unread_counts(self.recipient.pk), (0, 1))
+        self.client.post(reverse('notifications'))
+        self.assertEqual(unread_counts(self.recipient.pk), (0, 0))
+        self.assertCountsMatchRebuild()
+
+
+class AnnouncementTests(TestCase):
+    """Announcements reach every department member once, in batched inserts."""
+
+    def setUp(self):
+        self.hr = User.objects.create_user('hr', password='x')
+        Profile.objects.create(user=self.hr, user_type='HR Manager', department='HR')
+        self.members = []
+        for index in range(5):
+            user = User.objects.create_user(f'it{index}', password='x')
+            Profile.objects.create(user=user, user_type='Employee', department='IT')
+            self.members.append(user.pk)
+        admin = User.objects.create_superuser('admin', password='x')
+        Profile.objects.create(user=admin, department='IT')
+        Profile.objects.create(user=User.objects.create_user('sales', password='x'), department='Sales')
+
+    def test_broadcast_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            sent = broadcast_announcement(self.hr, ['IT', 'HR'], 'Holiday', 'Office closed', batch_size=2)
+        self.assertEqual(sent, 5)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "hr_app_message"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(sorted(Message.objects.values_list('recipient_id', flat=True)), self.members)
+        self.assertFalse(Message.objects.exclude(thread_root=F('id')).exists())
+        self.assertEqual(sorted(Notification.objects.values_list('user_id', flat=True)), self.members)
+        self.assertEqual({unread_counts(pk) for pk in self.members}, {(1, 1)})
+
+    @override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_view(self):
+        self.client.force_login(self.hr)
+        url = reverse('send_announcement')
+        response = self.client.post(url, {'departments': ['Unknown'], 'subject': 's', 'body': 'b'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Message.objects.exists())
+        response = self.client.post(url, {'departments': ['IT'], 'subject': 's', 'body': 'b'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertEqual(Message.objects.count(), 5)
+
+
+class InboxPagingTests(TestCase):
+
+    def setUp(self):
+        self.sender = User.objects.create_user('hr', password='x')
+        self.recipient = User.objects.create_user('emp', password='x')
+        # خمس محادثات، لكل منها رسالة ورد، وكلها في نفس اللحظة حتى يفصل المعرف بينها
+        send_messages(self.sender, [self.recipient.pk] * 5, 'subject', 'body')
+        for message in list(Message.objects.all()):
+            send_messages(self.sender, [self.recipient.pk], 'reply', 'body', reply_to=message)
+        Message.objects.update(created_at=timezone.make_aware(datetime(2025, 1, 6, 8, 0)))
+        self.inbox = Message.objects.filter(recipient=self.recipient)
+
+    def test_inbox_pages_forward_and_back(self):
+        expected = list(self.inbox.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen, cursor, pages = [], None, []
+        while True:
+            rows, cursor, previous = inbox_page(self.inbox, after=cursor, page_size=4)
+            seen += [row.id for row in rows]
+            pages.append((rows, previous))
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        rows, _, _ = inbox_page(self.inbox, before=pages[1][1], page_size=4)
+        self.assertEqual(rows, pages[0][0])
+
+    def test_thread_pages(self):
+        seen, cursor = [], None
+        while True:
+            threads, cursor = inbox_threads(self.recipient, after=cursor, page_size=2)
+            seen += [(t.thread_root or t.pk, t.thread_total) for t in threads]
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 5)
+        self.assertEqual({total for _, total in seen}, {2})
+        self.assertEqual(len({root for root, _ in seen}), 5)
+
+    def test_unread_threads_page(self):
+        # قراءة الرد في محادثتين تتركهما بدون غير مقروء
+        replies = list(self.inbox.filter(subject='reply').order_by('id'))
+        for reply in replies[:2]:
+            Message.objects.filter(thread_root=reply.thread_root).update(is_read=True)
+        with self.assertNumQueries(2):
+            threads, cursor = inbox_threads(self.recipient, unread_only=True, page_size=2)
+        self.assertEqual([t.subject for t in threads], ['reply', 'reply'])
+        self.assertEqual([t.thread_unread for t in threads], [2, 2])
+        threads, cursor = inbox_threads(self.recipient, after=cursor, unread_only=True, page_size=2)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNone(cursor)
+
+    def test_malformed_cursors(self):
+        for cursor in ('9' * 30 + '_1', '253402300800000000_1', '²_1', '1_²', f'1_{2 ** 64}', 'abc'):
+            self.assertIsNone(decode_inbox_cursor(cursor))
+            self.assertEqual(len(inbox_page(self.inbox, after=cursor)[0]), 10)
+        for after in ('²', str(2 ** 64)):
+            self.assertEqual(len(inbox_threads(self.recipient, after=after)[0]), 5)
+
+
+class TerminalTokenTests(TestCase):
+
+    def test_non_ascii_token_is_forbidden(self):
+        with self.settings(ATTENDANCE_TERMINAL_TOKEN='secret'):
+            response = self.client.post(
+                reverse('attendance_punches'), '{}', content_type='application/json', HTTP_X_TERMINAL_TOKEN='سر',
+            )
+        self.assertEqual(response.status_code, 403)
+
+
+class PayrollImportTests(TestCase):
+    """Bad rows and bad files are reported, never raised as a server error."""
+
+    def setUp(self):
+        Profile.objects.create(user=User.objects.create_user('emp', password='x'), user_type='Employee')
+
+    def test_invalid_rows_are_reported(self):
+        data = 'username,year,month,base_salary\nemp,2025\nemp,inf,1,100\nemp,99999,1,100\nemp,2025,1,100\n'
+        report = import_payroll_file(io.BytesIO(data.encode()), 'payroll.csv')
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([line for line, _ in report['errors']], [2, 3, 4])
+
+    def test_periods_must_be_whole_numbers(self):
+        data = 'username,year,month,base_salary\nemp,2024.9,1,100\nemp,1e3,1,100\nemp,2025,1.0,100\nemp, 2025 ,2,100\n'
+        report = import_payroll_file(io.BytesIO(data.encode()), 'payroll.csv')
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([line for line, _ in report['errors']], [2, 3, 4])
+
+    def test_unreadable_files(self):
+        with self.assertRaises(ValueError):
+            # حقل أطول من csv.field_size_limit()
+            import_payroll_file(io.BytesIO(b'username,year,month,base_salary\nemp,2025,1,' + b'1' * 200000), 'payroll.csv')
+        with self.assertRaises(ValueError):
+            import_payroll_file(io.BytesIO(b'username,year,month,base_salary\n\xff,2025,1,1\n'), 'payroll.csv')
+        with self.assertRaises(ValueError):
+            import_payroll_file(io.BytesIO(b'not a workbook'), 'payroll.xlsx')
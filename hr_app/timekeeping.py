@@ -0,0 +1,596 @@
+# hr_app/timekeeping.py
+"""
+خدمات الحضور والانصراف: استقبال بصمات أجهزة الحضور دفعة واحدة، حساب ساعات العمل
+وتحديث ملخص الحضور الشهري.
+"""
+
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Case, Count, Exists, F, FloatField, Max, Min, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Cast, ExtractHour, ExtractMinute, ExtractMonth, ExtractSecond, ExtractYear, Round
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+from .models import Attendance, AttendanceArchive, AttendanceSummary, LeaveRequest, Profile
+from .versions import ATTENDANCE, bump_data_version
+
+
+PUNCH_ACTIONS = ('check_in', 'check_out')
+
+# أقصى عدد قيم في شرط IN واحد؛ القوائم الأطول تُقسم على عدة استعلامات
+IN_BATCH_SIZE = 500
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def compute_hours_worked(day, check_in, check_out):
+    """Hours between check-in and check-out on `day`, rounded to 2 places (None if incomplete)."""
+    if not check_in or not check_out:
+        return None
+    delta = datetime.combine(day, check_out) - datetime.combine(day, check_in)
+    return round(delta.total_seconds() / 3600, 2)
+
+
+def _parse_punch(event):
+    """Validate one terminal event and return (username, local_datetime, action)."""
+    if not isinstance(event, dict):
+        raise ValueError('صيغة الحدث غير صالحة.')
+    username = str(event.get('employee') or '').strip()
+    if not username:
+        raise ValueError('الموظف مطلوب.')
+    action = event.get('action')
+    if action not in PUNCH_ACTIONS:
+        raise ValueError(f"الإجراء يجب أن يكون أحد {', '.join(PUNCH_ACTIONS)}.")
+    moment = parse_datetime(str(event.get('timestamp') or ''))
+    if moment is None:
+        raise ValueError('الوقت غير صالح، استخدم صيغة ISO 8601.')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    # نخزن التاريخ والوقت بالتوقيت المحلي للشركة (TIME_ZONE)
+    return username, timezone.localtime(moment), action
+
+
+def record_web_punch(employee_id, action, moment=None):
+    """
+    Apply one check-in/check-out from the attendance page, safe under concurrent requests.
+
+    The day's row is created through the (employee, date) unique constraint,
+    so parallel first requests end up on the same row. Each punch is then a
+    single conditional UPDATE (`check_in IS NULL` / `check_out IS NULL`), so
+    only the first of several simultaneous clicks is applied and none is lost.
+    Returns (attendance, applied).
+    """
+    if action not in PUNCH_ACTIONS:
+        raise ValueError(f"الإجراء يجب أن يكون أحد {', '.join(PUNCH_ACTIONS)}.")
+    moment = timezone.localtime(moment)
+    day, punch_time = moment.date(), moment.time().replace(microsecond=0)
+
+    with transaction.atomic():
+        record, _ = Attendance.objects.get_or_create(employee_id=employee_id, date=day)
+        rows = Attendance.objects.filter(pk=record.pk)
+        if action == 'check_in':
+            applied = rows.filter(check_in__isnull=True).update(check_in=punch_time)
+        else:
+            # الخروج مرة واحدة فقط وبعد تسجيل الدخول؛ وقت الدخول لا يتغير بعد تعيينه
+            check_in = rows.values_list('check_in', flat=True).get()
+            hours = compute_hours_worked(day, check_in, punch_time)
+            applied = 0
+            if check_in is not None and punch_time >= check_in:
+                applied = rows.filter(check_out__isnull=True).update(check_out=punch_time, hours_worked=hours)
+            if applied:
+                # update() لا يرسل إشارات، فنضيف الساعات إلى الملخص الشهري يدوياً
+                apply_attendance_summary_delta((employee_id, day.year, day.month), (0, 0, 0, Decimal(str(hours))), 1)
+        if applied:
+            # وقت الدخول وحده لا يغير الملخص لكنه يغير تحليلات الحضور
+            bump_data_version(ATTENDANCE)
+    return Attendance.objects.get(pk=record.pk), bool(applied)
+
+
+def record_punches(events, attempts=3):
+    """
+    Apply a batch of terminal punches to the Attendance table.
+
+    Events are grouped per (employee, day): the earliest check-in and the
+    latest check-out win, merged with whatever the day's row already holds.
+    A check-out earlier than the day's check-in is rejected.
+    Employees are resolved with one query, existing rows are read with one
+    query, and the result is written with one bulk_create plus one
+    bulk_update. Because the merge is min/max, replaying the same batch
+    changes nothing, so terminals can retry safely.
+
+    If a concurrent batch inserts one of the same (employee, date) rows
+    first, the unique constraint aborts the transaction and the batch is
+    re-applied on top of the committed rows (up to `attempts` times).
+
+    Returns {'accepted', 'created', 'updated', 'rejected': [{'index', 'error'}]}.
+    """
+    rejected = []
+    parsed = []
+    for index, event in enumerate(events):
+        try:
+            parsed.append((index, *_parse_punch(event)))
+        except ValueError as e:
+            rejected.append({'index': index, 'error': str(e)})
+
+    profiles = {}
+    for usernames in _chunks({p[1] for p in parsed}, IN_BATCH_SIZE):
+        profiles.update(
+            Profile.objects.filter(user__username__in=usernames).values_list('user__username', 'id')
+        )
+
+    # نجمع البصمات لكل موظف ويوم: أول دخول وآخر خروج
+    days = {}
+    for index, username, moment, action in parsed:
+        employee_id = profiles.get(username)
+        if employee_id is None:
+            rejected.append({'index': index, 'error': f'الموظف غير موجود: {username}'})
+            continue
+        punches = days.setdefault(
+            (employee_id, moment.date()), {'check_in': None, 'check_out': None, 'check_out_indexes': []},
+        )
+        punch_time = moment.time().replace(microsecond=0)
+        if action == 'check_in':
+            punches['check_in'] = min(filter(None, [punches['check_in'], punch_time]))
+        else:
+            punches['check_out'] = max(filter(None, [punches['check_out'], punch_time]))
+            punches['check_out_indexes'].append(index)
+
+    for attempt in range(1, attempts + 1):
+        try:
+            created, updated, invalid_days = _apply_punch_days(days)
+            break
+        except IntegrityError:
+            if attempt == attempts:
+                raise
+    for key in invalid_days:
+        for index in days[key]['check_out_indexes']:
+            rejected.append({'index': index, 'error': 'وقت الخروج قبل وقت الدخول.'})
+
+    rejected.sort(key=lambda r: r['index'])
+    return {
+        'accepted': len(events) - len(rejected),
+        'created': created,
+        'updated': updated,
+        'rejected': rejected,
+    }
+
+
+def _apply_punch_days(days):
+    """
+    Merge {(employee_id, day): punches} into Attendance in one transaction.
+
+    Returns (created, updated, invalid_days): the keys whose check-out came
+    before the check-in, which is dropped instead of storing negative hours.
+    """
+    with transaction.atomic():
+        existing = {}
+        for keys in _chunks(days, IN_BATCH_SIZE):
+            rows = Attendance.objects.select_for_update().filter(
+                employee_id__in={key[0] for key in keys},
+                date__in={key[1] for key in keys},
+            )
+            existing.update({(row.employee_id, row.date): row for row in rows})
+
+        to_create, to_update, invalid_days = [], [], []
+        for (employee_id, day), punches in days.items():
+            row = existing.get((employee_id, day))
+            if row is None:
+                row = Attendance(employee_id=employee_id, date=day)
+                to_create.append(row)
+            else:
+                to_update.append(row)
+            if punches['check_in']:
+                row.check_in = min(filter(None, [row.check_in, punches['check_in']]))
+            if punches['check_out']:
+                row.check_out = max(filter(None, [row.check_out, punches['check_out']]))
+            if row.check_in and row.check_out and row.check_out < row.check_in:
+                # لا يوجد خروج صالح قبل الدخول؛ أي خروج سابق أقدم منه أيضاً
+                row.check_out = None
+                invalid_days.append((employee_id, day))
+            row.hours_worked = compute_hours_worked(day, row.check_in, row.check_out)
+
+        Attendance.objects.bulk_create(to_create, batch_size=1000)
+        Attendance.objects.bulk_update(to_update, ['check_in', 'check_out', 'hours_worked'], batch_size=1000)
+        created, updated = len(to_create), len(to_update)
+
+        # العمليات الجماعية لا ترسل إشارات، لذلك نعيد بناء ملخص الموظفين والأشهر المتأثرة
+        periods = {}
+        for employee_id, day in days:
+            periods.setdefault((day.year, day.month), set()).add(employee_id)
+        for (year, month), employee_ids in periods.items():
+            rebuild_attendance_summaries(year, month, employee_ids)
+        if created or updated:
+            bump_data_version(ATTENDANCE)
+    return created, updated, invalid_days
+
+
+# ----------------------------
+# إعادة حساب ساعات العمل والحالة في قاعدة البيانات
+# ----------------------------
+
+def _seconds_of_day(field):
+    return ExtractHour(field) * 3600 + ExtractMinute(field) * 60 + ExtractSecond(field)
+
+
+def hours_worked_expression():
+    """SQL expression for hours between check_in and check_out, rounded to 2 places (NULL if incomplete)."""
+    seconds = Cast(_seconds_of_day('check_out') - _seconds_of_day('check_in'), FloatField())
+    return Case(
+        When(check_in__isnull=False, check_out__isnull=False, then=Round(seconds / Value(3600.0), 2)),
+        default=None,
+        output_field=FloatField(),
+    )
+
+
+def late_threshold(value=None):
+    """Parse a late threshold (HH:MM), falling back to settings.ATTENDANCE_LATE_AFTER."""
+    value = value or settings.ATTENDANCE_LATE_AFTER
+    threshold = parse_time(value) if isinstance(value, str) else value
+    if threshold is None:
+        raise ValueError(f'وقت التأخير غير صالح: {value}')
+    return threshold
+
+
+def recompute_attendance(qs, late_after=None, batch_size=10000):
+    """
+    Recompute hours_worked (and status, if `late_after` is given) for every row of `qs`.
+
+    The work is a series of UPDATE ... WHERE id BETWEEN statements over
+    `batch_size`-wide id ranges, each in its own transaction, so no model
+    instance is loaded however many rows match. With `late_after`, rows with
+    a check-in become Late after that time and Present otherwise; rows without
+    a check-in keep their status. Monthly summaries of the touched months are
+    rebuilt at the end. Returns the number of rows updated.
+    """
+    bounds = qs.aggregate(Min('id'), Max('id'), Min('date'), Max('date'))
+    if bounds['id__min'] is None:
+        return 0
+
+    values = {'hours_worked': hours_worked_expression()}
+    if late_after is not None:
+        values['status'] = Case(
+            When(check_in__gt=late_threshold(late_after), then=Value('Late')),
+            When(check_in__isnull=False, then=Value('Present')),
+            default=F('status'),
+        )
+
+    updated = 0
+    for start in range(bounds['id__min'], bounds['id__max'] + 1, batch_size):
+        with transaction.atomic():
+            updated += qs.filter(id__gte=start, id__lt=start + batch_size).update(**values)
+            bump_data_version(ATTENDANCE)
+
+    # update() لا يرسل إشارات، لذلك نعيد بناء ملخص الأشهر التي شملها التعديل
+    year, month = bounds['date__min'].year, bounds['date__min'].month
+    while (year, month) <= (bounds['date__max'].year, bounds['date__max'].month):
+        rebuild_attendance_summaries(year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return updated
+
+
+# ----------------------------
+# تسجيل الغياب الليلي
+# ----------------------------
+
+def absent_profiles(day):
+    """
+    Active employees with no attendance row and no approved leave covering `day`.
+
+    Only profiles of type Employee are checked; HR and finance staff do not
+    record attendance. Every condition is a NOT EXISTS sub-query (archived days count as
+    attendance too), so the whole check is one anti-join query whatever the
+    number of employees.
+    """
+    has_attendance = Attendance.objects.filter(employee=OuterRef('pk'), date=day)
+    has_archived = AttendanceArchive.objects.filter(employee=OuterRef('pk'), date=day)
+    on_leave = LeaveRequest.objects.filter(
+        employee=OuterRef('pk'), status='Approved', start_date__lte=day, end_date__gte=day,
+    )
+    return (
+        Profile.objects
+        .filter(user_type='Employee', user__is_superuser=False, user__is_active=True, date_joined__lte=day)
+        .exclude(Exists(has_attendance))
+        .exclude(Exists(has_archived))
+        .exclude(Exists(on_leave))
+    )
+
+
+def mark_absences(start, end=None, skip_weekdays=(), batch_size=1000):
+    """
+    Insert an Absent attendance row for every absent employee on each day in [start, end].
+
+    Days whose weekday() is in `skip_weekdays` are not checked. Running the
+    same range again only fills days that are still missing, so it is safe to
+    use for backfills. Returns {day: created_count}.
+    """
+    end = end or start
+    if end < start:
+        raise ValueError('تاريخ النهاية يجب أن يكون بعد تاريخ البداية.')
+
+    results = {}
+    periods = {}
+    day = start
+    while day <= end:
+        if day.weekday() not in skip_weekdays:
+            with transaction.atomic():
+                employee_ids = list(absent_profiles(day).values_list('id', flat=True).iterator(chunk_size=batch_size))
+                day_rows = Attendance.objects.filter(date=day)
+                before = day_rows.count() if employee_ids else 0
+                Attendance.objects.bulk_create(
+                    [Attendance(employee_id=employee_id, date=day, status='Absent') for employee_id in employee_ids],
+                    batch_size=batch_size,
+                    ignore_conflicts=True,
+                )
+                # ignore_conflicts يتجاهل من سجّل حضوره في نفس اللحظة، لذلك نعد ما أُدرج فعلاً
+                results[day] = day_rows.count() - before if employee_ids else 0
+                if results[day]:
+                    bump_data_version(ATTENDANCE)
+            periods.setdefault((day.year, day.month), set()).update(employee_ids)
+        day += timedelta(days=1)
+
+    # bulk_create لا يرسل إشارات، لذلك نعيد بناء ملخص الموظفين والأشهر المتأثرة
+    for (year, month), employee_ids in periods.items():
+        if employee_ids:
+            rebuild_attendance_summaries(year, month, employee_ids)
+    return results
+
+
+# ----------------------------
+# تصفح سجلات الحضور (keyset pagination)
+# ----------------------------
+
+ATTENDANCE_PAGE_SIZE = 50
+MAX_CURSOR_ID = 2 ** 63 - 1
+
+
+def _parse_date_or_none(value):
+    # parse_date يعيد None للصيغة الخاطئة لكنه يرفع ValueError لتاريخ غير موجود مثل 2025-02-30
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def filter_attendances(qs, date_from=None, date_to=None, department=None, status=None):
+    """Narrow an Attendance queryset by date range, department and status; invalid values are ignored."""
+    date_from, date_to = _parse_date_or_none(date_from), _parse_date_or_none(date_to)
+    if date_from:
+        qs = qs.filter(date__gte=date_from)
+    if date_to:
+        qs = qs.filter(date__lte=date_to)
+    if department:
+        qs = qs.filter(employee__department=department)
+    if status in dict(Attendance.STATUS_CHOICES):
+        qs = qs.filter(status=status)
+    return qs
+
+
+def encode_attendance_cursor(attendance):
+    return f'{attendance.date.isoformat()}_{attendance.id}'
+
+
+def decode_attendance_cursor(cursor):
+    """Return (date, id) from a cursor string, or None if it is missing or malformed."""
+    day, _, pk = (cursor or '').partition('_')
+    day = _parse_date_or_none(day)
+    # isdigit يقبل أرقاماً مثل ² لا يفهمها int، والمعرّف يجب أن يتسع في عمود bigint
+    if day is None or not (pk.isascii() and pk.isdigit()) or int(pk) > MAX_CURSOR_ID:
+        return None
+    return day, int(pk)
+
+
+def attendance_page(qs, after=None, before=None, page_size=ATTENDANCE_PAGE_SIZE):
+    """
+    One page of `qs` ordered newest first, using a keyset on (date, id).
+
+    `after` continues past the last row of the previous page and `before`
+    goes back from the first row of the current one. Each page is a single
+    index range scan of page_size + 1 rows, so its cost does not grow with
+    the page number. Returns (rows, next_cursor, previous_cursor).
+    """
+    after, before = decode_attendance_cursor(after), decode_attendance_cursor(before)
+    if before:
+        day, pk = before
+        qs = qs.filter(Q(date__gt=day) | Q(date=day, id__gt=pk)).order_by('date', 'id')
+    else:
+        if after:
+            day, pk = after
+            qs = qs.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+        qs = qs.order_by('-date', '-id')
+
+    rows = list(qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+        has_next, has_previous = bool(rows), has_more
+    else:
+        has_next, has_previous = has_more, after is not None
+
+    next_cursor = encode_attendance_cursor(rows[-1]) if rows and has_next else None
+    previous_cursor = encode_attendance_cursor(rows[0]) if rows and has_previous else None
+    return rows, next_cursor, previous_cursor
+
+
+# ----------------------------
+# ملخص الحضور الشهري
+# ----------------------------
+
+def attendance_summary_values(attendance):
+    """The (key, amounts) a single Attendance row contributes to AttendanceSummary."""
+    day = attendance.date
+    if isinstance(day, str):
+        day = datetime.strptime(day, '%Y-%m-%d').date()
+    key = (attendance.employee_id, day.year, day.month)
+    amounts = (
+        int(attendance.status == 'Present'),
+        int(attendance.status == 'Absent'),
+        int(attendance.status == 'Late'),
+        Decimal(str(attendance.hours_worked or 0)),
+    )
+    return key, amounts
+
+
+def apply_attendance_summary_delta(key, amounts, sign):
+    """
+    Add (sign=1) or remove (sign=-1) one attendance row from its monthly summary.
+
+    Removing never creates a summary row: a missing summary does not hold
+    the row in the first place, and the employee may be in the middle of
+    being deleted.
+    """
+    employee_id, year, month = key
+    present, absent, late, hours = amounts
+    if sign > 0:
+        AttendanceSummary.objects.get_or_create(employee_id=employee_id, year=year, month=month)
+    AttendanceSummary.objects.filter(employee_id=employee_id, year=year, month=month).update(
+        present_count=F('present_count') + sign * present,
+        absent_count=F('absent_count') + sign * absent,
+        late_count=F('late_count') + sign * late,
+        total_hours=F('total_hours') + sign * hours,
+    )
+
+
+def _summary_totals(qs):
+    """Per (employee, year, month) counts and hours of an Attendance or AttendanceArchive queryset."""
+    return (
+        qs
+        .annotate(period_year=ExtractYear('date'), period_month=ExtractMonth('date'))
+        .values('employee_id', 'period_year', 'period_month')
+        .annotate(
+            present=Count('id', filter=Q(status='Present')),
+            absent=Count('id', filter=Q(status='Absent')),
+            late=Count('id', filter=Q(status='Late')),
+            hours=Sum('hours_worked'),
+        )
+        .order_by()
+    )
+
+
+def rebuild_attendance_summaries(year=None, month=None, employee_ids=None):
+    """
+    Recompute AttendanceSummary from the live and archived attendance rows.
+
+    The scope can be narrowed to a year, a month and/or a set of employees;
+    only the summaries inside the scope are replaced. Each table is read with
+    one aggregate query (per IN_BATCH_SIZE employees). Returns the number of
+    summary rows written.
+    """
+    scope = {}
+    if year is not None:
+        scope['date__year'] = year
+    if month is not None:
+        scope['date__month'] = month
+    scopes = [scope] if employee_ids is None else [
+        {**scope, 'employee_id__in': chunk} for chunk in _chunks(employee_ids, IN_BATCH_SIZE)
+    ]
+    with transaction.atomic():
+        return sum(_rebuild_attendance_summaries(chunk_scope) for chunk_scope in scopes)
+
+
+def _rebuild_attendance_summaries(scope):
+    merged = {}
+    for model in (Attendance, AttendanceArchive):
+        for row in _summary_totals(model.objects.filter(**scope)):
+            key = (row['employee_id'], row['period_year'], row['period_month'])
+            totals = merged.setdefault(key, [0, 0, 0, Decimal('0')])
+            totals[0] += row['present']
+            totals[1] += row['absent']
+            totals[2] += row['late']
+            totals[3] += row['hours'] or 0
+
+    rows = [
+        AttendanceSummary(
+            employee_id=employee_id, year=period_year, month=period_month,
+            present_count=present, absent_count=absent, late_count=late, total_hours=hours,
+        )
+        for (employee_id, period_year, period_month), (present, absent, late, hours) in merged.items()
+    ]
+    summaries = AttendanceSummary.objects.filter(
+        **{key.replace('date__', ''): value for key, value in scope.items()}
+    )
+    summaries.delete()
+    AttendanceSummary.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+# ----------------------------
+# أرشفة الحضور (جدول ساخن وجدول أرشيف)
+# ----------------------------
+
+ARCHIVE_FIELDS = ('employee_id', 'date', 'check_in', 'check_out', 'hours_worked', 'status')
+
+# مفعّل أثناء حذف السجلات المنقولة إلى الأرشيف، فلا تطرحها إشارة الحذف من الملخص الشهري
+archiving_attendance = ContextVar('archiving_attendance', default=False)
+
+
+def archive_cutoff(days=None):
+    """Rows dated before this day are archived."""
+    days = settings.ATTENDANCE_ARCHIVE_AFTER_DAYS if days is None else days
+    return timezone.localdate() - timedelta(days=days)
+
+
+def archive_attendance(before, batch_size=5000, max_batches=None):
+    """
+    Move Attendance rows dated before `before` into AttendanceArchive.
+
+    Rows are moved oldest id first, `batch_size` at a time, each batch in its
+    own transaction (copy, then delete). An interrupted run keeps the batches
+    it finished and the next run continues from there; `original_id` is
+    unique, so a batch is never archived twice. Monthly summaries are left
+    as they are, since they cover both tables. Returns the number of rows moved.
+    """
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            rows = list(
+                Attendance.objects
+                .select_for_update()
+                .filter(date__lt=before)
+                .order_by('id')
+                .values('id', *ARCHIVE_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            ids = [row['id'] for row in rows]
+            AttendanceArchive.objects.bulk_create(
+                [AttendanceArchive(original_id=row.pop('id'), **row) for row in rows],
+                ignore_conflicts=True,
+            )
+            # الملخص الشهري يحسب السجلات المؤرشفة أيضاً، فلا نطرحها عند حذفها من الجدول الساخن
+            token = archiving_attendance.set(True)
+            try:
+                Attendance.objects.filter(id__in=ids).delete()
+            finally:
+                archiving_attendance.reset(token)
+        moved += len(ids)
+        batches += 1
+    return moved
+
+
+HISTORY_FIELDS = ('date', 'check_in', 'check_out', 'hours_worked', 'status')
+
+
+def attendance_history(employee_id, year=None):
+    """
+    All attendance rows of one employee from the live and archive tables, newest first.
+
+    This is the only place that reads both tables; each row carries an
+    `archived` flag. Returns a UNION ALL queryset of dicts.
+    """
+    live = Attendance.objects.filter(employee_id=employee_id)
+    archived = AttendanceArchive.objects.filter(employee_id=employee_id)
+    if year is not None:
+        live, archived = live.filter(date__year=year), archived.filter(date__year=year)
+    live = live.annotate(archived=Value(False, output_field=BooleanField())).values(*HISTORY_FIELDS, 'archived')
+    archived = archived.annotate(archived=Value(True, output_field=BooleanField())).values(*HISTORY_FIELDS, 'archived')
+    return live.union(archived, all=True).order_by('-date')
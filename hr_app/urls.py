@@ -21,6 +21,7 @@ urlpatterns = [
     path('profile/', views.profile_view, name='profile'),
     path('contact-hr/', views.contact_hr, name='contact_hr'),
     path('hr/inbox/', views.hr_inbox, name='hr_inbox'),
+    path('hr/announcements/', views.send_announcement, name='send_announcement'),
     path('hr/message/<int:msg_id>/', views.view_message, name='view_message'),
     path('hr/message/<int:msg_id>/reply/', views.reply_message, name='reply_message'),
 
@@ -32,12 +33,16 @@ urlpatterns = [
     # Attendance
     path('attendance/', views.attendance, name='attendance'),
     path('manage-attendance/', views.manage_attendance, name='manage_attendance'),
+    path('attendance/punches/', views.attendance_punches, name='attendance_punches'),
+    path('attendance/history/', views.attendance_history_view, name='attendance_history'),
+    path('attendance/analytics/', views.attendance_analytics, name='attendance_analytics'),
 
     # Leave
     path('request-leave/', views.request_leave, name='request_leave'),
 
     # Notifications
     path('notifications/', views.notifications, name='notifications'),
+    path('events/', views.event_stream, name='event_stream'),
     
     # HR / Admin management
     path('manage-employees/', views.manage_employees, name='manage_employees'),
@@ -49,6 +54,7 @@ urlpatterns = [
     path('manage-leaves/', views.manage_leaves, name='manage_leaves'),
     path('leaves/approve/<int:leave_id>/', views.approve_leave, name='approve_leave'),
     path('leaves/reject/<int:leave_id>/', views.reject_leave, name='reject_leave'),
+    path('leaves/bulk-decision/', views.bulk_leave_decision, name='bulk_leave_decision'),
 
     # Payroll / Evaluations
     path('manage-payroll/', views.manage_payroll, name='manage_payroll'),
@@ -56,9 +62,19 @@ urlpatterns = [
     path('manage-evaluations/', views.manage_evaluations, name='manage_evaluations'),
     path('payroll/export/', views.export_payroll, name='export_payroll'),
     path('payroll/add/', views.add_payroll, name='add_payroll'),
+    path('payroll/run/', views.payroll_run, name='payroll_run'),
+    path('payroll/adjust/', views.adjust_payroll_salaries, name='adjust_payroll_salaries'),
+    path('payroll/import/', views.import_payroll, name='import_payroll'),
+    path('payroll/simulate/', views.simulate_payroll, name='simulate_payroll'),
     path('payroll/export-pdf/', views.export_payroll_pdf, name='export_payroll_pdf'),
+    path('payroll/export-pdf/metrics/', views.pdf_pool_metrics, name='pdf_pool_metrics'),
+    path('payroll/payslips/', views.export_payslips_zip, name='export_payslips_zip'),
+    path('payroll/reports/', views.payroll_report_job_create, name='payroll_report_job_create'),
+    path('payroll/reports/<int:job_id>/', views.payroll_report_job_status, name='payroll_report_job_status'),
+    path('payroll/reports/<int:job_id>/download/', views.payroll_report_job_download, name='payroll_report_job_download'),
     path('employees/evaluate/add/', views.add_evaluation, name='add_evaluation'),
     path('employees/<int:emp_id>/details/', views.employee_details, name='employee_details'),
+    path('employees/<int:emp_id>/attendance-history/', views.employee_attendance_history, name='employee_attendance_history'),
 
 
 ]
@@ -0,0 +1,32 @@
+# hr_app/versions.py
+"""
+أرقام إصدار رخيصة للبيانات التي تُخزّن نتائجها مؤقتاً (تقرير الرواتب، تحليلات الحضور):
+تزيد مع كل تعديل بدلاً من حساب بصمة تمر على الجدول كله في كل طلب.
+"""
+
+from django.db.models import F
+
+from .models import DataVersion
+
+PAYROLL = 'payroll'
+ATTENDANCE = 'attendance'
+
+
+def bump_data_version(name):
+    """Increase the version of `name` by one, creating its row on first use."""
+    if DataVersion.objects.filter(name=name).update(version=F('version') + 1):
+        return
+    _, created = DataVersion.objects.get_or_create(name=name, defaults={'version': 1})
+    if not created:
+        # أنشأه طلب آخر في نفس اللحظة
+        DataVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def data_version(name):
+    """
+    Current (created_at, version) of `name`, or None before its first change.
+
+    The creation time is part of the value so that a counter that was reset
+    (e.g. a restored database) never matches a key built from the old one.
+    """
+    return DataVersion.objects.filter(name=name).values_list('created_at', 'version').first()
@@ -3,26 +3,35 @@
 # --- 1. Python Standard Library ---
 import asyncio
 import csv
+import hmac
+import json
 import os
 from datetime import datetime, date
 from decimal import Decimal, InvalidOperation
 from io import BytesIO
 
 # --- 2. Django Core Libraries ---
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
 from django.contrib.staticfiles import finders
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Avg
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.template.loader import get_template, render_to_string
 from django.utils import timezone
+from django.utils.dateparse import parse_time
+from django.utils.http import urlencode
+from django.views.decorators.csrf import csrf_exempt
 
 # --- 3. Third-Party Libraries ---
-from playwright.async_api import async_playwright
 # إذا كنت لا تزال تستخدم xhtml2pdf، يمكنك إبقاء هذه الاستدعاءات
 from xhtml2pdf import pisa
 from reportlab.pdfbase import pdfmetrics
@@ -36,7 +45,51 @@ from .models import (
     Message,
     Notification,
     Payroll,
+    PayrollRollup,
+    PayrollRun,
     Profile,
+    ReportJob,
+)
+from .attendance_analytics import get_attendance_analytics
+from .events import get_broker
+from .leaves import (
+    attended_days,
+    decide_leaves,
+    department_out,
+    employee_leave_conflicts,
+    leave_balances,
+    set_leave_status,
+    validate_leave_dates,
+)
+from .messaging import (
+    broadcast_announcement,
+    hr_manager_ids,
+    inbox_page,
+    inbox_threads,
+    mark_message_read,
+    mark_notifications_read,
+    notify,
+    send_messages,
+    thread_messages,
+)
+from .pdf import get_browser_pool
+from .payroll import adjust_salaries, iter_payroll_export_rows, run_monthly_payroll, to_decimal, validate_period
+from .payroll_import import import_payroll_file
+from .payroll_simulator import get_snapshot, simulate, validate_rules
+from .reports import (
+    cached_report_path,
+    enqueue_payroll_report,
+    payslip_rows,
+    stream_payslips_zip,
+)
+from .timekeeping import (
+    PUNCH_ACTIONS,
+    attendance_history,
+    attendance_page,
+    compute_hours_worked,
+    filter_attendances,
+    record_punches,
+    record_web_punch,
 )
 
 
@@ -45,17 +98,6 @@ from .models import (
 # Helpers
 # ----------------------------
 
-def to_decimal(val, default=Decimal('0.00')):
-    """
-    تقوم بتحويل القيمة إلى Decimal بشكل آمن، وتعيد قيمة افتراضية عند الفشل.
-    """
-    try:
-        if val in (None, ''):
-            return default
-        return Decimal(val)
-    except (InvalidOperation, TypeError):
-        return default
-
 def is_hr_manager(user):
     return Profile.objects.filter(user=user, user_type='HR Manager').exists() or user.is_superuser
 
@@ -146,6 +188,7 @@ def dashboard_hr(request):
         'pending_leaves': pending_leaves,
         'today_attendance': today_attendance,
         'average_performance': average_performance, # <-- نرسل القيمة المحسوبة
+        'departments': Profile.DEPARTMENTS,
     }
     return render(request, 'dashboards/dashboard_admin.html', context)
 @login_required
@@ -154,7 +197,8 @@ def dashboard_employee(request):
     profile = Profile.objects.get(user=request.user)
     payroll = Payroll.objects.filter(employee=profile).first()
     evaluations = Evaluation.objects.filter(employee=profile).order_by('-month')
-    notifications = Notification.objects.filter(user=request.user, is_read=False)
+    # القالب يعرض آخر إشعارين فقط
+    notifications = Notification.objects.filter(user=request.user, is_read=False).order_by('-created_at')[:2]
     context = {
         'employee': profile,
         'payroll': payroll,
@@ -167,7 +211,10 @@ def dashboard_employee(request):
 @user_passes_test(is_finance)
 def dashboard_finance(request):
     payrolls = Payroll.objects.all()
-    context = {'payrolls': payrolls}
+    # إجماليات الشهر الحالي تُقرأ من جدول الملخص (صف لكل قسم) بدلاً من تجميع كل الرواتب
+    now = timezone.now()
+    rollups = PayrollRollup.objects.filter(year=now.year, month=now.month, headcount__gt=0).order_by('department')
+    context = {'payrolls': payrolls, 'rollups': rollups, 'current_year': now.year, 'current_month': now.month}
     return render(request, 'dashboards/dashboard_finance.html', context)
 
 # ----------------------------
@@ -214,46 +261,126 @@ def attendance(request):
         user=request.user,
         defaults={'user_type': 'Employee'}
     )
-    today = timezone.now().date()
-    attendance_record, created = Attendance.objects.get_or_create(employee=profile, date=today)
-
     if request.method == 'POST':
+        # تحديث شرطي واحد لكل ضغطة: الضغط المزدوج أو الطلبات المتزامنة لا تنشئ سجلات مكررة
         action = request.POST.get('action')
-        if action == 'check_in' and not attendance_record.check_in:
-            attendance_record.check_in = timezone.now().time()
-        elif action == 'check_out' and not attendance_record.check_out:
-            attendance_record.check_out = timezone.now().time()
-            if attendance_record.check_in:
-                t_in = datetime.combine(today, attendance_record.check_in)
-                t_out = datetime.combine(today, attendance_record.check_out)
-                delta = t_out - t_in
-                attendance_record.hours_worked = round(delta.total_seconds() / 3600, 2)
-        attendance_record.save()
+        if action in PUNCH_ACTIONS:
+            record_web_punch(profile.id, action)
         return redirect('attendance')
 
+    today = timezone.localdate()
+    attendance_record = Attendance.objects.filter(employee=profile, date=today).first() or Attendance(employee=profile, date=today)
     return render(request, 'attendance.html', {'attendance': attendance_record})
 
 @login_required
 @user_passes_test(is_hr_manager)
 def manage_attendance(request):
-    attendances = Attendance.objects.select_related('employee__user').order_by('-date')
     if request.method == 'POST':
         attendance_id = request.POST.get('attendance_id')
         check_in = request.POST.get('check_in')
         check_out = request.POST.get('check_out')
-        attendance = Attendance.objects.get(id=attendance_id)
+        attendance = get_object_or_404(Attendance, id=attendance_id)
         if check_in:
-            attendance.check_in = check_in
+            attendance.check_in = parse_time(check_in) or attendance.check_in
         if check_out:
-            attendance.check_out = check_out
-            if attendance.check_in:
-                t_in = datetime.combine(attendance.date, attendance.check_in)
-                t_out = datetime.combine(attendance.date, attendance.check_out)
-                delta = t_out - t_in
-                attendance.hours_worked = round(delta.total_seconds()/3600, 2)
+            attendance.check_out = parse_time(check_out) or attendance.check_out
+        # نعيد حساب الساعات عند تصحيح وقت الدخول أو الخروج
+        attendance.hours_worked = compute_hours_worked(attendance.date, attendance.check_in, attendance.check_out)
         attendance.save()
         return redirect('manage_attendance')
-    return render(request, 'manage_attendance.html', {'attendances': attendances})
+
+    filters = {name: request.GET.get(name, '') for name in ('date_from', 'date_to', 'department', 'status')}
+    attendances = filter_attendances(Attendance.objects.select_related('employee__user'), **filters)
+    attendances, next_cursor, previous_cursor = attendance_page(
+        attendances, after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    # نحتفظ بالفلاتر في روابط الصفحات التالية والسابقة
+    query = urlencode({name: value for name, value in filters.items() if value})
+    return render(request, 'manage_attendance.html', {
+        'attendances': attendances,
+        'filters': filters,
+        'filter_query': query,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+        'departments': Profile.DEPARTMENTS,
+        'statuses': Attendance.STATUS_CHOICES,
+    })
+
+def _render_attendance_history(request, profile, back_url):
+    year = request.GET.get('year', '')
+    rows = attendance_history(profile.id, int(year) if year.isdigit() else None)
+    page = Paginator(rows, 50).get_page(request.GET.get('page'))
+    return render(request, 'attendance_history.html', {
+        'profile': profile,
+        'page': page,
+        'year': year,
+        'back_url': back_url,
+    })
+
+
+@login_required
+@user_passes_test(is_employee)
+def attendance_history_view(request):
+    """السجل الكامل لحضور الموظف الحالي (يشمل السجلات المؤرشفة)."""
+    profile = get_object_or_404(Profile, user=request.user)
+    return _render_attendance_history(request, profile, reverse('attendance'))
+
+
+@login_required
+@user_passes_test(is_hr_manager)
+def employee_attendance_history(request, emp_id):
+    """السجل الكامل لحضور موظف معين للمدير (يشمل السجلات المؤرشفة)."""
+    profile = get_object_or_404(Profile, id=emp_id)
+    return _render_attendance_history(request, profile, reverse('employee_details', args=[emp_id]))
+
+
+@login_required
+@user_passes_test(is_hr_manager)
+def attendance_analytics(request):
+    """
+    تحليلات الحضور بصيغة JSON للوحة مدير الموارد البشرية.
+
+    المعاملات الاختيارية: year و month (الافتراضي الشهر الحالي) و department.
+    """
+    today = timezone.localdate()
+    try:
+        year, month = validate_period(request.GET.get('year') or today.year, request.GET.get('month') or today.month)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    department = request.GET.get('department') or None
+    if department and department not in dict(Profile.DEPARTMENTS):
+        return JsonResponse({'status': 'error', 'message': 'القسم غير موجود.'}, status=400)
+
+    result = get_attendance_analytics(department, year, month)
+    return JsonResponse({'status': 'success', 'year': year, 'month': month, 'department': department, **result})
+
+
+@csrf_exempt
+def attendance_punches(request):
+    """
+    واجهة JSON لأجهزة الحضور لرفع مجموعة بصمات دفعة واحدة.
+
+    الطلب: POST مع الترويسة X-Terminal-Token والجسم
+    {"events": [{"employee": "username", "timestamp": "2025-01-05T08:01:00+03:00", "action": "check_in"}]}
+    """
+    token = settings.ATTENDANCE_TERMINAL_TOKEN
+    # نقارن البايتات لأن compare_digest يرفض النصوص غير ASCII بخطأ TypeError
+    supplied = request.headers.get('X-Terminal-Token', '').encode()
+    if not token or not hmac.compare_digest(supplied, token.encode()):
+        return JsonResponse({'status': 'error', 'message': 'Invalid terminal token'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    events = payload.get('events') if isinstance(payload, dict) else payload
+    if not isinstance(events, list):
+        return JsonResponse({'status': 'error', 'message': 'events must be a list'}, status=400)
+
+    result = record_punches(events)
+    return JsonResponse({'status': 'success', **result})
+
 
 # ----------------------------
 # Leave Request
@@ -268,26 +395,108 @@ def request_leave(request):
     )
     if request.method == 'POST':
         leave_type = request.POST.get('leave_type')
-        start_date = request.POST.get('start_date')
-        end_date = request.POST.get('end_date')
         reason = request.POST.get('reason')
-        LeaveRequest.objects.create(
-            employee=profile,
-            leave_type=leave_type,
-            start_date=start_date,
-            end_date=end_date,
-            reason=reason
-        )
+        try:
+            start_date, end_date = validate_leave_dates(request.POST.get('start_date'), request.POST.get('end_date'))
+            if leave_type not in dict(LeaveRequest.LEAVE_TYPES):
+                raise ValueError('نوع الإجازة غير صالح.')
+            with transaction.atomic():
+                # قفل ملف الموظف حتى لا يمر طلبان متداخلان أُرسلا في نفس اللحظة
+                Profile.objects.select_for_update().get(pk=profile.pk)
+                conflict = employee_leave_conflicts(profile.id, start_date, end_date).first()
+                if conflict:
+                    raise ValueError(
+                        f'الفترة تتداخل مع طلب إجازة {conflict.get_status_display()} '
+                        f'من {conflict.start_date} إلى {conflict.end_date}.'
+                    )
+                worked = attended_days(profile.id, start_date, end_date)
+                if worked:
+                    raise ValueError(f"لديك حضور مسجل في: {', '.join(str(day) for day in worked)}.")
+                LeaveRequest.objects.create(
+                    employee=profile,
+                    leave_type=leave_type,
+                    start_date=start_date,
+                    end_date=end_date,
+                    reason=reason
+                )
+        except ValueError as e:
+            messages.error(request, str(e))
+            return render(request, 'request_leave.html', {
+                'form_data': request.POST,
+                'balances': leave_balances(profile.id, timezone.localdate().year),
+            })
+        messages.success(request, 'تم إرسال طلب الإجازة')
         return redirect('request_leave')
-    return render(request, 'request_leave.html')
+    return render(request, 'request_leave.html', {'balances': leave_balances(profile.id, timezone.localdate().year)})
 
 # ----------------------------
 # Notifications
 # ----------------------------
 @login_required
 def notifications(request):
-    notes = Notification.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'notifications.html', {'notifications': notes})
+    if request.method == 'POST':
+        # التعليم كمقروء يتم بطلب صريح فقط حتى لا يمحو مجرد فتح الصفحة الشارة
+        note_id = request.POST.get('notification_id')
+        if note_id:
+            if note_id.isdigit():
+                mark_notifications_read(request.user.id, [int(note_id)])
+            else:
+                messages.error(request, 'معرّف الإشعار غير صالح.')
+        else:
+            mark_notifications_read(request.user.id)
+        return redirect(request.get_full_path())
+
+    unread_only = request.GET.get('unread') == '1'
+    notes = Notification.objects.filter(user=request.user)
+    if unread_only:
+        notes = notes.filter(is_read=False)
+    notes, next_cursor, previous_cursor = inbox_page(notes, after=request.GET.get('after'), before=request.GET.get('before'))
+    return render(request, 'notifications.html', {
+        'notifications': notes,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+        'filter_query': urlencode({'unread': '1'}) if unread_only else '',
+        'unread_only': unread_only,
+    })
+
+
+async def event_stream(request):
+    """
+    بث الإشعارات والرسائل الجديدة للمستخدم الحالي (Server-Sent Events).
+
+    يعمل فقط تحت ASGI حيث يبقى الاتصال مفتوحاً دون حجز خيط؛ تحت WSGI يرد بـ 204
+    فيتوقف المتصفح عن إعادة المحاولة وتبقى الصفحات تعمل بالتحديث العادي.
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    subscription = get_broker().subscribe(user.pk)
+    heartbeat = settings.EVENT_STREAM_HEARTBEAT
+    # Django 4.2 لا يلاحظ انقطاع العميل أثناء البث، لذلك نغلق الاتصال بعد مدة محددة
+    # ويعيد المتصفح الاتصال تلقائياً؛ هكذا لا تتراكم الاشتراكات المهجورة
+    deadline = asyncio.get_running_loop().time() + settings.EVENT_STREAM_MAX_AGE
+
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while asyncio.get_running_loop().time() < deadline:
+                try:
+                    event = await subscription.get(timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    # تعليق فارغ يبقي الاتصال حياً عبر الـ proxies
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # ----------------------------
@@ -299,43 +508,79 @@ def notifications(request):
 @user_passes_test(is_employee)
 def contact_hr(request):
     if request.method == 'POST':
-        # --- التعديل الرئيسي هنا: نبحث عن "كل" المديرين وليس الأول فقط ---
-        hr_profiles = Profile.objects.filter(user_type='HR Manager', user__is_superuser=False).select_related('user')
-        
+        # نرسل نسخة من الرسالة والإشعار لكل مديري الموارد البشرية دفعة واحدة
         subject = request.POST.get('subject', 'رسالة من موظف')
         body = request.POST.get('body', '')
 
+        sent = send_messages(
+            request.user, hr_manager_ids(), subject, body,
+            notification=f'رسالة جديدة من الموظف: {request.user.get_full_name() or request.user.username}',
+        )
         # إذا لم نجد أي مدير، نعرض رسالة خطأ
-        if not hr_profiles.exists():
+        if not sent:
             messages.error(request, 'لا يوجد مدير موارد بشرية متاح حالياً لاستقبال الرسالة')
             return redirect('dashboard') # توجيه المستخدم إلى لوحة التحكم
 
-        # --- نمر على كل مدير ونرسل له نسخة من الرسالة والإشعار ---
-        for profile in hr_profiles:
-            # إنشاء رسالة للمدير الحالي في الحلقة
-            Message.objects.create(
-                sender=request.user, 
-                recipient=profile.user, 
-                subject=subject, 
-                body=body
-            )
-            # إنشاء إشعار للمدير الحالي في الحلقة
-            Notification.objects.create(
-                user=profile.user, 
-                message=f'رسالة جديدة من الموظف: {request.user.get_full_name() or request.user.username}'
-            )
-            
         messages.success(request, 'تم إرسال رسالتك إلى قسم الموارد البشرية بنجاح')
         return redirect('dashboard') # توجيه المستخدم إلى لوحة التحكم بعد الإرسال
 
     # هذا الجزء يبقى كما هو لعرض الفورم
     return render(request, 'contact_hr.html')
 
+
+def inbox_context(request):
+    """
+    صفحة واحدة من صندوق الوارد للمستخدم الحالي (مشتركة بين المدير والموظف).
+
+    ?unread=1 يعرض غير المقروء فقط، و ?group=thread يعرض المحادثات بدلاً من الرسائل المنفردة.
+    """
+    unread_only = request.GET.get('unread') == '1'
+    query = {'unread': '1'} if unread_only else {}
+    if request.GET.get('group') == 'thread':
+        threads, next_cursor = inbox_threads(request.user, after=request.GET.get('after'), unread_only=unread_only)
+        return {
+            'group': 'thread',
+            'threads': threads,
+            'next_cursor': next_cursor,
+            'first_page_query': urlencode({**query, 'group': 'thread'}) if request.GET.get('after') else None,
+            'filter_query': urlencode({**query, 'group': 'thread'}),
+            'unread_only': unread_only,
+        }
+
+    msgs = Message.objects.filter(recipient=request.user).select_related('sender')
+    if unread_only:
+        msgs = msgs.filter(is_read=False)
+    rows, next_cursor, previous_cursor = inbox_page(msgs, after=request.GET.get('after'), before=request.GET.get('before'))
+    return {
+        'inbox': rows,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+        'filter_query': urlencode(query),
+        'unread_only': unread_only,
+    }
+
+
+@login_required
+@user_passes_test(is_hr_manager)
+def send_announcement(request):
+    """إرسال إعلان (رسالة وإشعار) لكل موظفي قسم أو أكثر."""
+    if request.method == 'POST':
+        departments = [d for d in request.POST.getlist('departments') if d in dict(Profile.DEPARTMENTS)]
+        subject = request.POST.get('subject', '').strip()
+        body = request.POST.get('body', '').strip()
+        if not departments or not subject or not body:
+            messages.error(request, 'الرجاء اختيار قسم واحد على الأقل وكتابة الموضوع ونص الإعلان.')
+        else:
+            sent = broadcast_announcement(request.user, departments, subject, body)
+            messages.success(request, f'تم إرسال الإعلان إلى {sent} موظف.')
+            return redirect('send_announcement')
+    return render(request, 'send_announcement.html', {'departments': Profile.DEPARTMENTS})
+
+
 @login_required
 @user_passes_test(is_hr_manager)
 def hr_inbox(request):
-    msgs = Message.objects.filter(recipient=request.user).order_by('-created_at')
-    return render(request, 'hr_inbox.html', {'messages': msgs})
+    return render(request, 'hr_inbox.html', inbox_context(request))
 
 
 @login_required
@@ -343,10 +588,8 @@ def hr_inbox(request):
 def view_message(request, msg_id):
     msg = get_object_or_404(Message, id=msg_id, recipient=request.user)
     # mark as read
-    if not msg.is_read:
-        msg.is_read = True
-        msg.save()
-    return render(request, 'message_detail.html', {'message': msg})
+    mark_message_read(msg)
+    return render(request, 'message_detail.html', {'message': msg, 'thread': thread_messages(msg, request.user)})
 
 
 @login_required
@@ -356,9 +599,11 @@ def reply_message(request, msg_id):
     if request.method == 'POST':
         body = request.POST.get('body', '')
         subject = 'رد: ' + (orig.subject or '')
-        reply = Message.objects.create(sender=request.user, recipient=orig.sender, subject=subject, body=body, reply_to=orig)
-        # notify the original sender (employee)
-        Notification.objects.create(user=orig.sender, message=f'لقد تلقيت رداً من مدير الموارد البشرية: {request.user.username}', link='')
+        # the reply and the notification of the original sender (employee) are written together
+        send_messages(
+            request.user, [orig.sender_id], subject, body, reply_to=orig,
+            notification=f'لقد تلقيت رداً من مدير الموارد البشرية: {request.user.username}', link='',
+        )
         messages.success(request, 'تم إرسال الرد')
         return redirect('hr_inbox')
     return render(request, 'reply_message.html', {'message': orig})
@@ -373,8 +618,7 @@ def reply_message(request, msg_id):
 @user_passes_test(is_employee)
 def employee_inbox(request):
     """عرض صندوق الوارد الخاص بالموظف (الرسائل الواردة)"""
-    msgs = Message.objects.filter(recipient=request.user).order_by('-created_at')
-    return render(request, 'employee_inbox.html', {'messages': msgs})
+    return render(request, 'employee_inbox.html', inbox_context(request))
 
 
 @login_required
@@ -382,10 +626,8 @@ def employee_inbox(request):
 def employee_view_message(request, msg_id):
     """عرض رسالة محددة للموظف (وضع القراءة)"""
     msg = get_object_or_404(Message, id=msg_id, recipient=request.user)
-    if not msg.is_read:
-        msg.is_read = True
-        msg.save()
-    return render(request, 'employee_message_detail.html', {'message': msg})
+    mark_message_read(msg)
+    return render(request, 'employee_message_detail.html', {'message': msg, 'thread': thread_messages(msg, request.user)})
 
 
 @login_required
@@ -396,9 +638,11 @@ def employee_reply_message(request, msg_id):
     if request.method == 'POST':
         body = request.POST.get('body', '')
         subject = 'رد: ' + (orig.subject or '')
-        reply = Message.objects.create(sender=request.user, recipient=orig.sender, subject=subject, body=body, reply_to=orig)
-        # notify the HR manager
-        Notification.objects.create(user=orig.sender, message=f'لقد تلقيت رداً من الموظف: {request.user.username}', link='')
+        # the reply and the notification of the HR manager are written together
+        send_messages(
+            request.user, [orig.sender_id], subject, body, reply_to=orig,
+            notification=f'لقد تلقيت رداً من الموظف: {request.user.username}', link='',
+        )
         messages.success(request, 'تم إرسال الرد إلى مدير الموارد البشرية')
         return redirect('employee_inbox')
     return render(request, 'employee_reply_message.html', {'message': orig})
@@ -473,25 +717,86 @@ def manage_leaves(request):
 @login_required
 @user_passes_test(is_hr_manager)
 def approve_leave(request, leave_id):
-    leave = get_object_or_404(LeaveRequest, id=leave_id)
-    leave.status = 'Approved'
-    leave.approved_by = request.user
-    leave.save()
-    messages.success(request, 'تم قبول الإجازة')
-    return redirect('manage_leaves')
+    """
+    عرض تعارضات الطلب (طلبات متداخلة، أيام حضور، ومن هو في إجازة من نفس القسم) ثم القبول عند التأكيد.
+    """
+    leave = get_object_or_404(LeaveRequest.objects.select_related('employee__user'), id=leave_id)
+    conflicts = list(employee_leave_conflicts(leave.employee_id, leave.start_date, leave.end_date, exclude_id=leave.id))
+
+    if request.method == 'POST':
+        # التحقق من التعارض يتم داخل set_leave_status بعد قفل الطلب والموظف
+        try:
+            set_leave_status(leave.id, 'Approved', request.user)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('approve_leave', leave_id=leave.id)
+        messages.success(request, 'تم قبول الإجازة')
+        return redirect('manage_leaves')
+
+    out = []
+    if leave.employee.department:
+        out = list(department_out(leave.employee.department, leave.start_date, leave.end_date, leave.employee_id))
+    return render(request, 'approve_leave.html', {
+        'leave': leave,
+        'conflicts': conflicts,
+        'attended_days': attended_days(leave.employee_id, leave.start_date, leave.end_date),
+        'department_out': out,
+        'department_size': Profile.objects.filter(department=leave.employee.department).count() if leave.employee.department else 0,
+        'balances': leave_balances(leave.employee_id, leave.start_date.year),
+        'requested_days': (leave.end_date - leave.start_date).days + 1,
+    })
 
 
 @login_required
 @user_passes_test(is_hr_manager)
 def reject_leave(request, leave_id):
     leave = get_object_or_404(LeaveRequest, id=leave_id)
-    leave.status = 'Rejected'
-    leave.approved_by = request.user
-    leave.save()
+    # رفض إجازة مقبولة سابقاً يعيد أيامها إلى الرصيد
+    set_leave_status(leave.id, 'Rejected', request.user)
     messages.success(request, 'تم رفض الإجازة')
     return redirect('manage_leaves')
 
 
+@login_required
+@user_passes_test(is_hr_manager)
+def bulk_leave_decision(request):
+    """
+    قبول أو رفض عدة طلبات إجازة في طلب واحد.
+
+    يستقبل من نموذج إدارة الإجازات الحقلين leave_ids (متعدد) و decision،
+    أو JSON بالشكل: {"leave_ids": [1, 2, 3], "decision": "Approved"}
+    ويعيد في حالة JSON نتيجة كل طلب على حدة.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    is_json = request.content_type == 'application/json'
+    try:
+        if is_json:
+            payload = json.loads(request.body or b'{}')
+            leave_ids, decision = payload.get('leave_ids') or [], payload.get('decision')
+        else:
+            leave_ids, decision = request.POST.getlist('leave_ids'), request.POST.get('decision')
+        try:
+            leave_ids = [int(i) for i in leave_ids]
+        except (TypeError, ValueError):
+            raise ValueError('أرقام الطلبات غير صالحة.')
+        results = decide_leaves(leave_ids, decision, request.user)
+    except (ValueError, AttributeError) as e:
+        if is_json:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        messages.error(request, str(e))
+        return redirect('manage_leaves')
+
+    done = sum(1 for r in results.values() if r == decision)
+    if is_json:
+        return JsonResponse({'status': 'success', 'updated': done, 'results': {str(k): v for k, v in results.items()}})
+    messages.success(request, f'تم تحديث {done} من {len(results)} طلب.')
+    conflicts = sum(1 for r in results.values() if r == 'conflict')
+    if conflicts:
+        messages.error(request, f'لم يتم قبول {conflicts} طلب لوجود إجازة مقبولة متداخلة.')
+    return redirect('manage_leaves')
+
+
 # ----------------------------
 # Payroll & Evaluations
 # ----------------------------
@@ -499,7 +804,7 @@ def reject_leave(request, leave_id):
 @user_passes_test(lambda u: is_hr_manager(u) or is_finance(u))
 def manage_payroll(request):
     payrolls = Payroll.objects.select_related('employee__user').all()
-    return render(request, 'manage_payroll.html', {'payrolls': payrolls})
+    return render(request, 'manage_payroll.html', {'payrolls': payrolls, 'departments': Profile.DEPARTMENTS})
 
 
 @login_required
@@ -538,10 +843,11 @@ def add_payroll(request):
 
         try:
             emp_id = request.POST.get('employee')
-            # أضفت هنا معالجة للشهر والسنة لأنهما غير موجودين في الفورم حاليا
-            # يمكنك إضافتهما للفورم أو استخدام القيمة الحالية كافتراضي
-            month = timezone.now().month
-            year = timezone.now().year
+            # الشهر والسنة اختياريان في الفورم، والقيمة الافتراضية هي الشهر الحالي
+            year, month = validate_period(
+                request.POST.get('year') or timezone.now().year,
+                request.POST.get('month') or timezone.now().month,
+            )
 
             base_salary = to_decimal(request.POST.get('base_salary'))
             bonuses = to_decimal(request.POST.get('bonuses'))
@@ -553,12 +859,12 @@ def add_payroll(request):
 
             employee_profile = get_object_or_404(Profile, id=emp_id)
 
-            # --- منع إضافة راتب لموظف لديه راتب بالفعل ---
-            if Payroll.objects.filter(employee=employee_profile).exists():
+            # --- منع إضافة راتب لموظف لديه راتب بالفعل لنفس الشهر ---
+            if Payroll.objects.filter(employee=employee_profile, year=year, month=month).exists():
                  if is_ajax:
-                    return JsonResponse({'status': 'error', 'message': 'هذا الموظف لديه راتب مسجل بالفعل.'}, status=400)
+                    return JsonResponse({'status': 'error', 'message': 'هذا الموظف لديه راتب مسجل بالفعل لهذا الشهر.'}, status=400)
                  else:
-                    messages.error(request, 'هذا الموظف لديه راتب مسجل بالفعل.')
+                    messages.error(request, 'هذا الموظف لديه راتب مسجل بالفعل لهذا الشهر.')
                     return redirect('add_payroll')
 
 
@@ -589,9 +895,129 @@ def add_payroll(request):
                 messages.error(request, f'حدث خطأ: {str(e)}')
                 return redirect('add_payroll')
 
-    # هذا الجزء يبقى كما هو: جلب الموظفين الذين ليس لديهم راتب
-    employees_with_no_payroll = Profile.objects.select_related('user').filter(payroll__isnull=True, user__is_superuser=False)
-    return render(request, 'add_payroll.html', {'employees': employees_with_no_payroll})
+    # جلب الموظفين الذين ليس لديهم راتب للشهر الحالي
+    now = timezone.now()
+    employees_with_no_payroll = (
+        Profile.objects.select_related('user')
+        .filter(user__is_superuser=False)
+        .exclude(id__in=Payroll.objects.filter(year=now.year, month=now.month).values('employee_id'))
+    )
+    return render(request, 'add_payroll.html', {
+        'employees': employees_with_no_payroll,
+        'current_year': now.year,
+        'current_month': now.month,
+    })
+
+
+@login_required
+@user_passes_test(lambda u: is_hr_manager(u) or is_finance(u))
+def payroll_run(request):
+    """تشغيل مسير الرواتب لكل الموظفين المستحقين لشهر محدد دفعة واحدة."""
+    if request.method == 'POST':
+        try:
+            run = run_monthly_payroll(request.POST.get('year'), request.POST.get('month'), run_by=request.user)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('payroll_run')
+        messages.success(
+            request,
+            f'تم تشغيل مسير رواتب {run.month}/{run.year}: أضيف {run.created_count} راتب، '
+            f'وتم تخطي {run.skipped_count} موجود مسبقاً خلال {run.duration_ms} ms.'
+        )
+        if run.missing_usernames:
+            # نعرض أول 20 اسماً فقط حتى تبقى الرسالة قصيرة
+            names = '، '.join(run.missing_usernames[:20])
+            if len(run.missing_usernames) > 20:
+                names += ' ...'
+            messages.warning(
+                request,
+                f'لم يُنشأ راتب لـ {run.missing_salary_count} موظف بدون راتب أساسي سابق (موظفون جدد): {names}. '
+                'أضف أول راتب لهم يدوياً أو عبر الاستيراد.'
+            )
+        return redirect('payroll_run')
+
+    now = timezone.now()
+    runs = PayrollRun.objects.select_related('run_by').order_by('-started_at')[:10]
+    return render(request, 'payroll_run.html', {
+        'runs': runs,
+        'current_year': now.year,
+        'current_month': now.month,
+        'departments': Profile.DEPARTMENTS,
+    })
+
+
+@login_required
+@user_passes_test(lambda u: is_hr_manager(u) or is_finance(u))
+def adjust_payroll_salaries(request):
+    """تعديل جماعي للرواتب (نسبة أو مبلغ) لقسم أو شهر محدد بأمر UPDATE واحد."""
+    if request.method != 'POST':
+        return redirect('payroll_run')
+    try:
+        year, month = request.POST.get('year') or None, request.POST.get('month') or None
+        if year or month:
+            year, month = validate_period(year, month)
+        updated = adjust_salaries(
+            field=request.POST.get('field', 'base_salary'),
+            percent=request.POST.get('percent'),
+            amount=request.POST.get('amount'),
+            year=year,
+            month=month,
+            department=request.POST.get('department') or None,
+            all_periods=request.POST.get('all_periods') == '1',
+        )
+    except ValueError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'تم تعديل {updated} راتب.')
+    return redirect('payroll_run')
+
+
+@login_required
+@user_passes_test(lambda u: is_hr_manager(u) or is_finance(u))
+def import_payroll(request):
+    """استيراد الرواتب من ملف CSV أو XLSX وعرض تقرير بالأخطاء لكل سطر."""
+    report = None
+    if request.method == 'POST':
+        uploaded = request.FILES.get('file')
+        if not uploaded:
+            messages.error(request, 'الرجاء اختيار ملف للاستيراد.')
+            return redirect('import_payroll')
+        try:
+            report = import_payroll_file(uploaded, uploaded.name)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('import_payroll')
+        # نعرض أول 500 خطأ فقط حتى لا تصبح الصفحة ضخمة
+        report['shown_errors'] = report['errors'][:500]
+    return render(request, 'import_payroll.html', {'report': report})
+
+
+@login_required
+@user_passes_test(lambda u: is_hr_manager(u) or is_finance(u))
+def simulate_payroll(request):
+    """
+    معاينة أثر قواعد الزيادة أو الخصم على صافي الرواتب دون حفظ أي تغيير.
+
+    يستقبل JSON بالشكل: {"year": 2025, "month": 1, "rules": [{"department": "IT", "field": "base_salary", "percent": 7}]}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    try:
+        payload = json.loads(request.body or b'{}')
+        if not isinstance(payload, dict):
+            raise ValueError('يجب إرسال كائن JSON يحتوي على rules.')
+        year, month = payload.get('year'), payload.get('month')
+        if year is not None or month is not None:
+            year, month = validate_period(year, month)
+        snapshot = get_snapshot(year, month)
+        rules = validate_rules(payload.get('rules'), departments=set(snapshot.departments))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    result = simulate(snapshot, rules)
+    return JsonResponse({'status': 'success', **result})
+
+
 @login_required
 @user_passes_test(is_hr_manager)
 def manage_evaluations(request):
@@ -602,31 +1028,42 @@ def manage_evaluations(request):
 @login_required
 @user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
 def export_payroll(request):
-    """Export payrolls as CSV for finance/HR."""
-    payrolls = Payroll.objects.select_related('employee__user').all().order_by('year', 'month')
-    # Create the HttpResponse object with the appropriate CSV header.
-    # Use UTF-8 with BOM so Excel on Windows opens Arabic text correctly.
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    """
+    Export payrolls as CSV for finance/HR.
+
+    The file is streamed row by row, and can be narrowed with the optional
+    `year`, `month` and `department` query parameters.
+    """
+    year = request.GET.get('year')
+    month = request.GET.get('month')
+    department = request.GET.get('department')
+    try:
+        if year:
+            year = int(year)
+        if month:
+            month = int(month)
+    except ValueError:
+        messages.error(request, 'السنة والشهر يجب أن تكون أرقاماً صحيحة.')
+        return redirect('manage_payroll')
+
+    class Echo:
+        """كائن يشبه الملف: csv.writer يكتب فيه ونعيد السطر مباشرة بدلاً من تخزينه."""
+        def write(self, value):
+            return value
+
+    writer = csv.writer(Echo())
+
+    def stream():
+        # Write UTF-8 BOM at the start so Excel on Windows opens Arabic text correctly
+        yield '\ufeff'
+        # Header (Arabic)
+        yield writer.writerow(['الموظف', 'السنة', 'الشهر', 'الراتب الأساسي', 'العلاوات', 'الخصومات', 'الصافي', 'ملاحظات'])
+        for row in iter_payroll_export_rows(year, month, department):
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
     filename = f'كشوفات_الرواتب_{timezone.now().date()}.csv'
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-    # Write UTF-8 BOM at the start so Excel recognizes UTF-8 encoding
-    response.write('\ufeff')
-
-    writer = csv.writer(response)
-    # Header (Arabic)
-    writer.writerow(['الموظف', 'السنة', 'الشهر', 'الراتب الأساسي', 'العلاوات', 'الخصومات', 'الصافي', 'ملاحظات'])
-    for p in payrolls:
-        writer.writerow([
-            p.employee.user.username,
-            p.year,
-            p.month,
-            str(p.base_salary),
-            str(p.bonuses),
-            str(p.deductions),
-            str(p.net_salary),
-            (p.remarks or '')
-        ])
     return response
 
 
@@ -661,9 +1098,9 @@ def add_evaluation(request): # <-- تم حذف emp_id من هنا
         )
 
         month_name = evaluation_date.strftime("%B %Y")
-        Notification.objects.create(
-            user=employee_profile.user,
-            message=f"لقد تم تقييمك لشهر {month_name} من قبل المدير. يمكنك مراجعة التقييم في لوحة التحكم."
+        notify(
+            [employee_profile.user_id],
+            f"لقد تم تقييمك لشهر {month_name} من قبل المدير. يمكنك مراجعة التقييم في لوحة التحكم."
         )
 
         messages.success(request, f"تم إضافة التقييم للموظف {employee_profile.user.username} بنجاح.")
@@ -679,60 +1116,82 @@ def add_evaluation(request): # <-- تم حذف emp_id من هنا
 
 
 
-# hr_app/views.py
+@login_required
+@user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
+def export_payroll_pdf(request):
+    """
+    تصدير كشوفات الرواتب كملف PDF باستخدام Playwright (الطريقة المضمونة).
 
-# hr_app/views.py
+    إذا لم تتغير بيانات الرواتب منذ آخر تصدير يتم إرسال الملف المحفوظ على القرص مباشرة،
+    وإلا يُضاف التقرير إلى مهام الخلفية وتنتظر الصفحة اكتماله ثم تحمّله، حتى لا يحجز
+    التوليد عامل الويب.
+    """
+    job = enqueue_payroll_report(request.user)
+    if job.status == 'Done':
+        return redirect('payroll_report_job_download', job.id)
+    return render(request, 'payroll_report_wait.html', {'job': job})
 
-# hr_app/views.py
 
-# --- دالة مساعدة جديدة لتشغيل الكود غير المتزامن ---
-# hr_app/views.py
+@login_required
+@user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
+def payroll_report_job_create(request):
+    """إضافة مهمة توليد تقرير PDF في الخلفية وإرجاع رقم المهمة."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    job = enqueue_payroll_report(request.user)
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': reverse('payroll_report_job_status', args=[job.id]),
+    }, status=202)
 
-async def generate_pdf_from_html(html_content, request):
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page()
-        
-        # --- التصحيح هنا ---
-        # 1. نقوم بتعيين محتوى الصفحة أولاً
-        await page.set_content(html_content)
 
-        # 2. ثم ننتظر حتى يتم تحميل كل شيء (مثل الخطوط) من الشبكة
-        await page.wait_for_load_state('networkidle')
-        
-        pdf_bytes = await page.pdf(
-            format='A4',
-            print_background=True,
-            margin={'top': '20mm', 'bottom': '20mm', 'left': '20mm', 'right': '20mm'}
-        )
-        await browser.close()
-        return pdf_bytes
 @login_required
 @user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
-def export_payroll_pdf(request):
-    """
-    تصدير كشوفات الرواتب كملف PDF باستخدام Playwright (الطريقة المضمونة).
-    """
-    payrolls = Payroll.objects.select_related('employee__user').all().order_by('employee__user__username')
-    context = {
-        'payrolls': payrolls,
-        'export_date': timezone.now().strftime('%Y-%m-%d %H:%M'),
-        'request': request # تمرير request مهم لتحميل الملفات الثابتة
-    }
-    
-    # تحويل القالب إلى نص HTML
-    html = render_to_string('payroll_pdf_template.html', context)
-    
-    # تشغيل الدالة غير المتزامنة وانتظار النتيجة
-    pdf_file = asyncio.run(generate_pdf_from_html(html, request))
+def payroll_report_job_status(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id)
+    data = {'job_id': job.id, 'status': job.status}
+    if job.status == 'Done':
+        data['download_url'] = reverse('payroll_report_job_download', args=[job.id])
+    elif job.status == 'Failed':
+        data['error'] = job.error
+    return JsonResponse(data)
 
-    response = HttpResponse(pdf_file, content_type='application/pdf')
-    filename = f'Payroll_Report_{timezone.now().date()}.pdf'
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
+
+@login_required
+@user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
+def payroll_report_job_download(request, job_id):
+    job = get_object_or_404(ReportJob, id=job_id, status='Done')
+    path = cached_report_path(job.content_hash)
+    if not os.path.exists(path):
+        raise Http404('الملف لم يعد موجوداً، يرجى طلب التقرير مرة أخرى.')
+    filename = f'Payroll_Report_{job.finished_at.date()}.pdf'
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
+
+
+@login_required
+@user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
+def export_payslips_zip(request):
+    """تصدير قسيمة راتب PDF لكل موظف في الشهر المحدد داخل ملف ZIP يتم بثه تدريجياً."""
+    try:
+        year, month = validate_period(request.GET.get('year'), request.GET.get('month'))
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect('manage_payroll')
+
+    rows = payslip_rows(year, month, request.GET.get('department'))
+    response = StreamingHttpResponse(stream_payslips_zip(rows), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="Payslips_{year}_{month:02d}.zip"'
     return response
 
 
+@login_required
+@user_passes_test(lambda u: is_finance(u) or is_hr_manager(u))
+def pdf_pool_metrics(request):
+    """مؤشرات مجموعة متصفحات PDF: طول الطابور، زمن التوليد وعدد مرات إعادة التدوير."""
+    return JsonResponse(get_browser_pool().metrics())
+
+
 
 
 
@@ -751,6 +1210,12 @@ def employee_details(request, emp_id):
     # (نجلب آخر 10 سجلات فقط لتجنب إبطاء الصفحة)
     leaves = LeaveRequest.objects.filter(employee=profile).order_by('-start_date')[:10]
     attendances = Attendance.objects.filter(employee=profile).order_by('-date')[:10]
+
+    # ملخص الحضور لآخر 6 أشهر من الجدول المجمع بدلاً من عد سجلات الحضور
+    attendance_summaries = profile.attendance_summaries.order_by('-year', '-month')[:6]
+
+    # رصيد الإجازات للسنة الحالية من دفتر الأرصدة
+    leave_balance = leave_balances(profile.id, timezone.localdate().year)
     
     # جلب آخر راتب مسجل
     payroll = Payroll.objects.filter(employee=profile).order_by('-year', '-month').first()
@@ -762,6 +1227,8 @@ def employee_details(request, emp_id):
         'profile': profile,
         'leaves': leaves,
         'attendances': attendances,
+        'attendance_summaries': attendance_summaries,
+        'leave_balances': leave_balance,
         'payroll': payroll,
         'evaluation': evaluation,
     }
@@ -3,6 +3,10 @@ ASGI config for hr_management project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serving the project through this module (e.g. with uvicorn or daphne) keeps
+the /events/ notification streams open without holding a worker thread each;
+under WSGI the endpoint answers 204 and pages fall back to normal reloads.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -100,6 +100,41 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 
 
+# مجموعة متصفحات Playwright الدائمة لتوليد ملفات PDF
+PDF_POOL_SIZE = int(os.environ.get('PDF_POOL_SIZE', '2'))
+PDF_POOL_MAX_JOBS_PER_BROWSER = int(os.environ.get('PDF_POOL_MAX_JOBS_PER_BROWSER', '100'))
+PDF_POOL_QUEUE_SIZE = int(os.environ.get('PDF_POOL_QUEUE_SIZE', '20'))
+PDF_POOL_JOB_TIMEOUT = int(os.environ.get('PDF_POOL_JOB_TIMEOUT', '30'))
+
+# مهام التقارير في الخلفية وذاكرة التخزين المؤقت لملفات PDF على القرص
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '2'))
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', os.path.join(MEDIA_ROOT, 'reports'))
+REPORT_CACHE_MAX_FILES = int(os.environ.get('REPORT_CACHE_MAX_FILES', '20'))
+# المهمة المعلقة أو الجارية أطول من هذه المدة تعتبر متوقفة ويُعاد إنشاؤها
+REPORT_JOB_STALE_SECONDS = int(os.environ.get('REPORT_JOB_STALE_SECONDS', '600'))
+
+# رمز أجهزة الحضور لواجهة رفع البصمات دفعة واحدة (تُعطل الواجهة إذا كان فارغاً)
+ATTENDANCE_TERMINAL_TOKEN = os.environ.get('ATTENDANCE_TERMINAL_TOKEN', '')
+
+# سجلات الحضور الأقدم من هذا العدد من الأيام تُنقل إلى جدول الأرشيف
+ATTENDANCE_ARCHIVE_AFTER_DAYS = int(os.environ.get('ATTENDANCE_ARCHIVE_AFTER_DAYS', '365'))
+
+# وقت الدخول الذي يُعتبر بعده الموظف متأخراً عند إعادة حساب حالة الحضور
+ATTENDANCE_LATE_AFTER = os.environ.get('ATTENDANCE_LATE_AFTER', '09:00')
+
+# رصيد الإجازات السنوي لكل نوع (بالأيام)
+LEAVE_ENTITLEMENTS = {
+    'Annual': int(os.environ.get('LEAVE_ANNUAL_DAYS', '21')),
+    'Sick': int(os.environ.get('LEAVE_SICK_DAYS', '14')),
+    'Emergency': int(os.environ.get('LEAVE_EMERGENCY_DAYS', '3')),
+}
+
+# دفع الإشعارات لحظياً (SSE): الوسيط داخل العملية افتراضياً، ويمكن استبداله بوسيط مشترك
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'hr_app.events.InProcessBroker')
+EVENT_STREAM_QUEUE_SIZE = int(os.environ.get('EVENT_STREAM_QUEUE_SIZE', '100'))
+EVENT_STREAM_HEARTBEAT = int(os.environ.get('EVENT_STREAM_HEARTBEAT', '20'))
+EVENT_STREAM_MAX_AGE = int(os.environ.get('EVENT_STREAM_MAX_AGE', '300'))
+
 # ... بعد آخر سطر في الملف
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STORAGES = {